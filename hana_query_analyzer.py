@@ -1,30 +1,982 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, scrolledtext
+import tkinter.font as tkfont
 import os
 from datetime import datetime
-from pygments import lex
 from pygments.lexers.sql import SqlLexer
 from pygments.token import Token
 import time
 import pandas as pd
 import threading
-import queue
-from utils import HANAUtils
+import itertools
+from utils import (ResultStore, ColumnBatch, LobHandler, ConnectionPool, ParameterSweep, ExportJobManager,
+                   QuerySession, ConnectionKeepalive, QueryHistory, build_pushdown_query, bind_placeholders, parse_parameter_sets,
+                   is_read_only_query)
 import re
 
+class VirtualGrid:
+    """Treeview虚拟滚动表格：只保留可见窗口加少量缓冲的真实行，滚动时重新绑定行数据"""
+
+    def __init__(self, tree, vsb, buffer_rows=5):
+        self.tree = tree
+        self.vsb = vsb
+        self.buffer_rows = buffer_rows
+        self.rows = []  # 数据源，只要求支持len()和切片
+        self.top = 0  # 可见窗口第一行在数据源中的位置
+        self.selected = set()  # 选中行在数据源中的位置
+        self.all_selected = False
+        self.anchor = None  # Shift多选的起点
+        self.cursor = None  # 键盘导航的当前行
+        self._items = []  # 复用的真实Treeview行
+        self._item_index = {}  # 真实行ID -> 在窗口中的偏移
+        self._visible_rows = int(tree["height"])
+        self._render_after_id = None
+        self.on_need_more = None  # 用户滚动到已加载数据末尾时的回调
+
+        # 竖向滚动条由本类接管，Treeview自身始终停留在顶部
+        self.vsb.configure(command=self.yview)
+        self.tree.configure(yscrollcommand=lambda *args: None)
+
+        self.tree.bind("<Configure>", self._on_configure, add="+")
+        self.tree.bind("<MouseWheel>", self._on_mousewheel)
+        self.tree.bind("<Button-4>", lambda e: self.scroll(-3))  # Linux滚轮
+        self.tree.bind("<Button-5>", lambda e: self.scroll(3))
+        self.tree.bind("<Button-1>", lambda e: self._on_click(e))
+        self.tree.bind("<Control-Button-1>", lambda e: self._on_click(e, toggle=True))
+        self.tree.bind("<Shift-Button-1>", lambda e: self._on_click(e, extend=True))
+        self.tree.bind("<Up>", lambda e: self.move_cursor(-1))
+        self.tree.bind("<Down>", lambda e: self.move_cursor(1))
+        self.tree.bind("<Prior>", lambda e: self.move_cursor(-self._visible_rows))
+        self.tree.bind("<Next>", lambda e: self.move_cursor(self._visible_rows))
+        self.tree.bind("<Home>", lambda e: self.move_cursor(-len(self.rows)))
+        self.tree.bind("<End>", lambda e: self.move_cursor(len(self.rows)))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def set_rows(self, rows):
+        """替换数据源并回到顶部"""
+        self.rows = rows
+        self.top = 0
+        self.clear_selection()
+        self.render()
+
+    def clear(self):
+        """清空数据和真实行"""
+        self.rows = []
+        self.top = 0
+        self.clear_selection()
+        for iid in self._items:
+            self.tree.delete(iid)
+        self._items = []
+        self._item_index = {}
+        self._update_scrollbar()
+
+    def refresh(self):
+        """数据源内容变化后重新绑定当前窗口"""
+        self.render()
+
+    def clear_selection(self):
+        self.selected = set()
+        self.all_selected = False
+        self.anchor = None
+        self.cursor = None
+
+    def select_all(self):
+        self.all_selected = True
+        self.selected = set()
+        self.render()
+        return "break"
+
+    def is_selected(self, pos):
+        return self.all_selected or pos in self.selected
+
+    def selected_positions(self):
+        """按显示顺序返回选中行在数据源中的位置"""
+        if self.all_selected:
+            return range(len(self.rows))
+        return sorted(pos for pos in self.selected if pos < len(self.rows))
+
+    def position_of(self, iid):
+        """真实行ID对应的数据源位置"""
+        offset = self._item_index.get(iid)
+        if offset is None:
+            return None
+        return self.top + offset
+
+    def render(self):
+        """把数据源的可见窗口绑定到真实行上，开销只与窗口大小相关"""
+        self._render_after_id = None
+        total = len(self.rows)
+        self.top = max(0, min(self.top, total - self._visible_rows))
+
+        # 调整真实行数量：可见行 + 缓冲，且不超过剩余数据
+        needed = max(0, min(self._visible_rows + self.buffer_rows, total - self.top))
+        while len(self._items) < needed:
+            self._items.append(self.tree.insert("", "end"))
+        while len(self._items) > needed:
+            self.tree.delete(self._items.pop())
+        self._item_index = {iid: offset for offset, iid in enumerate(self._items)}
+
+        window = self.rows[self.top:self.top + needed]
+        selection = []
+        for offset, (iid, values) in enumerate(zip(self._items, window)):
+            pos = self.top + offset
+            tag = 'evenrow' if pos % 2 == 0 else 'oddrow'
+            self.tree.item(iid, values=values, tags=(tag,))
+            if self.is_selected(pos):
+                selection.append(iid)
+        self.tree.selection_set(selection)
+        if self._items:
+            self.tree.yview_moveto(0)
+        self._update_scrollbar()
+
+    def schedule_render(self):
+        """合并短时间内的多次重绘请求"""
+        if self._render_after_id is None:
+            self._render_after_id = self.tree.after_idle(self.render)
+
+    def _update_scrollbar(self):
+        total = len(self.rows)
+        if total <= self._visible_rows:
+            self.vsb.set(0, 1)
+        else:
+            self.vsb.set(self.top / total, min(1.0, (self.top + self._visible_rows) / total))
+
+    def _check_need_more(self):
+        """用户滚动到已加载数据末尾附近时请求更多数据"""
+        if self.on_need_more and len(self.rows) and self.top + self._visible_rows + self.buffer_rows >= len(self.rows):
+            self.on_need_more()
+
+    def yview(self, *args):
+        """竖向滚动条命令"""
+        total = len(self.rows)
+        if not args or not total:
+            return
+        if args[0] == 'moveto':
+            self.top = int(float(args[1]) * total)
+        elif args[0] == 'scroll':
+            step = int(args[1])
+            if args[2] == 'pages':
+                step *= self._visible_rows
+            self.top += step
+        self.render()
+        self._check_need_more()
+
+    def scroll(self, rows):
+        self.top += rows
+        self.render()
+        if rows > 0:
+            self._check_need_more()
+        return "break"
+
+    def see(self, pos):
+        """滚动使指定行可见"""
+        if pos < self.top:
+            self.top = pos
+        elif pos >= self.top + self._visible_rows:
+            self.top = pos - self._visible_rows + 1
+
+    def move_cursor(self, step):
+        """键盘移动当前行"""
+        total = len(self.rows)
+        if not total:
+            return "break"
+        current = self.cursor if self.cursor is not None else self.top - (1 if step > 0 else 0)
+        self.cursor = max(0, min(total - 1, current + step))
+        self.anchor = self.cursor
+        self.selected = {self.cursor}
+        self.all_selected = False
+        self.see(self.cursor)
+        self.render()
+        if step > 0:
+            self._check_need_more()
+        return "break"
+
+    def _on_mousewheel(self, event):
+        # Windows下每格滚轮为120，滚动3行
+        return self.scroll(-3 * (event.delta // 120) if abs(event.delta) >= 120 else -event.delta)
+
+    def _on_click(self, event, toggle=False, extend=False):
+        # 表头区域交给Treeview处理（排序、调整列宽）
+        if self.tree.identify_region(event.x, event.y) not in ("cell", "tree"):
+            return None
+        pos = self.position_of(self.tree.identify_row(event.y))
+        if pos is None:
+            return "break"
+        self.tree.focus_set()
+
+        if extend and self.anchor is not None:
+            start, end = sorted((self.anchor, pos))
+            self.selected = set(range(start, end + 1))
+            self.all_selected = False
+        elif toggle:
+            if self.all_selected:
+                self.selected = set(range(len(self.rows)))
+                self.all_selected = False
+            self.selected ^= {pos}
+            self.anchor = pos
+        else:
+            self.selected = {pos}
+            self.all_selected = False
+            self.anchor = pos
+        self.cursor = pos
+        self.render()
+        return "break"
+
+    def _on_configure(self, event):
+        # 根据控件高度计算可见行数
+        try:
+            row_height = int(ttk.Style().lookup('Treeview', 'rowheight') or 25)
+        except (ValueError, tk.TclError):
+            row_height = 25
+        header_height = row_height
+        if self._items:
+            bbox = self.tree.bbox(self._items[0])
+            if bbox:
+                header_height = bbox[1]
+        visible = max(1, (event.height - header_height) // row_height)
+        if visible != self._visible_rows:
+            self._visible_rows = visible
+            self.schedule_render()
+
+class PreviewCursor:
+    """标签页保留的预览游标，预览达到上限后可从这里继续获取"""
+
+    def __init__(self, cursor, columns, release=None):
+        self.cursor = cursor
+        self.columns = columns
+        self.release = release  # 游标来自预编译语句缓存时，关闭改为归还
+        self.lobs = LobHandler.from_cursor(cursor)  # 预览中的LOB只读取开头部分
+        self.pending = []  # 探测是否还有数据时多取出的行
+        self.fetched = 0
+        self.exhausted = False
+        self.complete = False  # 已读到结果集末尾，已获取的行即完整结果（提前关闭的游标不算）
+        self.closed = False
+        self.last_used = time.time()
+
+    def idle_seconds(self):
+        return time.time() - self.last_used
+
+    def fetch(self, size):
+        """获取下一批数据，优先返回之前多取出的行"""
+        rows = self.pending[:size]
+        self.pending = self.pending[size:]
+        if len(rows) < size and not self.exhausted:
+            more = self.cursor.fetchmany(size - len(rows))
+            if not more:
+                self.exhausted = self.complete = True
+            rows.extend(self.lobs.apply(more) if self.lobs else more)
+        self.fetched += len(rows)
+        self.last_used = time.time()
+        return rows
+
+    def has_more(self):
+        """探测游标中是否还有数据"""
+        if not self.pending and not self.exhausted:
+            self.pending = self.cursor.fetchmany(1)
+            if self.lobs:
+                self.pending = self.lobs.apply(self.pending)
+            if not self.pending:
+                self.exhausted = self.complete = True
+        return bool(self.pending)
+
+    def close(self):
+        self.closed = True
+        self.exhausted = True
+        self.pending = []
+        try:
+            if self.release is not None:
+                self.release()
+                self.release = None
+            else:
+                self.cursor.close()
+        except Exception:
+            pass
+
+class JobChannel:
+    """单个后台任务的消息通道，put接口与queue.Queue一致，可直接替代队列传给导出器"""
+
+    def __init__(self, dispatcher, job_id):
+        self.dispatcher = dispatcher
+        self.job_id = job_id
+
+    def put(self, message):
+        self.dispatcher.post(self.job_id, message)
+
+class UiDispatcher:
+    """后台线程到界面线程的统一消息分发
+
+    消息按任务ID分组排队，有消息时才唤醒Tk事件循环；同一帧内到达的消息
+    合并后交给任务的处理函数一次处理，进度消息只保留最后一条。
+    任务收到("done", ...)后自动注销。
+    """
+
+    # 后到的消息会覆盖先到的消息类型，同一批中只保留最后一条
+    COALESCE_KINDS = ("progress",)
+
+    def __init__(self, root, frame_ms=16):
+        self.root = root
+        self.frame_ms = frame_ms
+        self._lock = threading.Lock()
+        self._handlers = {}
+        self._pending = {}
+        self._next_id = 0
+        self._scheduled = False
+        self._after_id = None
+        self._last_flush = 0.0
+        # 非线程化的Tcl不能从其他线程生成事件，退化为有任务时按帧检查
+        try:
+            self._threaded = bool(int(root.tk.eval('set tcl_platform(threaded)')))
+        except (tk.TclError, ValueError):
+            self._threaded = False
+        root.bind('<<UiDispatch>>', self._on_wake)
+
+    def open(self, handler):
+        """注册任务并返回其消息通道，handler(messages)在界面线程中调用"""
+        with self._lock:
+            self._next_id += 1
+            job_id = self._next_id
+            self._handlers[job_id] = handler
+        if not self._threaded and self._after_id is None:
+            self._after_id = self.root.after(self.frame_ms, self.flush)
+        return JobChannel(self, job_id)
+
+    def close(self, job_id):
+        """注销任务，丢弃尚未处理的消息"""
+        with self._lock:
+            self._handlers.pop(job_id, None)
+            self._pending.pop(job_id, None)
+
+    def post(self, job_id, message):
+        """后台线程投递消息，本帧第一条消息负责唤醒界面线程"""
+        with self._lock:
+            if job_id not in self._handlers:
+                return
+            self._pending.setdefault(job_id, []).append(message)
+            if self._scheduled or not self._threaded:
+                return
+            self._scheduled = True
+        try:
+            self.root.event_generate('<<UiDispatch>>', when='tail')
+        except (RuntimeError, tk.TclError):
+            # 窗口已关闭
+            pass
+
+    def _on_wake(self, event=None):
+        if self._after_id is not None:
+            return
+        # 距上次刷新不足一帧时推迟到下一帧，期间到达的消息一并处理
+        delay = self.frame_ms - int((time.perf_counter() - self._last_flush) * 1000)
+        if delay > 0:
+            self._after_id = self.root.after(delay, self.flush)
+        else:
+            self.flush()
+
+    def flush(self):
+        """在界面线程中处理所有排队的消息"""
+        self._after_id = None
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._scheduled = False
+        self._last_flush = time.perf_counter()
+        for job_id, messages in pending.items():
+            handler = self._handlers.get(job_id)
+            if handler is None:
+                continue
+            try:
+                handler(self._coalesce(messages))
+            finally:
+                if any(kind == "done" for kind, _ in messages):
+                    self.close(job_id)
+        if not self._threaded and self._handlers:
+            self._after_id = self.root.after(self.frame_ms, self.flush)
+
+    def _coalesce(self, messages):
+        last = {kind: i for i, (kind, _) in enumerate(messages) if kind in self.COALESCE_KINDS}
+        return [message for i, message in enumerate(messages)
+                if message[0] not in last or last[message[0]] == i]
+
+class SqlHighlighter:
+    """SQL编辑器的增量语法高亮
+
+    记录每行开始时的词法状态（是否处于跨行的字符串或多行注释中，以及注释嵌套层数）。文本变化后只从
+    变化行之前最近的"干净"行开始重新分析，直到某行的开始状态与上次分析结果一致为止；
+    标记按记号的精确位置添加，每次处理不超过时间预算，剩余部分在下一个空闲周期继续。
+    未闭合的引号会在后面出现引号时变成字符串的开头，因此编辑位置之前若有未闭合的引号，
+    从该行开始重新分析。
+    """
+
+    STRING_TAG = "quoted_string"
+    _UNKNOWN = object()  # 文本已变化、尚未重新分析的行
+
+    def __init__(self, text, color_for, time_budget=0.02, delay=30):
+        self.text = text
+        self.color_for = color_for
+        self.time_budget = time_budget
+        self.delay = delay
+        self.lexer = SqlLexer()
+        self.lines = []  # 上次登记的文本行
+        self.states = []  # 每行开始时的词法状态，None表示不在跨行记号中
+        self.dangling = set()  # 含有未闭合引号的行
+        self.tags = set()
+        self._tag_of = {}  # 记号类型 -> 标记名（None表示不着色）
+        self._after_id = None
+        self._job = None  # 进行中的分析
+
+    def schedule(self):
+        """文本变化后调用，短暂防抖后开始分析"""
+        if self._after_id:
+            self.text.after_cancel(self._after_id)
+        self._after_id = self.text.after(self.delay, self._run)
+
+    def clear(self):
+        """取消分析并清除所有高亮标记"""
+        if self._after_id:
+            self.text.after_cancel(self._after_id)
+            self._after_id = None
+        self._job = None
+        self.lines = []
+        self.states = []
+        self.dangling = set()
+        for tag in self.tags:
+            self.text.tag_remove(tag, "1.0", tk.END)
+
+    def _run(self):
+        self._after_id = None
+        try:
+            self._register_edit()
+            if self._job is not None:
+                self._process()
+        except tk.TclError:
+            # 控件已销毁
+            self._job = None
+
+    def _register_edit(self):
+        """对比上次登记的文本行，确定需要重新分析的范围"""
+        new_lines = self.text.get("1.0", "end-1c").split("\n")
+        old_lines = self.lines
+        if new_lines == old_lines:
+            return
+        n_old, n_new = len(old_lines), len(new_lines)
+        limit = min(n_old, n_new)
+        prefix = 0
+        while prefix < limit and old_lines[prefix] == new_lines[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < limit - prefix and old_lines[n_old - 1 - suffix] == new_lines[n_new - 1 - suffix]:
+            suffix += 1
+
+        # 从变化行（或上次未完成的位置）往前找最近一个不在跨行记号中的行重新开始
+        first_changed, end_changed = self._edited_range(old_lines, new_lines, prefix, suffix)
+        start = max(min(first_changed, n_old - 1, n_new - 1), 0)
+        if self._job is not None:
+            # 上次的分析尚未完成，其当前位置和原定的收敛下限之前都不能判断收敛
+            start = min(start, self._job['line'])
+            for line in (self._job['line'] + 1, self._job['min_end']):
+                if line > n_old - suffix:
+                    line += n_new - n_old
+                end_changed = max(end_changed, min(line, n_new))
+        start = min([start] + [line for line in self.dangling if line < start])
+        while start > 0 and self.states[start] is not None:
+            start -= 1
+
+        changed = [self._UNKNOWN] * (n_new - suffix - prefix)
+        self.states = self.states[:prefix] + changed + self.states[n_old - suffix:]
+        self.states[start] = None
+        self.dangling = ({line for line in self.dangling if line < start} |
+                         {line + n_new - n_old for line in self.dangling if line >= n_old - suffix})
+        self.lines = new_lines
+        self._job = {
+            'tokens': self.lexer.get_tokens_unprocessed("\n".join(new_lines[start:])),
+            'line': start,
+            'col': 0,
+            'depth': 0,  # 多行注释的嵌套层数
+            'min_end': end_changed,  # 至少分析到变化范围之后才能判断是否收敛
+        }
+
+    @staticmethod
+    def _slide(text, start, end):
+        """文本块text[start:end]在不改变整体文本的前提下能向左、向右移动的字符数"""
+        if start == end:
+            return 0, 0
+        left = 0
+        while start - left > 0 and text[start - 1 - left] == text[end - 1 - left]:
+            left += 1
+        right = 0
+        while end + right < len(text) and text[start + right] == text[end + right]:
+            right += 1
+        return left, right
+
+    def _edited_range(self, old_lines, new_lines, prefix, suffix, window_lines=64):
+        """逐行对比得到的变化范围不一定是实际编辑的位置：插入或删除的文本与相邻内容相同时
+        （例如在重复的内容旁粘贴），编辑可能发生在更靠前或更靠后的行上，这些行的文本虽然
+        相同，字符上的标记却来自别处。向两侧滑动找出可能受影响的行范围[起始行, 结束行)"""
+        n_old, n_new = len(old_lines), len(new_lines)
+        # 每行带上换行符比较，整行插入或删除时换行符也属于编辑的文本
+        old_seg = "".join(line + "\n" for line in old_lines[prefix:n_old - suffix])
+        new_seg = "".join(line + "\n" for line in new_lines[prefix:n_new - suffix])
+        limit = min(len(old_seg), len(new_seg))
+        head = 0
+        while head < limit and old_seg[head] == new_seg[head]:
+            head += 1
+        tail = 0
+        while tail < limit - head and old_seg[-1 - tail] == new_seg[-1 - tail]:
+            tail += 1
+
+        first = max(prefix - window_lines, 0)
+        before = "".join(line + "\n" for line in new_lines[first:prefix])
+        old_window = before + old_seg + "".join(line + "\n" for line in old_lines[n_old - suffix:n_old - suffix + window_lines])
+        new_window = before + new_seg + "".join(line + "\n" for line in new_lines[n_new - suffix:n_new - suffix + window_lines])
+        block_start = len(before) + head
+        old_left, old_right = self._slide(old_window, block_start, len(before) + len(old_seg) - tail)
+        new_left, new_right = self._slide(new_window, block_start, len(before) + len(new_seg) - tail)
+        start_char = block_start - max(old_left, new_left)
+        end_char = len(before) + len(new_seg) - tail + max(old_right, new_right)
+        if end_char <= start_char:
+            return prefix, n_new - suffix
+
+        if start_char == 0 and first > 0:
+            start_line = 0
+        else:
+            start_line = first + new_window.count("\n", 0, start_char)
+        if end_char >= len(new_window) - 1 or end_char + len(old_window) - len(new_window) >= len(old_window) - 1:
+            # 滑动到了比较窗口的末尾，保守地分析到文本末尾
+            end_line = n_new
+        else:
+            end_line = first + new_window.count("\n", 0, end_char - 1) + 1
+        return min(start_line, prefix), max(end_line, n_new - suffix)
+
+    def _tag_for(self, ttype):
+        tag = self._tag_of.get(ttype, self._UNKNOWN)
+        if tag is self._UNKNOWN:
+            if ttype in Token.Literal.String:
+                tag = self.STRING_TAG
+                self.text.tag_config(tag, foreground="blue")
+            else:
+                color = self.color_for(ttype)
+                tag = str(ttype) if color != "black" else None
+                if tag is not None:
+                    # 为关键字配置粗体
+                    if ttype is Token.Keyword:
+                        self.text.tag_config(tag, foreground=color, font=('TkDefaultFont', 10, 'bold'))
+                    else:
+                        self.text.tag_config(tag, foreground=color)
+            if tag is not None:
+                self.tags.add(tag)
+            self._tag_of[ttype] = tag
+        return tag
+
+    def _process(self):
+        """在时间预算内消费记号并按精确位置打标记"""
+        job = self._job
+        deadline = time.perf_counter() + self.time_budget
+        line, col, depth = job['line'], job['col'], job['depth']
+        start_index = f"{line + 1}.{col}"
+        ranges = {}
+        finished = True
+        converged = False
+        count = 0
+
+        for _, ttype, value in job['tokens']:
+            tag = self._tag_for(ttype)
+            if ttype is Token.Error and value in ("'", '"'):
+                self.dangling.add(line)
+            elif ttype is Token.Comment.Multiline:
+                if value == "/*":
+                    depth += 1
+                elif value == "*/":
+                    depth -= 1
+            token_start = f"{line + 1}.{col}"
+            newlines = value.count("\n")
+            if newlines == 0:
+                col += len(value)
+            else:
+                # 跨行记号：逐个换行记录下一行的开始状态，并检查是否已与上次一致
+                if ttype in Token.Literal.String:
+                    carries = ttype
+                elif ttype in Token.Comment.Multiline:
+                    carries = (ttype, depth)
+                else:
+                    carries = None
+                pos = -1
+                for _ in range(newlines):
+                    pos = value.index("\n", pos + 1)
+                    line += 1
+                    col = 0
+                    state = carries
+                    if line >= job['min_end'] and self.states[line] is not self._UNKNOWN and self.states[line] == state:
+                        converged = True
+                        break
+                    self.states[line] = state
+                    self.dangling.discard(line)
+                if not converged:
+                    col = len(value) - pos - 1
+            if tag is not None:
+                ranges.setdefault(tag, []).extend((token_start, f"{line + 1}.{col}"))
+            if converged:
+                break
+            count += 1
+            if count % 64 == 0 and time.perf_counter() > deadline:
+                finished = False
+                break
+
+        end_index = f"{line + 1}.{col}" if not finished or converged else tk.END
+        for tag in self.tags:
+            self.text.tag_remove(tag, start_index, end_index)
+        for tag, indices in ranges.items():
+            self.text.tag_add(tag, *indices)
+
+        if finished:
+            self._job = None
+        else:
+            job['line'], job['col'], job['depth'] = line, col, depth
+            self._after_id = self.text.after(1, self._run)
+
+
+class LineNumberGutter(tk.Canvas):
+    """行号栏：只绘制可见行的行号，可见范围或总行数变化时才重绘"""
+
+    def __init__(self, master, text, min_digits=3):
+        super().__init__(master, background='#f0f0f0', highlightthickness=0, takefocus=0, cursor='arrow')
+        self.text = text
+        self.font = tkfont.Font(font=text.cget('font'))
+        self.min_digits = min_digits
+        self._digits = 0
+        self._last_view = None  # (首个可见行, 总行数, 控件高度)
+        self._refresh_pending = False
+        self._set_digits(min_digits)
+
+    def _set_digits(self, digits):
+        self._digits = digits
+        self.configure(width=self.font.measure('0' * digits) + 10)
+
+    def schedule_refresh(self):
+        """合并同一轮事件中的多次刷新请求"""
+        if not self._refresh_pending:
+            self._refresh_pending = True
+            self.after_idle(self.refresh)
+
+    def refresh(self):
+        """按键时调用的开销只与可见行数有关，不读取全文"""
+        self._refresh_pending = False
+        top = int(self.text.index('@0,0').split('.')[0])
+        total = int(self.text.index('end-1c').split('.')[0])
+        view = (top, total, self.text.winfo_height())
+        if view == self._last_view:
+            return
+        self._last_view = view
+
+        digits = max(self.min_digits, len(str(total)))
+        if digits != self._digits:
+            self._set_digits(digits)
+        x = int(self['width']) - 5
+        self.delete('all')
+        for line in range(top, total + 1):
+            dline = self.text.dlineinfo(f'{line}.0')
+            if dline is None:
+                break
+            self.create_text(x, dline[1], anchor='ne', text=str(line), font=self.font, fill='gray')
+
+
+class FilterBar(ttk.Frame):
+    """结果筛选栏：按列条件筛选并在所有列中搜索，条件之间为"且"关系"""
+
+    def __init__(self, master, on_change, search_delay=300, pushdown=False):
+        super().__init__(master)
+        self.on_change = on_change
+        self.search_delay = search_delay
+        self.conditions = []  # (列索引, 运算符, 值)
+        self._columns = []
+        self._search_after_id = None
+
+        ttk.Label(self, text="筛选:").pack(side=tk.LEFT, padx=(5, 2))
+        self.column_box = ttk.Combobox(self, state="readonly", width=18)
+        self.column_box.pack(side=tk.LEFT, padx=2)
+        self.op_box = ttk.Combobox(self, state="readonly", width=5, values=ResultStore.FILTER_OPS)
+        self.op_box.current(0)
+        self.op_box.pack(side=tk.LEFT, padx=2)
+        self.value_entry = ttk.Entry(self, width=16)
+        self.value_entry.pack(side=tk.LEFT, padx=2)
+        self.value_entry.bind("<Return>", lambda e: self.add_condition())
+        ttk.Button(self, text="添加条件", command=self.add_condition).pack(side=tk.LEFT, padx=2)
+        ttk.Button(self, text="清除筛选", command=self.clear).pack(side=tk.LEFT, padx=2)
+        self.conditions_label = ttk.Label(self, foreground="gray")
+        self.conditions_label.pack(side=tk.LEFT, padx=5)
+
+        # 服务器端模式：排序和筛选改写为SQL在HANA上执行，而不是只处理已加载的行
+        self.pushdown_var = tk.BooleanVar(value=pushdown)
+        ttk.Checkbutton(self, text="服务器端排序/筛选", variable=self.pushdown_var,
+                        command=self.on_change).pack(side=tk.RIGHT, padx=5)
+
+        self.search_entry = ttk.Entry(self, width=20)
+        self.search_entry.pack(side=tk.RIGHT, padx=5)
+        self.search_entry.bind("<KeyRelease>", self._on_search_key)
+        ttk.Label(self, text="搜索:").pack(side=tk.RIGHT)
+
+    @property
+    def search_text(self):
+        return self.search_entry.get()
+
+    @property
+    def pushdown_enabled(self):
+        return self.pushdown_var.get()
+
+    def set_columns(self, columns):
+        """新结果集到达时更新列选项并清除旧条件"""
+        self._columns = list(columns)
+        self.column_box.configure(values=self._columns)
+        if self._columns:
+            self.column_box.current(0)
+        self.conditions = []
+        self.search_entry.delete(0, tk.END)
+        self.update_label()
+
+    def add_condition(self):
+        col = self.column_box.get()
+        if col not in self._columns:
+            return
+        self.conditions.append((self._columns.index(col), self.op_box.get(), self.value_entry.get()))
+        self.value_entry.delete(0, tk.END)
+        self.update_label()
+        self.on_change()
+
+    def clear(self):
+        if not self.conditions and not self.search_text:
+            return
+        self.conditions = []
+        self.search_entry.delete(0, tk.END)
+        self.update_label()
+        self.on_change()
+
+    def update_label(self):
+        self.conditions_label.configure(text="  且  ".join(
+            f"{self._columns[c]} {op} {value}".rstrip() for c, op, value in self.conditions))
+
+    def _on_search_key(self, event):
+        # 输入停顿后再搜索，避免每个按键都触发一次筛选
+        if self._search_after_id:
+            self.after_cancel(self._search_after_id)
+        self._search_after_id = self.after(self.search_delay, self._fire_search)
+
+    def _fire_search(self):
+        self._search_after_id = None
+        self.on_change()
+
+
+class SessionBar(ttk.Frame):
+    """标签页会话设置栏：默认schema和事务隔离级别，下一次执行查询时生效"""
+
+    def __init__(self, master, session):
+        super().__init__(master)
+        self.session = session
+
+        ttk.Label(self, text="Schema:").pack(side=tk.LEFT, padx=(5, 2))
+        self.schema_entry = ttk.Entry(self, width=20)
+        self.schema_entry.insert(0, session.schema or "")
+        self.schema_entry.pack(side=tk.LEFT, padx=2)
+        self.schema_entry.bind("<Return>", lambda e: self.apply())
+        self.schema_entry.bind("<FocusOut>", lambda e: self.apply())
+        ttk.Label(self, text="隔离级别:").pack(side=tk.LEFT, padx=(10, 2))
+        self.isolation_box = ttk.Combobox(self, state="readonly", width=16,
+                                          values=("默认",) + QuerySession.ISOLATION_LEVELS)
+        self.isolation_box.set(session.isolation or "默认")
+        self.isolation_box.pack(side=tk.LEFT, padx=2)
+        self.isolation_box.bind("<<ComboboxSelected>>", lambda e: self.apply())
+        self.status_label = ttk.Label(self, foreground="gray")
+        self.status_label.pack(side=tk.LEFT, padx=10)
+        self.refresh()
+
+    def apply(self):
+        isolation = self.isolation_box.get()
+        self.session.configure(isolation=None if isolation == "默认" else isolation,
+                               schema=self.schema_entry.get())
+        self.refresh()
+
+    def refresh(self):
+        session = self.session
+        if session.running:
+            state = "执行中"
+        elif session.is_connected():
+            state = "已连接"
+        else:
+            state = "未连接"
+        settings = [text for text in (session.schema, session.isolation) if text]
+        suffix = f"，{' / '.join(settings)}" if settings else ""
+        self.status_label.configure(text=f"会话：{session.mode}，{state}{suffix}")
+
+class ExportJobPanel(tk.Toplevel):
+    """导出任务列表：每个任务的状态、已导出行数、速度和预计剩余时间，可取消任务"""
+
+    STATUS_TEXT = {'waiting': '排队中', 'connecting': '等待连接', 'running': '导出中', 'done': '已完成', 'failed': '失败', 'cancelled': '已取消'}
+    COLUMNS = (("label", "任务", 220), ("status", "状态", 90), ("rows", "已导出", 130),
+               ("rate", "行/秒", 80), ("eta", "剩余时间", 80), ("output", "输出文件", 320))
+
+    def __init__(self, master, manager, on_cancel):
+        super().__init__(master)
+        self.title("导出任务")
+        self.geometry("960x260")
+        self.manager = manager
+        self.on_cancel = on_cancel
+        # 关闭窗口只隐藏，任务继续运行
+        self.protocol("WM_DELETE_WINDOW", self.withdraw)
+
+        self.tree = ttk.Treeview(self, columns=[key for key, _, _ in self.COLUMNS], show="headings", height=8)
+        for key, text, width in self.COLUMNS:
+            self.tree.heading(key, text=text)
+            self.tree.column(key, width=width, anchor=tk.W if key in ("label", "output") else tk.CENTER)
+        self.tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+
+        button_frame = ttk.Frame(self)
+        button_frame.pack(fill=tk.X, padx=5, pady=(0, 5))
+        ttk.Button(button_frame, text="取消选中任务", command=self.cancel_selected).pack(side=tk.LEFT, padx=2)
+        ttk.Button(button_frame, text="清除已结束", command=self.clear_finished).pack(side=tk.LEFT, padx=2)
+        self.summary_label = ttk.Label(button_frame, foreground="gray")
+        self.summary_label.pack(side=tk.LEFT, padx=10)
+
+    @staticmethod
+    def _format_seconds(seconds):
+        if seconds is None:
+            return "-"
+        seconds = int(seconds)
+        if seconds >= 3600:
+            return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+        return f"{seconds // 60}:{seconds % 60:02d}"
+
+    def _values(self, job):
+        status = self.STATUS_TEXT.get(job.status, job.status)
+        if job.priority:
+            status += "（优先）"
+        rows = f"{job.rows}/{job.total}" if job.total else str(job.rows)
+        rate = f"{job.rows_per_second():.0f}" if job.started is not None else "-"
+        return (job.label, status, rows, rate, self._format_seconds(job.eta_seconds()), job.output or "")
+
+    def refresh(self):
+        """按任务列表更新表格"""
+        shown = set()
+        for job in list(self.manager.jobs):
+            iid = str(job.id)
+            if self.tree.exists(iid):
+                self.tree.item(iid, values=self._values(job))
+            else:
+                self.tree.insert("", tk.END, iid=iid, values=self._values(job))
+            shown.add(iid)
+        for iid in self.tree.get_children():
+            if iid not in shown:
+                self.tree.delete(iid)
+        running = sum(1 for job in self.manager.jobs if job.status in ('connecting', 'running'))
+        waiting = sum(1 for job in self.manager.jobs if job.status == 'waiting')
+        self.summary_label.configure(
+            text=f"运行中 {running} 个 / 排队 {waiting} 个，最多同时运行 {self.manager.concurrency} 个")
+
+    def cancel_selected(self):
+        jobs = {str(job.id): job for job in self.manager.jobs}
+        for iid in self.tree.selection():
+            if iid in jobs:
+                self.on_cancel(jobs[iid])
+
+    def clear_finished(self):
+        self.manager.clear_finished()
+        self.refresh()
+
+class QueryHistoryPanel(tk.Toplevel):
+    """查询历史：按语句文本搜索执行记录，或按平均耗时列出最慢的查询；双击在新标签页中打开语句"""
+
+    HISTORY_COLUMNS = (("executed_at", "时间", 140), ("kind", "类型", 60), ("sql", "SQL", 380),
+                       ("execute", "执行(秒)", 70), ("fetch", "取数(秒)", 70), ("rows", "行数", 80),
+                       ("bytes", "字节", 90), ("rate", "行/秒", 70), ("error", "错误", 200))
+    SLOWEST_COLUMNS = (("avg", "平均(秒)", 70), ("last", "最近(秒)", 70), ("max", "最长(秒)", 70),
+                       ("runs", "次数", 50), ("rows", "平均行数", 80), ("executed_at", "最近执行", 140),
+                       ("sql", "SQL", 560))
+    KIND_TEXT = {'query': '查询', 'export': '导出'}
+
+    def __init__(self, master, history, on_open):
+        super().__init__(master)
+        self.title("查询历史")
+        self.geometry("1200x420")
+        self.history = history
+        self.on_open = on_open
+        self.sql_by_item = {}
+        # 关闭窗口只隐藏，下次打开保留搜索条件
+        self.protocol("WM_DELETE_WINDOW", self.withdraw)
+
+        search_frame = ttk.Frame(self)
+        search_frame.pack(fill=tk.X, padx=5, pady=5)
+        self.search_entry = ttk.Entry(search_frame, width=60)
+        self.search_entry.pack(side=tk.LEFT, padx=2)
+        self.search_entry.bind("<Return>", lambda e: self.search())
+        ttk.Button(search_frame, text="搜索", command=self.search).pack(side=tk.LEFT, padx=2)
+        ttk.Button(search_frame, text="最慢查询", command=self.show_slowest).pack(side=tk.LEFT, padx=2)
+        self.summary_label = ttk.Label(search_frame, foreground="gray")
+        self.summary_label.pack(side=tk.LEFT, padx=10)
+
+        self.tree = ttk.Treeview(self, show="headings", height=16)
+        self.tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=(0, 5))
+        self.tree.bind("<Double-1>", lambda e: self.open_selected())
+
+    def _set_columns(self, columns):
+        self.tree.delete(*self.tree.get_children())
+        self.sql_by_item.clear()
+        self.tree.configure(columns=[key for key, _, _ in columns])
+        for key, text, width in columns:
+            self.tree.heading(key, text=text)
+            self.tree.column(key, width=width, anchor=tk.W if key in ("sql", "error") else tk.CENTER)
+
+    @staticmethod
+    def _number(value, digits=2):
+        return "-" if value is None else f"{value:.{digits}f}"
+
+    @staticmethod
+    def _one_line(sql):
+        return " ".join(sql.split())[:300]
+
+    def search(self):
+        """按输入的词搜索历史，为空时列出最近的记录"""
+        text = self.search_entry.get().strip()
+        self._set_columns(self.HISTORY_COLUMNS)
+        records = self.history.search(text)
+        for record in records:
+            kind = self.KIND_TEXT.get(record['kind'], record['kind'])
+            if record['export_mode']:
+                kind += f"/{record['export_mode']}"
+            item = self.tree.insert("", tk.END, values=(
+                record['executed_at'], kind, self._one_line(record['sql_text']),
+                self._number(record['execute_seconds']), self._number(record['fetch_seconds']),
+                "-" if record['row_count'] is None else record['row_count'],
+                "-" if record['bytes'] is None else record['bytes'],
+                self._number(record['rows_per_second'], 0), record['error'] or ""))
+            self.sql_by_item[item] = record['sql_text']
+        scope = f"包含“{text}”的" if text else "最近的"
+        self.summary_label.configure(text=f"{scope}记录 {len(records)} 条，双击在新标签页中打开")
+
+    def show_slowest(self):
+        """按规范化语句汇总，平均耗时最长的在前"""
+        self._set_columns(self.SLOWEST_COLUMNS)
+        records = self.history.slowest()
+        for record in records:
+            item = self.tree.insert("", tk.END, values=(
+                self._number(record['avg_seconds']), self._number(record['last_seconds']),
+                self._number(record['max_seconds']), record['runs'], self._number(record['avg_rows'], 0),
+                record['last_run'], self._one_line(record['sql_text'])))
+            self.sql_by_item[item] = record['sql_text']
+        self.summary_label.configure(text=f"最慢的 {len(records)} 条查询（常量不同的语句合并统计）")
+
+    def open_selected(self):
+        for item in self.tree.selection():
+            if item in self.sql_by_item:
+                self.on_open(self.sql_by_item[item])
+                return
+
 class HanaQueryAnalyzer:
+    MAX_TABS = 10  # 最多同时打开的标签页数
+
     def __init__(self, root):
-        # 初始化数据相关的属性
-        self._all_data = []
-        self._display_data = []
-        self._batch_size = 100
+        # 初始化排序相关的属性
         self._current_sort_col = None
         self._sort_reverse = False
 
-        # 高亮相关的属性
-        self._highlight_after_id = None
-        self._last_content = None
-        self._token_colors = {}
+        # 增量高亮每次处理的时间预算（毫秒）
+        self.highlight_time_budget = float(os.getenv('HIGHLIGHT_TIME_BUDGET', '20')) / 1000
         
         # 列宽相关的缓存
         self._column_widths = {}  # 缓存列宽
@@ -46,6 +998,57 @@ class HanaQueryAnalyzer:
         # 从环境变量获取最大结果集大小，默认为100
         self.max_results = int(os.getenv('RESULT_SIZE', '100'))
         
+        # 渐进式预览：首批行数、单批上限和时间预算（秒，0表示不限制）
+        self.preview_first_batch = int(os.getenv('PREVIEW_FIRST_BATCH', '50'))
+        self.preview_max_batch = int(os.getenv('PREVIEW_MAX_BATCH', '1000'))
+        self.preview_time_limit = float(os.getenv('PREVIEW_TIME_LIMIT', '0'))
+        
+        # 每个标签页独立的数据库会话：dedicated为单独建立连接，pool为从连接池借用
+        self.tab_session_mode = os.getenv('TAB_SESSION_MODE', 'dedicated').lower()
+        
+        # 预览游标空闲超时（秒），超时后自动关闭释放数据库资源
+        self.preview_cursor_timeout = float(os.getenv('PREVIEW_CURSOR_TIMEOUT', '300'))
+        
+        # 预览数据超过该行数后写入临时文件（0表示不落盘），以及内存中缓存的页数
+        self.preview_memory_rows = int(os.getenv('PREVIEW_MEMORY_ROWS', '200000'))
+        self.preview_cache_pages = int(os.getenv('PREVIEW_CACHE_PAGES', '8'))
+        self.preview_spill_dir = os.getenv('PREVIEW_SPILL_DIR') or None
+        
+        # 服务器端排序/筛选：新标签页是否默认开启，以及改写后查询的LIMIT行数
+        self.pushdown_mode = os.getenv('PUSHDOWN_MODE', 'False').lower() == 'true'
+        self.pushdown_limit = int(os.getenv('PUSHDOWN_LIMIT', '1000'))
+        self.root.after(30000, self._close_idle_preview_cursors)
+        
+        # 后台任务消息按任务ID分发，有消息时才唤醒界面线程，每帧最多更新一次
+        self.ui_dispatcher = UiDispatcher(root)
+        
+        # 绑定参数模式：占位符转换为绑定参数执行，并复用预编译语句
+        self.bind_parameters_var = tk.BooleanVar(value=os.getenv('BIND_PARAMETERS', 'False').lower() == 'true')
+        
+        # 参数批量导出等并发任务使用的连接池，首次使用时创建
+        self.connection_pool = None
+        # TAB_SESSION_MODE=pool时标签页会话单独使用的连接池，不与导出任务争用连接
+        self.session_pool = None
+        
+        # 后台保活：定期检查空闲的标签页会话和连接池连接，执行查询前不再检查连接
+        self.keepalive = ConnectionKeepalive()
+        
+        # 导出任务队列和任务列表窗口，首次导出时创建
+        self.export_manager = None
+        self.export_panel = None
+        self.export_channels = {}  # 任务ID -> 日志通道
+        self.export_priority_var = tk.BooleanVar(value=False)
+        
+        # 查询历史，QUERY_HISTORY_DB为空时不记录
+        self.query_history = None
+        self.query_history_panel = None
+        history_error = None
+        if os.getenv("QUERY_HISTORY_DB", "query_history.db"):
+            try:
+                self.query_history = QueryHistory()
+            except Exception as e:
+                history_error = str(e)
+        
         # 创建主框架
         main_frame = ttk.Frame(root)
         main_frame.pack(fill=tk.BOTH, expand=True)
@@ -61,9 +1064,14 @@ class HanaQueryAnalyzer:
         ttk.Button(button_frame, text="加载 (Ctrl+O)", command=self.load_sql).pack(side=tk.LEFT, padx=2)
         ttk.Button(button_frame, text="执行选中 (Ctrl+F8)", command=self.execute_selected).pack(side=tk.LEFT, padx=2)
         ttk.Button(button_frame, text="执行全部 (F8)", command=self.execute_all).pack(side=tk.LEFT, padx=2)
+        ttk.Button(button_frame, text="继续加载 (F9)", command=self.load_more_results).pack(side=tk.LEFT, padx=2)
         ttk.Button(button_frame, text="流式导出 (F12)", command=self.stream_export_results).pack(side=tk.LEFT, padx=2)
         ttk.Button(button_frame, text="分页导出 (Ctrl+F12)", command=self.export_results).pack(side=tk.LEFT, padx=2)
         ttk.Button(button_frame, text="直接导出 (Shift+F12)", command=self.export_all).pack(side=tk.LEFT, padx=2)
+        ttk.Button(button_frame, text="参数批量导出", command=self.sweep_export).pack(side=tk.LEFT, padx=2)
+        ttk.Button(button_frame, text="导出任务", command=self.show_export_panel).pack(side=tk.LEFT, padx=2)
+        ttk.Checkbutton(button_frame, text="小任务优先", variable=self.export_priority_var).pack(side=tk.LEFT, padx=2)
+        ttk.Button(button_frame, text="查询历史", command=self.show_query_history).pack(side=tk.LEFT, padx=2)
         self.stop_button = ttk.Button(button_frame, text="终止查询 (Esc)", command=self.stop_query, state="disabled")
         self.stop_button.pack(side=tk.LEFT, padx=2)
         
@@ -76,6 +1084,7 @@ class HanaQueryAnalyzer:
         
         # 在按钮区域添加高亮开关按钮
         ttk.Button(button_frame, text="开启/关闭高亮 (Ctrl+L)", command=self.toggle_highlight).pack(side=tk.LEFT, padx=2)
+        ttk.Checkbutton(button_frame, text="绑定参数", variable=self.bind_parameters_var).pack(side=tk.LEFT, padx=2)
         
         # 绑定快捷键（同时支持大小写）
         self.root.bind_all("<Escape>", lambda e: self.stop_query())
@@ -89,6 +1098,7 @@ class HanaQueryAnalyzer:
         self.root.bind_all("<Control-O>", lambda e: self.load_sql())
         self.root.bind_all("<Control-F8>", lambda e: self.execute_selected())
         self.root.bind_all("<F8>", lambda e: self.execute_all())
+        self.root.bind_all("<F9>", lambda e: self.load_more_results())
         self.root.bind_all("<F12>", lambda e: self.stream_export_results())
         self.root.bind_all("<Control-F12>", lambda e: self.export_results())
         self.root.bind_all("<Shift-F12>", lambda e: self.export_all())
@@ -110,23 +1120,22 @@ class HanaQueryAnalyzer:
         # 添加关闭按钮
         ttk.Button(button_frame, text="关闭标签页 (Ctrl+W)", command=self.close_tab).pack(side=tk.LEFT, padx=2)
         
-        # 初始化HANA数据库工具（启动时自动连接）
-        self.hana_utils = HANAUtils()
-        self.connected = False  # 标记是否已连接
+        # 切换标签页时按该标签页的会话更新按钮状态
+        self.notebook.bind("<<NotebookTabChanged>>", lambda e: self._update_tab_controls())
+        self.connected = False  # 标记当前标签页是否已连接
         
-        # 尝试自动连接数据库
+        # 尝试为第一个标签页自动连接数据库
         try:
-            self.hana_utils.connect()
-            if self.check_connection_status():
-                self.connected = True
-                self.log_message("数据库连接成功")
-            else:
-                self.log_message("数据库连接失败：无法验证连接")
+            self.get_current_tab_widgets()[1].session.connect(timeout=0)
+            self.connected = True
+            self.log_message("数据库连接成功")
         except Exception as e:
             self.log_message(f"数据库自动连接失败: {str(e)}")
+        if history_error:
+            self.log_message(f"查询历史不可用: {history_error}")
             
         # 更新连接按钮状态
-        self.update_connection_button()
+        self._update_tab_controls()
         
         # 添加参数值缓存字典
         self.param_cache = {}
@@ -218,98 +1227,56 @@ class HanaQueryAnalyzer:
         return '\n'.join(lines)
         
     def add_tab(self):
-        if len(self.notebook.tabs()) >= 10:
+        if len(self.notebook.tabs()) >= self.MAX_TABS:
             return
             
         frame = ttk.Frame(self.notebook)
         self.notebook.add(frame, text=f"Query {len(self.notebook.tabs()) + 1}")
         
+        # 标签页独立的数据库会话及其设置栏
+        session = QuerySession(pool=self.get_session_pool() if self.tab_session_mode == 'pool' else None)
+        self.keepalive.register(session)
+        session_bar = SessionBar(frame, session)
+        session_bar.pack(fill=tk.X, pady=(2, 0))
+        
         # 创建SQL输入区域的容器框架
         sql_frame = ttk.Frame(frame)
         sql_frame.pack(fill=tk.BOTH, expand=True)
         
-        # 创建行号文本框
-        line_numbers = tk.Text(sql_frame, width=4)
-        line_numbers.pack(side=tk.LEFT, fill=tk.Y)
-        
-        # 配置行号文本框的样式
-        line_numbers.configure(
-            background='#f0f0f0',
-            foreground='gray',
-            padx=5,
-            state='disabled',
-            relief=tk.FLAT,
-            takefocus=0,
-            wrap='none',  # 禁用自动换行
-            cursor='arrow'  # 使用箭头光标
-        )
-        
         # SQL输入框
         sql_input = scrolledtext.ScrolledText(sql_frame, wrap=tk.NONE)  # 修改为 NONE
+        
+        # 行号栏，放在输入框左侧
+        line_numbers = LineNumberGutter(sql_frame, sql_input)
+        line_numbers.pack(side=tk.LEFT, fill=tk.Y)
         sql_input.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         
         # 绑定右键菜单
         sql_input.bind('<Button-3>', lambda e: self.show_context_menu(e, sql_input))
         # 绑定Ctrl+A快捷键
         sql_input.bind('<Control-Key-a>', lambda e: self.select_all(sql_input))
-        # 绑定更新行号的事件
-        sql_input.bind('<Key>', lambda e: self.update_line_numbers(sql_input, line_numbers))
-        sql_input.bind('<Return>', lambda e: self.update_line_numbers(sql_input, line_numbers))
-        sql_input.bind('<BackSpace>', lambda e: self.update_line_numbers(sql_input, line_numbers))
-        sql_input.bind('<Delete>', lambda e: self.update_line_numbers(sql_input, line_numbers))  # 添加Delete键的绑定
-        sql_input.bind('<<Paste>>', lambda e: self.root.after(10, lambda: self.update_line_numbers(sql_input, line_numbers)))
-        sql_input.bind('<<Cut>>', lambda e: self.root.after(10, lambda: self.update_line_numbers(sql_input, line_numbers)))  # 添加剪切事件的绑定
-        
-        # 修改滚动同步处理
-        def on_scroll(*args):
-            try:
-                if args[0] == 'scroll':
-                    # 滚动事件
-                    line_numbers.yview_scroll(int(args[1]), args[2])
-                    sql_input.yview_scroll(int(args[1]), args[2])
-                elif args[0] == 'moveto':
-                    # 移动到指定位置
-                    line_numbers.yview_moveto(float(args[1]))
-                    sql_input.yview_moveto(float(args[1]))
-            except Exception as e:
-                print(f"Scroll error: {str(e)}")
-
-        def on_mousewheel(event):
-            try:
-                # 处理鼠标滚轮事件
-                delta = -1 * (event.delta // 120)
-                line_numbers.yview_scroll(delta, "units")
-                sql_input.yview_scroll(delta, "units")
-                return "break"  # 阻止事件继续传播
-            except Exception as e:
-                print(f"Mousewheel error: {str(e)}")
-        
-        # 绑定滚动事件
-        sql_input.bind("<MouseWheel>", on_mousewheel)
-        
-        # 获取滚动条组件
-        scrollbar = sql_input.vbar
-        
-        # 配置滚动条命令
-        scrollbar.config(command=on_scroll)
-        
-        # 配置同步滚动
-        def sync_scroll(*args):
-            try:
-                line_numbers.yview_moveto(args[0])
-                return True
-            except Exception as e:
-                print(f"Sync scroll error: {str(e)}")
-                return False
-        
-        sql_input.config(yscrollcommand=scrollbar.set)
-        line_numbers.config(yscrollcommand=sync_scroll)
-        
-        # 保存行号文本框的引用
+        # 文本或可见范围变化时刷新行号栏（行数和首个可见行都没变时不重绘）
+        def on_yscroll(first, last):
+            sql_input.vbar.set(first, last)
+            line_numbers.schedule_refresh()
+        
+        sql_input.config(yscrollcommand=on_yscroll)
+        sql_input.bind('<KeyRelease>', lambda e: line_numbers.schedule_refresh())
+        sql_input.bind('<Configure>', lambda e: line_numbers.schedule_refresh())
+        sql_input.bind('<<Paste>>', lambda e: self.root.after(10, line_numbers.schedule_refresh))
+        sql_input.bind('<<Cut>>', lambda e: self.root.after(10, line_numbers.schedule_refresh))
+        
+        # 保存行号栏的引用
         sql_input.line_numbers = line_numbers
         
+        # 增量语法高亮：文本变化后只重新分析受影响的行
+        sql_input.highlighter = SqlHighlighter(sql_input, self.get_token_color, time_budget=self.highlight_time_budget)
+        sql_input.bind('<KeyRelease>', lambda e: self.highlight_sql(sql_input), add='+')
+        sql_input.bind('<<Paste>>', lambda e: self.root.after(10, lambda: self.highlight_sql(sql_input)), add='+')
+        sql_input.bind('<<Cut>>', lambda e: self.root.after(10, lambda: self.highlight_sql(sql_input)), add='+')
+        
         # 初始化行号
-        self.update_line_numbers(sql_input, line_numbers)
+        line_numbers.schedule_refresh()
         
         # 使用PanedWindow来分隔结果区域和日志区域
         paned = ttk.PanedWindow(frame, orient=tk.VERTICAL)
@@ -319,6 +1286,11 @@ class HanaQueryAnalyzer:
         result_frame = ttk.Frame(paned)
         paned.add(result_frame, weight=3)  # 结果区域占比更大
         
+        # 结果筛选栏
+        filter_bar = FilterBar(result_frame, on_change=lambda: self.apply_result_filter(tree),
+                               pushdown=self.pushdown_mode)
+        filter_bar.pack(fill=tk.X, pady=(2, 0))
+        
         # 创建带虚拟滚动的Treeview
         tree_frame = ttk.Frame(result_frame)  # 新增容器frame
         tree_frame.pack(fill=tk.BOTH, expand=True)
@@ -356,8 +1328,24 @@ class HanaQueryAnalyzer:
         tree.pack(fill=tk.BOTH, expand=True)
         tree.hsb.pack(fill=tk.X, expand=True)
         
-        # 配置Treeview的滚动
-        tree.configure(yscrollcommand=tree.vsb.set, xscrollcommand=tree.hsb.set)
+        # 配置Treeview的滚动，竖向滚动由虚拟表格接管
+        tree.configure(xscrollcommand=tree.hsb.set)
+        tree.virtual_grid = VirtualGrid(tree, tree.vsb)
+        tree.virtual_grid.on_need_more = lambda: self.load_more_results(tree, on_scroll=True)
+        self._setup_tree_events(tree)
+        tree.filter_bar = filter_bar
+        tree.base_sql = None  # 标签页最近一次执行的原始查询
+        tree.base_params = None  # 原始查询的绑定参数
+        tree.server_sort = None  # 服务器端排序状态(列索引, 是否降序)
+        tree.pushdown_applied = False  # 当前结果是否来自改写后的查询
+        tree.base_text = None  # 原始查询替换占位符后的文本，用于判断导出能否使用预览结果
+        tree.preview_result = None  # 最近一次预览的游标（含已读完的），用于判断预览是否包含完整结果
+        tree.keep_filters = False
+        tree.reapply_filter = False
+        
+        # 结果状态栏：显示已加载行数以及是否还有更多数据
+        tree.status_label = ttk.Label(result_frame, anchor=tk.W)
+        tree.status_label.pack(fill=tk.X, padx=5)
         
         # 优化样式设置
         style = ttk.Style()
@@ -370,6 +1358,10 @@ class HanaQueryAnalyzer:
         
         log_text = scrolledtext.ScrolledText(log_frame, height=6)
         log_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        tree.log_text = log_text  # 预览任务的日志写回发起查询的标签页
+        tree.session = session
+        tree.session_bar = session_bar
+        tree.closed = False
         
         # 将组件存储为frame的属性
         frame.sql_input = sql_input
@@ -387,102 +1379,14 @@ class HanaQueryAnalyzer:
             getattr(current_tab, 'log_text', None)
         )
         
-    def highlight_sql(self, event=None):
-        """手动触发的高亮处理"""
-        # 获取当前标签页的SQL输入框
-        sql_input, _, _ = self.get_current_tab_widgets()
-        if not sql_input:
+    def highlight_sql(self, sql_input=None):
+        """文本变化后触发增量高亮"""
+        if not self.highlight_enabled:
             return
-
-        # 使用防抖动延迟执行高亮处理
-        if self._highlight_after_id:
-            self.root.after_cancel(self._highlight_after_id)
-        self._highlight_after_id = self.root.after(100, lambda: self._do_highlight(sql_input))
-
-    def _do_highlight(self, sql_input):
-        """实际执行高亮处理的函数"""
-        try:
-            # 获取整个文本内容
-            text_content = sql_input.get("1.0", tk.END)
-
-            # 如果内容没有变化，跳过处理
-            if text_content == self._last_content:
-                return
-            self._last_content = text_content
-
-            # 移除所有现有标记
-            for tag in sql_input.tag_names():
-                if str(tag).startswith('Token') or tag == "quoted_string":
-                    sql_input.tag_remove(tag, "1.0", tk.END)
-
-            # 先处理引号内容
-            start_index = "1.0"
-            while True:
-                # 查找下一个引号
-                quote_pos = sql_input.search(r'["\']', start_index, tk.END)
-                if not quote_pos:
-                    break
-                    
-                try:
-                    # 获取引号类型
-                    quote_char = sql_input.get(quote_pos)
-                    # 查找匹配的结束引号
-                    end_pos = sql_input.search(quote_char, f"{quote_pos}+1c", tk.END)
-                    if not end_pos:
-                        break
-                    
-                    # 为整个引号内容（包括引号）添加标记
-                    sql_input.tag_add("quoted_string", quote_pos, f"{end_pos}+1c")
-                    
-                    # 更新搜索起始位置
-                    start_index = f"{end_pos}+1c"
-                    
-                except tk.TclError:
-                    break
-
-            # 配置引号内容的样式
-            sql_input.tag_config("quoted_string", foreground="blue")
-
-            # 使用pygments进行其他语法分析
-            for token, content in lex(text_content, SqlLexer()):
-                if not content.strip() or any(c in content for c in '"\''):  # 跳过空白内容和引号内容
-                    continue
-
-                start_index = "1.0"
-                while True:
-                    try:
-                        # 在整个文本中搜索匹配
-                        pos = sql_input.search(content, start_index, tk.END)
-                        if not pos:
-                            break
-
-                        # 检查该位置是否已经被引号标记覆盖
-                        if "quoted_string" in sql_input.tag_names(pos):
-                            start_index = f"{pos}+{len(content)}c"
-                            continue
-
-                        # 计算结束位置
-                        end = f"{pos}+{len(content)}c"
-
-                        # 使用缓存的颜色配置
-                        token_str = str(token)
-                        if token_str not in self._token_colors:
-                            self._token_colors[token_str] = self.get_token_color(token)
-                            # 为关键字配置粗体
-                            if token is Token.Keyword:
-                                sql_input.tag_config(token_str, foreground=self._token_colors[token_str], font=('TkDefaultFont', 10, 'bold'))
-                            else:
-                                sql_input.tag_config(token_str, foreground=self._token_colors[token_str])
-
-                        # 添加标记
-                        sql_input.tag_add(token_str, pos, end)
-                        
-                        # 更新起始位置
-                        start_index = end
-                    except tk.TclError:
-                        break  # 处理搜索过程中可能出现的错误
-        except Exception as e:
-            print(f"Highlighting error: {str(e)}")  # 添加错误输出以便调试
+        if sql_input is None:
+            sql_input, _, _ = self.get_current_tab_widgets()
+        if sql_input:
+            sql_input.highlighter.schedule()
                 
     def get_token_color(self, token):
         # 定义不同token类型的颜色
@@ -553,7 +1457,7 @@ class HanaQueryAnalyzer:
                     self.notebook.tab(current_tab, text=os.path.basename(file_path))
                     
                     # 手动更新行号
-                    self.update_line_numbers(sql_input, sql_input.line_numbers)
+                    sql_input.line_numbers.schedule_refresh()
                     
                     # 如果高亮功能已开启，则触发高亮
                     if self.highlight_enabled:
@@ -600,8 +1504,22 @@ class HanaQueryAnalyzer:
     def on_closing(self):
         """窗口关闭时的清理操作"""
         try:
-            # 断开数据库连接
-            self.hana_utils.disconnect()
+            # 关闭各标签页保留的预览游标
+            for tab_id in self.notebook.tabs():
+                tab = self.notebook.nametowidget(tab_id)
+                self.close_preview_cursor(tab.result_text)
+                self.release_result_store(tab.result_text)
+                tab.result_text.session.close()
+            # 停止保活，取消导出任务，关闭连接池和数据库连接
+            self.keepalive.stop()
+            if self.export_manager is not None:
+                self.export_manager.close()
+            if self.connection_pool is not None:
+                self.connection_pool.close()
+            if self.session_pool is not None:
+                self.session_pool.close()
+            if self.query_history is not None:
+                self.query_history.close()
         finally:
             self.root.destroy()
             
@@ -611,139 +1529,374 @@ class HanaQueryAnalyzer:
         placeholders = self.get_placeholders(sql_text)
         if placeholders:
             # 显示参数输入对话框
-            params = self.show_parameter_dialog(placeholders)
-            if params is None:  # 用户取消了输入
+            values = self.show_parameter_dialog(placeholders)
+            if values is None:  # 用户取消了输入
                 self.log_message("已取消执行")
                 return
-            # 替换占位符
-            sql_text = self.replace_placeholders(sql_text, params)
-            self.log_message("已替换占位符")
+            # 与导出时相同的替换结果，用于判断导出能否直接使用预览结果
+            base_text = self.replace_placeholders(sql_text, values)
+            if self.bind_parameters_var.get():
+                # 转换为绑定参数，换参数重新执行时SQL文本不变，可复用预编译语句
+                sql_text, params = bind_placeholders(sql_text, values)
+                self.log_message(f"已转换为绑定参数（{len(params)}个）")
+            else:
+                # 替换占位符
+                sql_text = self.replace_placeholders(sql_text, values)
+                self.log_message("已替换占位符")
+        else:
+            params = None
+            base_text = sql_text
+        
+        result_text.base_sql = sql_text
+        result_text.base_params = params or None
+        result_text.base_text = base_text
+        result_text.server_sort = None
+        result_text.pushdown_applied = False
+        result_text.keep_filters = False
+        result_text.reapply_filter = False
+        self._run_preview_query(result_text, sql_text, result_text.base_params)
+        self.log_message("正在执行查询...")
         
-        # 清除之前的结果
-        for item in result_text.get_children():
-            result_text.delete(item)
+    def _run_preview_query(self, result_text, sql_text, params=None):
+        """清除之前的结果并在后台执行预览查询"""
+        # 关闭上一次保留的预览游标
+        self.close_preview_cursor(result_text)
+        self.release_result_store(result_text)
+        result_text.preview_result = None
+        result_text.virtual_grid.clear()
+        result_text.status_label.configure(text="")
         result_text["columns"] = []
         
-        # 禁用执行按钮
-        self.disable_execute_buttons()
-        self.log_message("正在执行查询...")
+        self._start_preview_thread(self._execute_sql_in_thread, (sql_text, result_text, params), result_text)
         
-        # 创建队列用于线程间通信
-        self.result_queue = queue.Queue()
+    def run_pushdown_query(self, result_text):
+        """把排序和筛选条件改写为SQL，在服务器端对完整结果集重新执行"""
+        if not result_text.base_sql or not getattr(result_text, '_column_names', None):
+            self.log_message("请先执行返回结果集的查询")
+            return
+        if result_text.session.running:
+            self.log_message("查询正在执行，请稍后再排序或筛选")
+            return
+        filter_bar = result_text.filter_bar
+        sql_text, params = build_pushdown_query(
+            result_text.base_sql,
+            list(result_text._column_names),
+            filters=filter_bar.conditions,
+            search=filter_bar.search_text,
+            sort=result_text.server_sort,
+            limit=self.pushdown_limit
+        )
+        result_text.pushdown_applied = True
+        result_text.keep_filters = True
+        # 原查询的绑定参数在前，筛选条件的参数在后
+        self._run_preview_query(result_text, sql_text, list(result_text.base_params or []) + params)
+        self.log_message(f"正在服务器端排序/筛选: {sql_text}")
+        
+    def _start_preview_thread(self, target, args, result_text):
+        """启动预览后台线程并开始检查其状态"""
+        # 标签页的会话同时只执行一条查询
+        result_text.session.running = True
+        self._update_tab_controls()
+        
+        # 每个预览任务单独的消息通道，作为最后一个参数传给后台线程
+        channel = self.ui_dispatcher.open(
+            lambda messages: self._handle_preview_messages(result_text, messages))
         
         # 创建并启动后台线程
-        thread = threading.Thread(
-            target=self._execute_sql_in_thread,
-            args=(sql_text, result_text)
-        )
+        thread = threading.Thread(target=target, args=args + (channel,))
         thread.daemon = True
         thread.start()
         
-        # 启动定时器检查线程状态
-        self.root.after(100, self._check_thread_status, result_text)
+    def load_more_results(self, result_text=None, on_scroll=False):
+        """从保留的预览游标继续加载下一批数据"""
+        if result_text is None:
+            _, result_text, _ = self.get_current_tab_widgets()
+        if not result_text or result_text.session.running:
+            return
+        preview = getattr(result_text, 'preview_cursor', None)
+        if preview is None or preview.exhausted:
+            if not on_scroll:
+                self.log_message("没有更多数据可加载")
+            return
+        if not on_scroll:
+            self.log_message("正在继续加载数据...")
+        result_text.status_label.configure(text=f"已加载 {result_text.virtual_grid.rows.total_rows} 行，正在加载更多...")
+        self._start_preview_thread(self._continue_preview_in_thread, (result_text, preview), result_text)
+        
+    def close_preview_cursor(self, result_text, reason=None):
+        """关闭标签页保留的预览游标"""
+        preview = getattr(result_text, 'preview_cursor', None)
+        if preview is not None:
+            preview.close()
+            result_text.preview_cursor = None
+            if reason:
+                result_text.status_label.configure(
+                    text=f"已加载 {result_text.virtual_grid.rows.total_rows} 行，{reason}，重新执行查询可查看更多")
+        
+    def release_result_store(self, result_text):
+        """释放标签页的结果集存储并删除其临时文件"""
+        store = result_text.virtual_grid.rows
+        if isinstance(store, ResultStore):
+            store.close()
+        
+    def _close_idle_preview_cursors(self):
+        """定期关闭空闲超时的预览游标"""
+        try:
+            if self.preview_cursor_timeout > 0:
+                for tab_id in self.notebook.tabs():
+                    result_text = self.notebook.nametowidget(tab_id).result_text
+                    if result_text.session.running:
+                        continue
+                    preview = getattr(result_text, 'preview_cursor', None)
+                    if preview is not None and preview.idle_seconds() > self.preview_cursor_timeout:
+                        self.close_preview_cursor(result_text, reason="游标空闲超时已关闭")
+        finally:
+            self.root.after(30000, self._close_idle_preview_cursors)
+            
+    def _update_result_status(self, result_text):
+        """更新结果状态栏"""
+        store = result_text.virtual_grid.rows
+        loaded = store.total_rows
+        preview = getattr(result_text, 'preview_cursor', None)
+        if preview is not None and not preview.exhausted:
+            text = f"已加载 {loaded} 行 / 还有更多数据（滚动到底部或按F9继续加载）"
+        else:
+            text = f"已加载 {loaded} 行（全部）"
+        if store.filtered:
+            text = f"筛选结果 {len(store)} 行 / " + text
+        if result_text.pushdown_applied:
+            text = f"服务器端排序/筛选（最多 {self.pushdown_limit} 行），" + text
+        if getattr(store, 'spilled_rows', 0):
+            text += f"，其中 {store.spilled_rows} 行已写入临时文件"
+        result_text.status_label.configure(text=text)
+        
+    def apply_result_filter(self, result_text):
+        """按筛选栏的条件和搜索词筛选已加载的结果"""
+        filter_bar = result_text.filter_bar
+        if filter_bar.pushdown_enabled:
+            self.run_pushdown_query(result_text)
+            return
+        if result_text.pushdown_applied and not result_text.session.running:
+            # 关闭服务器端模式：重新执行原查询，加载完成后再在本地筛选
+            result_text.server_sort = None
+            result_text.pushdown_applied = False
+            result_text.keep_filters = True
+            result_text.reapply_filter = True
+            self._run_preview_query(result_text, result_text.base_sql, result_text.base_params)
+            self.log_message("已关闭服务器端排序/筛选，正在重新执行原查询...")
+            return
+        store = result_text.virtual_grid.rows
+        if not isinstance(store, ResultStore):
+            return
+        start_time = time.time()
+        try:
+            store.set_filter(filter_bar.conditions, filter_bar.search_text)
+        except ValueError as e:
+            # 条件有误时撤销最后添加的条件
+            self.log_message(f"筛选失败: {str(e)}")
+            if filter_bar.conditions:
+                filter_bar.conditions.pop()
+                filter_bar.update_label()
+            return
+        result_text.virtual_grid.set_rows(store)
+        self._update_result_status(result_text)
+        if store.filtered:
+            self.log_message(f"筛选完成，{len(store)} / {store.total_rows} 行符合条件，耗时 {(time.time() - start_time) * 1000:.0f} 毫秒")
         
     def stop_query(self):
         """终止当前查询"""
-        if hasattr(self, 'stop_requested'):
-            self.stop_requested = True
+        _, result_text, _ = self.get_current_tab_widgets()
+        if result_text is not None and result_text.session.running:
+            result_text.session.stop_requested = True
             self.log_message("正在终止查询...")
 
-    def _execute_sql_in_thread(self, sql_text, result_text):
+    def _execute_sql_in_thread(self, sql_text, result_text, params, channel):
         """在后台线程中执行SQL查询"""
-        self.stop_requested = False
+        session = result_text.session
+        session.stop_requested = False
+        # 写入查询历史的耗时、行数和字节数
+        execute_seconds = fetch_seconds = rows = nbytes = error = None
         try:
             # 记录开始时间
             start_time = time.time()
             
-            # 检查并确保数据库连接
-            if not self.check_connection_status():
-                self.hana_utils.connect()
-                if not self.check_connection_status():
-                    self.result_queue.put(("error", "无法建立数据库连接"))
-                    return
-                self.update_connection_button()
-
-            # 执行SQL查询
-            try:
-                cursor = self.hana_utils.get_cursor()
-                cursor.execute(sql_text)
-            except Exception as e:
-                # 如果执行失败，再次检查连接状态
-                if not self.check_connection_status():
-                    self.update_connection_button()
-                    self.result_queue.put(("error", "数据库连接已断开"))
-                    return
+            # 执行SQL查询，带绑定参数时使用连接上缓存的预编译语句
+            def execute(utils):
+                statements = utils.statements
+                if params and statements is not None:
+                    key, cursor, hit = statements.execute(sql_text, params)
+                    channel.put(("info", f"预编译语句{'缓存命中，跳过编译' if hit else '已编译并缓存'}"
+                                         f"（命中 {statements.hits} / 编译 {statements.misses}）"))
+                    return cursor, lambda: statements.release(key, cursor)
+                cursor = utils.get_cursor()
+                if params:
+                    cursor.execute(sql_text, params)
                 else:
-                    raise  # 如果连接正常但执行出错，抛出原始异常
+                    cursor.execute(sql_text)
+                return cursor, None
             
-            # 检查是否请求终止
-            if self.stop_requested:
-                self.result_queue.put(("info", "查询已终止"))
-                return
-                
-            results = cursor.fetchmany(self.max_results + 1)  # 多获取一条用于判断是否超出限制
-            columns = [desc[0] for desc in cursor.description]
+            # 只读查询在重连后自动重新执行；其他语句可能已经生效，不自动重试
+            retry = is_read_only_query(sql_text)
             
-            if results:
-                # 检查是否超出最大结果集限制
-                if len(results) > self.max_results:
-                    results = results[:self.max_results]  # 只保留前max_results条
-                    self.result_queue.put(("warning", f"警告：结果集已被限制为前{self.max_results}条记录"))
-                
-                # 将结果转换为DataFrame以便格式化显示
-                df = pd.DataFrame(results, columns=columns)
-                
-                # 将结果放入队列
-                self.result_queue.put(("columns", columns))
-                self.result_queue.put(("data", df))
-                
-                # 记录数
-                self.result_queue.put(("info", f"共 {len(results)} 条记录"))
+            def on_reconnect(total):
+                channel.put(("session", None))
+                action = "重新执行查询" if retry else "语句未自动重新执行，请确认后再次执行"
+                channel.put(("warning", f"数据库连接已断开，已重新连接（累计重连 {total} 次），{action}"))
+            
+            # 使用标签页自己的会话，执行前不额外检查连接，执行失败时才判断是否需要重连
+            was_connected = session.is_connected()
+            cursor, release = session.run(execute, retry=retry, on_reconnect=on_reconnect)
+            execute_seconds = time.time() - start_time
+            if not was_connected:
+                channel.put(("session", None))
+            
+            # 检查是否请求终止
+            if session.stop_requested or not cursor.description:
+                # 预编译语句的游标归还给缓存，普通游标直接关闭，避免留在标签页的长连接上
+                if release is not None:
+                    release()
+                else:
+                    cursor.close()
+                if session.stop_requested:
+                    channel.put(("info", "查询已终止"))
+                    return
+                channel.put(("info", "查询未返回结果"))
             else:
-                self.result_queue.put(("info", "查询未返回结果"))
+                columns = [desc[0] for desc in cursor.description]
+                channel.put(("columns", columns))
+                channel.put(("info", f"执行耗时: {time.time() - start_time:.2f}秒，开始获取数据"))
+                fetch_start = time.time()
+                rows, nbytes = self._stream_preview(session, PreviewCursor(cursor, columns, release), channel)
+                fetch_seconds = time.time() - fetch_start
             
             duration = time.time() - start_time
-            self.result_queue.put(("info", f"SQL执行成功，耗时: {duration:.2f}秒"))
+            channel.put(("info", f"SQL执行成功，耗时: {duration:.2f}秒"))
             
         except Exception as e:
             # 记录错误信息
             duration = time.time() - start_time
-            self.result_queue.put(("error", f"SQL执行失败: {str(e)}"))
+            error = str(e)
+            channel.put(("error", f"SQL执行失败: {str(e)}"))
         finally:
+            self._record_history('query', sql_text, params, execute_seconds=execute_seconds,
+                                 fetch_seconds=fetch_seconds, rows=rows, nbytes=nbytes, error=error)
             # 标记任务完成
-            self.result_queue.put(("done", None))
+            channel.put(("done", None))
             
-    def _check_thread_status(self, result_text):
-        """检查后台线程状态并更新UI"""
+    def _continue_preview_in_thread(self, result_text, preview, channel):
+        """在后台线程中从保留的游标继续获取数据"""
+        result_text.session.stop_requested = False
         try:
-            while not self.result_queue.empty():
-                msg_type, content = self.result_queue.get_nowait()
-                
-                if msg_type == "columns":
-                    self._handle_columns(result_text, content)
-                elif msg_type == "data":
-                    self._handle_data(result_text, content)
-                elif msg_type in ["info", "warning", "error"]:
-                    self.log_message(content)
-                elif msg_type == "done":
-                    # 启用执行按钮
-                    self.enable_execute_buttons()
-                    return
-
-            # 继续检查
-            self.root.after(100, self._check_thread_status, result_text)
-        except queue.Empty:
-            # 继续检查
-            self.root.after(100, self._check_thread_status, result_text)
+            self._stream_preview(result_text.session, preview, channel, announce=False)
+        except Exception as e:
+            channel.put(("error", f"继续加载失败: {str(e)}"))
+        finally:
+            channel.put(("done", None))
+            
+    def _stream_preview(self, session, preview, channel, announce=True):
+        """分批获取预览数据并逐批放入队列，直到达到行数或时间预算，返回(本次行数, 字节数)"""
+        start_time = time.time()
+        deadline = start_time + self.preview_time_limit if self.preview_time_limit > 0 else None
+        row_budget = self.max_results
+        batch_size = max(1, self.preview_first_batch)
+        fetched = 0
+        nbytes = 0
+        
+        while fetched < row_budget:
+            if session.stop_requested:
+                channel.put(("info", "查询已终止"))
+                break
+            if deadline and time.time() > deadline:
+                break
+            rows = preview.fetch(min(batch_size, row_budget - fetched))
+            if not rows:
+                break
+            # 在取数线程中转换为列式批次，界面线程直接封页
+            batch = ColumnBatch.from_rows(preview.columns, rows)
+            nbytes += batch.nbytes()
+            channel.put(("data", batch))
+            if fetched == 0:
+                channel.put(("info", f"首批 {len(rows)} 条记录耗时: {time.time() - start_time:.3f}秒"))
+            fetched += len(rows)
+            # 首批尽量小以便尽快显示，之后逐步增大批次减少往返
+            batch_size = min(batch_size * 2, self.preview_max_batch)
+        
+        channel.put(("info", f"本次加载 {fetched} 条记录，累计 {preview.fetched} 条"))
+        if preview.has_more():
+            # 保留游标，用户可以按F9扩展预算继续加载
+            channel.put(("more", preview))
+            if not announce:
+                return fetched, nbytes
+            if fetched >= row_budget:
+                reason = f"前{preview.fetched}条记录"
+            else:
+                reason = f"{self.preview_time_limit:g}秒预览时间内获取的记录"
+            channel.put(("warning", f"警告：结果集已被限制为{reason}，滚动到底部或按F9继续加载"))
+        else:
+            # 游标已读完，仍把它交给界面用于判断预览是否包含完整结果
+            preview.close()
+            channel.put(("more", preview))
+        return fetched, nbytes
+            
+    def _handle_preview_messages(self, result_text, messages):
+        """处理预览任务一帧内的消息，连续的数据批次合并后只刷新一次表格"""
+        logs = []
+        batches = []
+        done = False
+        for msg_type, content in messages:
+            if msg_type == "data":
+                batches.append(content)
+                continue
+            if batches:
+                self._handle_data(result_text, batches)
+                batches = []
+            if msg_type == "columns":
+                self._handle_columns(result_text, content)
+            elif msg_type == "more":
+                result_text.preview_result = content
+                result_text.preview_cursor = None if content.closed else content
+                self._update_result_status(result_text)
+            elif msg_type == "session":
+                self._update_tab_controls()
+            elif msg_type in ["info", "warning", "error"]:
+                logs.append(content)
+            elif msg_type == "done":
+                done = True
+        if batches:
+            self._handle_data(result_text, batches)
+        self.log_messages(logs, result_text.log_text)
+        
+        if done:
+            result_text.session.running = False
+            if result_text.closed:
+                # 查询期间标签页已关闭，结束后再释放游标和会话
+                self._release_tab_resources(result_text)
+                return
+            self._update_tab_controls()
+            if result_text.reapply_filter:
+                # 退出服务器端模式后在重新加载的数据上应用本地筛选
+                result_text.reapply_filter = False
+                self.apply_result_filter(result_text)
 
     def _handle_columns(self, result_text, content):
         """处理列信息"""
         # 清除现有数据和排序状态
         self._current_sort_col = None
         self._sort_reverse = False
-        self._all_data = []
-        self._display_data = []
-        self._batch_size = 100
+        self.release_result_store(result_text)
+        result_text.preview_result = None
+        result_text.virtual_grid.clear()
+        result_text.virtual_grid.set_rows(ResultStore(
+            content,
+            memory_rows=self.preview_memory_rows or None,
+            spill_dir=self.preview_spill_dir,
+            cache_pages=self.preview_cache_pages
+        ))
+        if result_text.keep_filters:
+            # 服务器端排序/筛选重新执行时保留筛选栏的条件
+            result_text.keep_filters = False
+        else:
+            result_text.filter_bar.set_columns(content)
         
         # 配置列并存储列名
         result_text["columns"] = content
@@ -762,6 +1915,9 @@ class HanaQueryAnalyzer:
             def do_resize():
                 # 计算最佳列宽，使用缓存优化
                 for col in content:
+                    # 添加列排序功能
+                    result_text.heading(col, text=col, command=lambda c=col: self.sort_column(result_text, c))
+                    
                     # 优先使用缓存的列宽
                     if col in self._column_widths:
                         result_text.column(col, width=self._column_widths[col], minwidth=50, stretch=False)
@@ -786,9 +1942,6 @@ class HanaQueryAnalyzer:
                     self._column_widths[col] = final_width
                     result_text.column(col, width=final_width, minwidth=50, stretch=False)
                     
-                    # 添加列排序功能
-                    result_text.heading(col, text=col, command=lambda c=col: self.sort_column(result_text, c))
-                    
                 # 最后一列可以stretch
                 if content:
                     result_text.column(content[-1], stretch=True)
@@ -808,12 +1961,8 @@ class HanaQueryAnalyzer:
             return
             
         try:
-            # 检查是否需要垂直滚动条
-            first, last = tree.yview()
-            if first <= 0 and last >= 1:
-                tree.vsb.pack_forget()
-            else:
-                tree.vsb.pack(side=tk.RIGHT, fill=tk.Y)
+            # 垂直滚动条由虚拟表格根据数据总行数维护
+            tree.virtual_grid.refresh()
                 
             # 检查是否需要水平滚动条
             first, last = tree.xview()
@@ -828,22 +1977,18 @@ class HanaQueryAnalyzer:
             # 忽略任何可能的tkinter错误
             pass
 
-    def _handle_data(self, result_text, content):
+    def _handle_data(self, result_text, batches):
         """处理数据"""
-        # 批量处理数据
-        self._all_data.extend([tuple(row) for _, row in content.iterrows()])
-        # 初始显示第一批数据
-        display_rows = self._all_data[:self._batch_size]
-        for i, row in enumerate(display_rows):
-            tag = 'evenrow' if i % 2 == 0 else 'oddrow'
-            result_text.insert("", "end", values=row, tags=(tag,))
+        # 数据写入列式存储，Treeview中只保留可见窗口的真实行
+        grid = result_text.virtual_grid
+        for batch in batches:
+            grid.rows.append_batch(batch)
+        grid.refresh()
+        result_text.status_label.configure(text=f"已加载 {grid.rows.total_rows} 行，正在获取...")
 
     def _setup_tree_events(self, result_text):
         """设置树形控件的事件绑定"""
-        # 绑定滚动相关事件以便动态加载数据
-        result_text.bind('<MouseWheel>', lambda e: self.on_scroll(e, result_text))
-        result_text.bind('<Motion>', lambda e: self.on_mouse_move(e, result_text))
-        
+        # 滚动、点击选择和键盘导航由虚拟表格处理
         # 绑定快捷键
         result_text.bind('<Control-c>', lambda e: self.copy_selected_with_headers(result_text))
         result_text.bind('<Control-a>', lambda e: self.select_all_results(result_text))
@@ -853,33 +1998,16 @@ class HanaQueryAnalyzer:
         
         # 绑定双击事件
         result_text.bind('<Double-Button-1>', lambda e: self.copy_cell_content(e, result_text))
-        
-        # 滚动条事件绑定 - 使用树控件的内置滚动条属性
-        if hasattr(result_text, 'vsb'):
-            result_text.vsb.bind('<B1-Motion>', lambda e: self.on_scrollbar_drag(e, result_text))
-        
-        # 内存优化事件绑定
-        result_text.bind('<Leave>', lambda e: self.clear_tree_memory(result_text))
-        result_text.bind('<Enter>', lambda e: self.clear_tree_memory(result_text))
-        result_text.bind('<Configure>', lambda e: self.clear_tree_memory(result_text))
-        
-        # 定期清理定时器
-        self._cleanup_after_id = self.root.after(5000, lambda: self.clear_tree_memory(result_text))
             
-    def disable_execute_buttons(self):
-        """禁用所有执行相关按钮"""
-        for child in self.root.winfo_children():
-            if isinstance(child, ttk.Button) and child["text"] in ["执行选中 (Ctrl+F8)", "执行全部 (F8)"]:
-                child["state"] = "disabled"
-        self.stop_button["state"] = "normal"
+    def _update_tab_controls(self):
+        """按当前标签页的会话更新终止查询按钮、连接按钮和会话状态"""
+        _, result_text, _ = self.get_current_tab_widgets()
+        if result_text is None:
+            return
+        self.stop_button["state"] = "normal" if result_text.session.running else "disabled"
+        self.update_connection_button()
+        result_text.session_bar.refresh()
                 
-    def enable_execute_buttons(self):
-        """启用所有执行相关按钮"""
-        for child in self.root.winfo_children():
-            if isinstance(child, ttk.Button) and child["text"] in ["执行选中 (Ctrl+F8)", "执行全部 (F8)"]:
-                child["state"] = "normal"
-        self.stop_button["state"] = "disabled"
-        
     def is_select_query(self, sql_text):
         """检查SQL语句是否以select开头(不区分大小写)"""
         sql_text = (sql_text or "").strip().lower()
@@ -914,130 +2042,47 @@ class HanaQueryAnalyzer:
             self.export_all()
             return
             
-        # 打开文件保存对话框
+        # 打开文件保存对话框（流式导出也可保存为CSV或Parquet）
         file_path = filedialog.asksaveasfilename(
             defaultextension=".xlsx",
-            filetypes=[("Excel Files", "*.xlsx"), ("All Files", "*.*")]
+            filetypes=[("Excel Files", "*.xlsx"), ("CSV Files", "*.csv"), ("Parquet Files", "*.parquet"), ("All Files", "*.*")]
         )
         
         if file_path:
-            # 禁用所有导出按钮
-            for child in self.root.winfo_children():
-                if isinstance(child, ttk.Button) and ("导出" in child["text"]):
-                    child["state"] = "disabled"
-
-            # 创建自定义StreamExporter子类用于日志输出
             from utils import StreamExporter
-            
-            # 创建队列用于线程间通信
-            self.stream_queue = queue.Queue()
-
-            def export_in_thread():
-                try:
-                    class UIStreamExporter(StreamExporter):
-                        def __init__(self, sql_query, output_file, queue=None):
-                            super().__init__(sql_query, output_file)
-                            self.queue = queue
-                            self.last_update_time = 0
-
-                        def export(self):
-                            try:
-                                cursor = self.utils.get_cursor()
-                                self.get_total_records(cursor)
-                                self.init_excel_writer()
-
-                                cursor.execute(self.sql_query)
-                                columns = [desc[0] for desc in cursor.description]
-                                
-                                df = pd.DataFrame(columns=columns)
-                                df.to_excel(self.writer, sheet_name='Data', index=False, startrow=0)
-                                self.worksheet = self.writer.sheets['Data']
-                                
-                                for col_num, value in enumerate(columns):
-                                    self.worksheet.write(0, col_num, value, self.header_format)
-                                
-                                self.worksheet.set_column(0, len(columns) - 1, 20)
-                                self.worksheet.freeze_panes(1, 0)
-                                
-                                row = 1
-                                processed = 0
-                                
-                                while True:
-                                    results = cursor.fetchmany(self.chunk_size)
-                                    if not results:
-                                        break
-                                        
-                                    df = pd.DataFrame(results, columns=columns)
-                                    
-                                    for col in df.columns:
-                                        try:
-                                            df[col] = pd.to_numeric(df[col])
-                                        except (ValueError, TypeError):
-                                            continue
-                                    
-                                    for r_idx, data_row in enumerate(df.values):
-                                        for c_idx, value in enumerate(data_row):
-                                            if pd.isna(value) or (isinstance(value, float) and (value == float('inf') or value == float('-inf'))):
-                                                value = None
-                                            self.worksheet.write(row + r_idx, c_idx, value, self.body_format)
-                                    
-                                    row += len(results)
-                                    processed += len(results)
-                                    
-                                    # 每隔一秒更新一次进度
-                                    current_time = time.time()
-                                    if current_time - self.last_update_time >= 1:
-                                        progress = processed/self.total_records
-                                        if self.queue:
-                                            self.queue.put(("progress", f"已导出 {processed}/{self.total_records} 条记录 ({progress:.1%})"))
-                                        self.last_update_time = current_time
-                                
-                                return True
-                                
-                            except Exception as e:
-                                if self.queue:
-                                    self.queue.put(("error", f"导出失败: {str(e)}"))
-                                raise
-                            finally:
-                                if self.writer:
-                                    self.writer.close()
-
-                    exporter = UIStreamExporter(sql_text, file_path, queue=self.stream_queue)
-                    exporter.utils = self.hana_utils  # 使用已有的数据库连接
-                    exporter.export()
-                    self.stream_queue.put(("success", f"结果已导出到: {file_path}"))
-                except Exception as e:
-                    self.stream_queue.put(("error", f"导出失败: {str(e)}"))
-                finally:
-                    self.stream_queue.put(("done", None))
-
-            def check_export_status():
-                try:
-                    while not self.stream_queue.empty():
-                        msg_type, content = self.stream_queue.get_nowait()
-                        
-                        if msg_type in ["info", "progress", "success", "error"]:
-                            self.log_message(content)
-                        elif msg_type == "done":
-                            # 启用所有导出按钮
-                            for child in self.root.winfo_children():
-                                if isinstance(child, ttk.Button) and ("导出" in child["text"]):
-                                    child["state"] = "normal"
-                            return
-                            
-                    # 继续检查
-                    self.root.after(100, check_export_status)
-                except queue.Empty:
-                    # 继续检查
-                    self.root.after(100, check_export_status)
+            if self.export_from_preview(result_text, sql_text, f"流式导出 {os.path.basename(file_path)}", file_path,
+                                        lambda: StreamExporter(sql_text, file_path), 'stream'):
+                return
 
-            # 创建并启动后台线程
-            thread = threading.Thread(target=export_in_thread)
-            thread.daemon = True
-            thread.start()
+            class UIStreamExporter(StreamExporter):
+                def __init__(self, sql_query, output_file, queue=None, job=None):
+                    super().__init__(sql_query, output_file)
+                    self.queue = queue
+                    self.job = job
+                    self.last_update_time = 0
+                    if queue:
+                        self.finalize_callback = lambda done, total: queue.put(
+                            ("progress", f"正在生成文件 ({done / max(total, 1):.0%})"))
 
-            # 开始检查导出状态
-            self.root.after(100, check_export_status)
+                def report_progress(self, processed):
+                    if self.job:
+                        self.job.update(processed, self.total_records)
+                    # 每隔一秒更新一次进度
+                    current_time = time.time()
+                    if current_time - self.last_update_time >= 1:
+                        progress = processed/self.total_records
+                        if self.queue:
+                            self.queue.put(("progress", f"已导出 {processed}/{self.total_records} 条记录 ({progress:.1%})"))
+                        self.last_update_time = current_time
+
+            def run(job, utils, channel):
+                exporter = UIStreamExporter(sql_text, file_path, queue=channel, job=job)
+                exporter.utils = utils  # 使用连接池中的连接
+                job.attach(exporter)
+                exporter.export()
+                return f"结果已导出到: {file_path}，{exporter.governor.summary()}"
+
+            self.submit_export(f"流式导出 {os.path.basename(file_path)}", file_path, run, sql_text, 'stream')
 
     def export_all(self):
         """直接导出所有数据"""
@@ -1071,54 +2116,403 @@ class HanaQueryAnalyzer:
         )
         
         if file_path:
-            # 禁用导出按钮
-            for child in self.root.winfo_children():
-                if isinstance(child, ttk.Button) and ("导出" in child["text"]):
-                    child["state"] = "disabled"
-
-            # 创建队列用于线程间通信
-            self.export_queue = queue.Queue()
-
-            def export_in_thread():
-                try:
-                    # 创建Excel导出器实例
-                    from utils import ExcelExporter
-                    exporter = ExcelExporter(sql_text, file_path)
-                    exporter.utils = self.hana_utils  # 使用已有的数据库连接
-                    exporter.export_all()
-                    self.export_queue.put(("success", f"结果已直接导出到: {file_path}"))
-                except Exception as e:
-                    self.export_queue.put(("error", f"直接导出失败: {str(e)}"))
-                finally:
-                    self.export_queue.put(("done", None))
-
-            def check_export_status():
-                try:
-                    while not self.export_queue.empty():
-                        msg_type, content = self.export_queue.get_nowait()
-                        
-                        if msg_type in ["info", "progress", "success", "error"]:
-                            self.log_message(content)
-                        elif msg_type == "done":
-                            # 启用所有导出按钮
-                            for child in self.root.winfo_children():
-                                if isinstance(child, ttk.Button) and ("导出" in child["text"]):
-                                    child["state"] = "normal"
-                            return
-                            
-                    # 继续检查
-                    self.root.after(100, check_export_status)
-                except queue.Empty:
-                    # 继续检查
-                    self.root.after(100, check_export_status)
+            from utils import ExcelExporter
+            if self.export_from_preview(result_text, sql_text, f"直接导出 {os.path.basename(file_path)}", file_path,
+                                        lambda: ExcelExporter(sql_text, file_path), 'all'):
+                return
+
+            def run(job, utils, channel):
+                exporter = ExcelExporter(sql_text, file_path)
+                exporter.utils = utils  # 使用连接池中的连接
+                exporter.finalize_callback = lambda done, total: channel.put(
+                    ("progress", f"正在生成文件 ({done / max(total, 1):.0%})"))
+                job.attach(exporter)
+                exporter.export_all()
+                if exporter.metrics:
+                    job.update(exporter.metrics['rows'])
+                return f"结果已直接导出到: {file_path}，{exporter.governor.summary()}"
 
-            # 创建并启动后台线程
-            thread = threading.Thread(target=export_in_thread)
-            thread.daemon = True
-            thread.start()
+            self.submit_export(f"直接导出 {os.path.basename(file_path)}", file_path, run, sql_text, 'all')
+        
+    def get_export_manager(self):
+        """获取导出任务队列，首次使用时创建，任务在连接池的连接上运行"""
+        if self.export_manager is None:
+            panel_channel = self.ui_dispatcher.open(lambda messages: self._refresh_export_panel())
+            self.export_manager = ExportJobManager(
+                pool=self.get_connection_pool(),
+                on_change=lambda job: panel_channel.put(("progress", job.id))
+            )
+        return self.export_manager
+        
+    def submit_export(self, label, output, run, sql_text=None, export_mode=None, connection=True, on_finish=None):
+        """把导出加入任务队列，run(job, utils, channel)返回完成信息，日志写入当前标签页并记入查询历史
+
+        connection为False时不占用连接池的连接；on_finish在任务结束后于界面线程调用。
+        借用的连接使用提交时标签页会话的schema和隔离级别，归还前恢复默认设置。
+        """
+        _, result_text, log_text = self.get_current_tab_widgets()
+        settings = (result_text.session.isolation, result_text.session.schema)
+        
+        def handle(messages):
+            self.log_messages(
+                [content for msg_type, content in messages if msg_type in ["info", "progress", "success", "error"]],
+                log_text)
+            if on_finish is not None and any(msg_type == "done" for msg_type, _ in messages):
+                on_finish()
+        
+        channel = self.ui_dispatcher.open(handle)
+        
+        def target(job, utils):
+            error = None
+            try:
+                if utils is not None:
+                    QuerySession.apply_settings(utils, *settings)
+                message = run(job, utils, channel)
+                channel.put(("success", message))
+                return message
+            except Exception as e:
+                error = "导出已取消" if job.cancelled else str(e)
+                channel.put(("error", "导出已取消" if job.cancelled else f"导出失败: {str(e)}"))
+                raise
+            finally:
+                if utils is not None:
+                    QuerySession.reset_settings(utils, settings)
+                if sql_text:
+                    nbytes = os.path.getsize(output) if os.path.isfile(output) else None
+                    self._record_history('export', sql_text, fetch_seconds=time.time() - job.started,
+                                         rows=job.rows, nbytes=nbytes, export_mode=export_mode,
+                                         output=output, error=error)
+                channel.put(("done", None))
+        
+        manager = self.get_export_manager()
+        job = manager.submit(label, target, output, priority=self.export_priority_var.get(), connection=connection)
+        self.export_channels[job.id] = channel
+        queued = "（优先）" if job.priority else ""
+        self.log_message(f"导出任务 #{job.id}{queued} 已加入队列: {label}，"
+                         f"同时运行 {manager.concurrency} 个任务")
+        self.show_export_panel()
+        return job
+        
+    def export_from_preview(self, result_text, sql_text, label, file_path, make_exporter, export_mode):
+        """导出的SQL与标签页的预览查询相同时直接使用预览结果，返回是否已提交导出
 
-            # 开始检查导出状态
-            self.root.after(100, check_export_status)
+        预览已包含完整结果时只写出内存中的数据，不访问数据库；预览游标仍保留时写出已加载的行后
+        从该游标继续获取，不重新执行查询。含LOB列的结果在预览中被截断，仍在数据库上重新导出。
+        make_exporter()创建尚未连接的StreamExporter或ExcelExporter。
+        """
+        preview = result_text.preview_result
+        store = result_text.virtual_grid.rows
+        session = result_text.session
+        if (preview is None or session.running or result_text.pushdown_applied or preview.lobs is not None
+                or not isinstance(store, ResultStore) or store.total_rows != preview.fetched):
+            return False
+        # 导出器会去掉末尾分号和LIMIT子句，两者的SQL完全相同时结果才一致
+        if not result_text.base_text or make_exporter().sql_query != result_text.base_text.strip().rstrip(';').strip():
+            return False
+        continuing = not preview.complete
+        if continuing and preview.closed:
+            return False
+        
+        # 导出期间标签页的会话和结果集由导出任务使用，不能执行新查询或继续加载
+        session.running = True
+        session.stop_requested = False
+        if continuing:
+            result_text.preview_cursor = None
+            result_text.preview_result = None
+        self._update_tab_controls()
+        loaded = store.total_rows
+        source = 'cursor' if continuing else 'preview'
+        
+        def batches(job, channel):
+            # 先写出已加载的行，游标仍保留时再继续获取
+            cursor_batches = iter(lambda: preview.fetch(self.preview_max_batch), []) if continuing else ()
+            rows = 0
+            last_update = time.time()
+            for batch in itertools.chain(store.iter_batches(), cursor_batches):
+                if session.stop_requested:
+                    # 终止按钮在导出期间用于取消导出
+                    self.export_manager.cancel(job)
+                    raise Exception("导出已取消")
+                if not isinstance(batch, ColumnBatch):
+                    batch = ColumnBatch.from_rows(preview.columns, batch)
+                yield batch
+                rows += len(batch)
+                job.update(rows, None if continuing else loaded)
+                # 每隔一秒更新一次进度
+                if time.time() - last_update >= 1:
+                    channel.put(("progress", f"已导出 {rows} 条记录"))
+                    last_update = time.time()
+        
+        def run(job, utils, channel):
+            exporter = make_exporter()
+            job.attach(exporter)
+            if continuing:
+                channel.put(("info", f"从预览游标继续导出，已加载的 {loaded} 条记录直接写出，不重新执行查询"))
+            else:
+                channel.put(("info", f"预览已包含全部 {loaded} 条记录，直接导出已加载的数据，不访问数据库"))
+            try:
+                exporter.export_batches(store.columns, batches(job, channel), source=source)
+            finally:
+                if continuing:
+                    preview.close()
+            return f"结果已导出到: {file_path}，共 {exporter.metrics['rows']} 条记录"
+        
+        def on_finish():
+            if continuing:
+                preview.close()
+            session.running = False
+            if result_text.closed:
+                self._release_tab_resources(result_text)
+                return
+            self._update_tab_controls()
+            self._update_result_status(result_text)
+            if continuing:
+                result_text.status_label.configure(
+                    text=f"已加载 {store.total_rows} 行，预览游标已用于导出，重新执行查询可查看更多")
+        
+        self.submit_export(label, file_path, run, sql_text, f"{export_mode}-{source}",
+                           connection=False, on_finish=on_finish)
+        return True
+        
+    def cancel_export_job(self, job):
+        """取消导出任务，排队中的任务直接结束其日志通道"""
+        if not self.get_export_manager().cancel(job):
+            return
+        if job.started is None:
+            channel = self.export_channels.get(job.id)
+            if channel is not None:
+                channel.put(("info", f"导出任务 #{job.id} 已取消: {job.label}"))
+                channel.put(("done", None))
+        else:
+            self.log_message(f"正在取消导出任务 #{job.id}: {job.label}")
+        
+    def show_export_panel(self):
+        """显示导出任务列表窗口"""
+        if self.export_panel is None or not self.export_panel.winfo_exists():
+            self.export_panel = ExportJobPanel(self.root, self.get_export_manager(), self.cancel_export_job)
+        else:
+            self.export_panel.deiconify()
+            self.export_panel.lift()
+        self.export_panel.refresh()
+        
+    def _record_history(self, kind, sql, params=None, **kwargs):
+        """写入一条查询历史，未启用时忽略；可在后台线程中调用"""
+        if self.query_history is not None:
+            self.query_history.record(kind, sql, params, **kwargs)
+        
+    def show_query_history(self):
+        """显示查询历史窗口"""
+        if self.query_history is None:
+            self.log_message("查询历史未启用（QUERY_HISTORY_DB为空或无法打开）")
+            return
+        if self.query_history_panel is None or not self.query_history_panel.winfo_exists():
+            self.query_history_panel = QueryHistoryPanel(self.root, self.query_history, self.open_sql_in_new_tab)
+        else:
+            self.query_history_panel.deiconify()
+            self.query_history_panel.lift()
+        self.query_history_panel.search()
+        
+    def open_sql_in_new_tab(self, sql_text):
+        """在新标签页中打开历史语句"""
+        if len(self.notebook.tabs()) >= self.MAX_TABS:
+            self.log_message(f"最多打开{self.MAX_TABS}个标签页，请先关闭不用的标签页")
+            return
+        self.add_tab()
+        self.notebook.select(self.notebook.tabs()[-1])
+        sql_input, _, _ = self.get_current_tab_widgets()
+        sql_input.insert("1.0", sql_text)
+        sql_input.line_numbers.schedule_refresh()
+        if self.highlight_enabled:
+            self.highlight_sql()
+        self.log_message("已从查询历史打开语句")
+        
+    def _refresh_export_panel(self):
+        for job in self.export_manager.jobs:
+            if not job.active:
+                channel = self.export_channels.pop(job.id, None)
+                if channel is not None and job.started is None and job.status == 'failed':
+                    # 未拿到连接就失败的任务没有运行导出，由这里结束其日志通道
+                    channel.put(("error", f"导出失败: {job.error}"))
+                    channel.put(("done", None))
+        if self.export_panel is not None and self.export_panel.winfo_exists():
+            self.export_panel.refresh()
+        
+    def get_connection_pool(self):
+        """获取并发任务使用的连接池"""
+        if self.connection_pool is None:
+            self.connection_pool = ConnectionPool()
+            self.keepalive.register(self.connection_pool)
+        return self.connection_pool
+        
+    def get_session_pool(self):
+        """获取标签页会话的连接池：容量与标签页数量上限相同，每个标签页最多占用一个连接，
+        在界面线程中借用连接时不会因连接用尽而等待"""
+        if self.session_pool is None:
+            self.session_pool = ConnectionPool(size=self.MAX_TABS)
+            self.keepalive.register(self.session_pool)
+        return self.session_pool
+        
+    def sweep_export(self):
+        """同一SQL按多组参数并发导出，每组一个文件或一个工作表"""
+        sql_input, _, _ = self.get_current_tab_widgets()
+        if not sql_input:
+            return
+        sql_text = sql_input.get("1.0", tk.END).strip()
+        if not sql_text:
+            self.log_message("没有SQL语句可执行")
+            return
+        placeholders = self.get_placeholders(sql_text)
+        if not placeholders:
+            self.log_message("SQL中没有占位符，请使用普通导出")
+            return
+        
+        options = self.show_sweep_dialog(placeholders)
+        if options is None:
+            self.log_message("已取消导出")
+            return
+        param_sets, per_sheet, workers = options
+        
+        if per_sheet:
+            output = filedialog.asksaveasfilename(
+                defaultextension=".xlsx",
+                filetypes=[("Excel Files", "*.xlsx"), ("All Files", "*.*")]
+            )
+        else:
+            output = filedialog.askdirectory(title="选择导出目录")
+        if not output:
+            return
+        
+        _, result_text, log_text = self.get_current_tab_widgets()
+        session = result_text.session
+        last_logged = {}
+        start_time = time.time()
+        
+        def handle(messages):
+            logs = []
+            # 参数组的事件包装为("sweep", ...)消息，避免与任务结束的"done"混淆
+            for event, index, info in (content for msg_type, content in messages if msg_type == "sweep"):
+                label = sweep.labels[index] if index is not None else ""
+                if event == "start":
+                    logs.append(f"[{index + 1}/{total}] {label} 开始导出")
+                elif event == "rows":
+                    # 每组最多每2秒输出一次进度
+                    now = time.time()
+                    if now - last_logged.get(index, 0) >= 2:
+                        last_logged[index] = now
+                        logs.append(f"[{index + 1}/{total}] {label} 已导出 {info} 条记录")
+                elif event == "done":
+                    logs.append(f"[{index + 1}/{total}] {label} 完成，{info['rows']} 条记录，耗时 {info['seconds']:.2f}秒")
+                elif event == "error":
+                    logs.append(f"[{index + 1}/{total}] {label} 失败: {info['error']}")
+                elif event == "failed":
+                    logs.append(f"参数批量导出失败: {info}")
+                elif event == "finished":
+                    failed = [r['label'] for r in sweep.results if r and r['error']]
+                    logs.append(f"参数批量导出结束：成功 {total - len(failed)} 组，失败 {len(failed)} 组，"
+                                f"总耗时 {time.time() - start_time:.2f}秒，{sweep.governor.summary()}，输出: {output}")
+                    if failed:
+                        logs.append("失败的参数组: " + ", ".join(failed))
+            self.log_messages(logs, log_text)
+        
+        channel = self.ui_dispatcher.open(handle)
+        
+        def progress(event, index, info):
+            if event in ("done", "error"):
+                # 每组参数各记一条查询历史
+                _, query, query_params = sweep.queries[index]
+                self._record_history('export', query, query_params, fetch_seconds=info['seconds'],
+                                     rows=info['rows'], export_mode='sweep', output=info['output'],
+                                     error=info['error'])
+            channel.put(("sweep", (event, index, info)))
+        
+        sweep = ParameterSweep(
+            sql_text, param_sets, output,
+            per_sheet=per_sheet,
+            pool=self.get_connection_pool(),
+            workers=workers,
+            progress_callback=progress,
+            settings=(session.isolation, session.schema)
+        )
+        total = len(param_sets)
+        self.log_message(f"开始参数批量导出：{total} 组参数，{sweep.workers} 个并发连接")
+        
+        def sweep_in_thread():
+            try:
+                sweep.run()
+                channel.put(("sweep", ("finished", None, None)))
+            except Exception as e:
+                channel.put(("sweep", ("failed", None, str(e))))
+            finally:
+                channel.put(("done", None))
+        
+        thread = threading.Thread(target=sweep_in_thread)
+        thread.daemon = True
+        thread.start()
+        
+    def show_sweep_dialog(self, placeholders):
+        """参数批量导出对话框：编辑或加载参数组，选择输出方式和并发数"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("参数批量导出")
+        dialog.geometry("520x460")
+        dialog.transient(self.root)
+        dialog.grab_set()
+        
+        ttk.Label(dialog, text="每行一组参数，第一行为参数名，逗号分隔（CSV格式）").pack(anchor=tk.W, padx=10, pady=(10, 2))
+        text = scrolledtext.ScrolledText(dialog, wrap=tk.NONE, height=14)
+        text.pack(fill=tk.BOTH, expand=True, padx=10)
+        header = ",".join(placeholders)
+        # 用上次对话框中的参数值预填一行
+        sample = ",".join(self.param_cache.get(name, "") for name in placeholders)
+        text.insert("1.0", header + "\n" + (sample + "\n" if sample.strip(",") else ""))
+        
+        options_frame = ttk.Frame(dialog)
+        options_frame.pack(fill=tk.X, padx=10, pady=5)
+        per_sheet_var = tk.BooleanVar(value=False)
+        ttk.Radiobutton(options_frame, text="每组一个文件", variable=per_sheet_var, value=False).pack(side=tk.LEFT)
+        ttk.Radiobutton(options_frame, text="每组一个工作表", variable=per_sheet_var, value=True).pack(side=tk.LEFT, padx=10)
+        pool_size = self.get_connection_pool().size
+        ttk.Label(options_frame, text="并发数:").pack(side=tk.LEFT, padx=(10, 2))
+        workers_var = tk.IntVar(value=pool_size)
+        ttk.Spinbox(options_frame, from_=1, to=pool_size, textvariable=workers_var, width=5).pack(side=tk.LEFT)
+        
+        dialog.result = None
+        
+        def on_load():
+            path = filedialog.askopenfilename(parent=dialog, filetypes=[("CSV Files", "*.csv"), ("All Files", "*.*")])
+            if path:
+                with open(path, 'r', encoding='utf-8-sig') as f:
+                    content = f.read()
+                text.delete("1.0", tk.END)
+                text.insert("1.0", content)
+        
+        def on_ok():
+            try:
+                names, param_sets = parse_parameter_sets(text.get("1.0", tk.END))
+            except ValueError as e:
+                self.log_message(f"参数组格式错误: {str(e)}")
+                return
+            missing = [name for name in placeholders if name not in names]
+            if missing:
+                self.log_message("参数组缺少参数: " + ", ".join(missing))
+                return
+            if not param_sets:
+                self.log_message("请至少输入一组参数")
+                return
+            try:
+                workers = max(1, min(int(workers_var.get()), pool_size))
+            except (tk.TclError, ValueError):
+                workers = pool_size
+            dialog.result = (param_sets, per_sheet_var.get(), workers)
+            dialog.destroy()
+        
+        button_frame = ttk.Frame(dialog)
+        button_frame.pack(fill=tk.X, padx=10, pady=10)
+        ttk.Button(button_frame, text="从CSV加载", command=on_load, width=15).pack(side=tk.LEFT)
+        ttk.Button(button_frame, text="取消", command=dialog.destroy, width=15).pack(side=tk.RIGHT)
+        ttk.Button(button_frame, text="开始导出", command=on_ok, style="Accent.TButton", width=15).pack(side=tk.RIGHT, padx=10)
+        
+        dialog.wait_window()
+        return dialog.result
         
     def export_results(self):
         # 获取当前标签页的SQL输入框和结果区域
@@ -1156,18 +2550,14 @@ class HanaQueryAnalyzer:
         )
         
         if file_path:
-            # 禁用导出按钮
-            for child in self.root.winfo_children():
-                if isinstance(child, ttk.Button) and ("导出" in child["text"]):
-                    child["state"] = "disabled"
-                    if child["text"] == "分页导出 (F12)":
-                        export_button = child
-
             # 创建自定义ExcelExporter子类用于日志输出
             from utils import ExcelExporter
+            if self.export_from_preview(result_text, sql_text, f"分页导出 {os.path.basename(file_path)}", file_path,
+                                        lambda: ExcelExporter(sql_text, file_path), 'paged'):
+                return
             
             class UIExcelExporter(ExcelExporter):
-                def __init__(self, sql_query, output_file, page_size=None, log_text=None, queue=None):
+                def __init__(self, sql_query, output_file, page_size=None, log_text=None, queue=None, job=None):
                     # 创建回调函数用于日志输出
                     def log_callback(message):
                         if queue:
@@ -1176,6 +2566,7 @@ class HanaQueryAnalyzer:
                     super().__init__(sql_query, output_file, page_size, log_callback=log_callback)
                     self.log_text = log_text
                     self.queue = queue
+                    self.job = job
                     
                 def get_total_records(self, cursor=None):
                     total = super().get_total_records(cursor)
@@ -1184,63 +2575,26 @@ class HanaQueryAnalyzer:
                     return total
                 
                 def export_page(self, cursor):
-                    if hasattr(self, 'last_update_time'):
-                        current_time = time.time()
-                        # 每5秒更新一次进度,避免过于频繁的UI更新
-                        if current_time - self.last_update_time < 5:
-                            super().export_page(cursor)
-                            return
-                    else:
-                        self.last_update_time = time.time()
-                    
                     super().export_page(cursor)
                     processed = min(self.current_offset, self.total_records)
-                    if self.queue:
-                        progress = processed/self.total_records
-                        self.queue.put(("progress", f"已导出 {processed}/{self.total_records} 条记录 ({progress:.1%})"))
-                        self.last_update_time = time.time()
-
-            # 创建队列用于线程间通信
-            self.export_queue = queue.Queue()
-
-            def export_in_thread():
-                try:
-                    exporter = UIExcelExporter(sql_text, file_path, queue=self.export_queue)
-                    exporter.utils = self.hana_utils  # 使用已有的数据库连接
-                    exporter.export()
-                    self.export_queue.put(("success", f"结果已导出到: {file_path}"))
-                except Exception as e:
-                    self.export_queue.put(("error", f"导出失败: {str(e)}"))
-                finally:
-                    self.export_queue.put(("done", None))
-
-            def check_export_status():
-                try:
-                    while not self.export_queue.empty():
-                        msg_type, content = self.export_queue.get_nowait()
-                        
-                        if msg_type in ["info", "progress", "success", "error"]:
-                            self.log_message(content)
-                        elif msg_type == "done":
-                            # 启用所有导出按钮
-                            for child in self.root.winfo_children():
-                                if isinstance(child, ttk.Button) and ("导出" in child["text"]):
-                                    child["state"] = "normal"
-                            return
-                            
-                    # 继续检查
-                    self.root.after(100, check_export_status)
-                except queue.Empty:
-                    # 继续检查
-                    self.root.after(100, check_export_status)
+                    if self.job:
+                        self.job.update(processed, self.total_records)
+                    # 每5秒输出一次进度日志，避免日志过多
+                    current_time = time.time()
+                    if current_time - getattr(self, 'last_update_time', 0) >= 5:
+                        if self.queue:
+                            progress = processed/self.total_records
+                            self.queue.put(("progress", f"已导出 {processed}/{self.total_records} 条记录 ({progress:.1%})"))
+                        self.last_update_time = current_time
 
-            # 创建并启动后台线程
-            thread = threading.Thread(target=export_in_thread)
-            thread.daemon = True
-            thread.start()
+            def run(job, utils, channel):
+                exporter = UIExcelExporter(sql_text, file_path, queue=channel, job=job)
+                exporter.utils = utils  # 使用连接池中的连接
+                job.attach(exporter)
+                exporter.export()
+                return f"结果已导出到: {file_path}，{exporter.governor.summary()}"
 
-            # 开始检查导出状态
-            self.root.after(100, check_export_status)
+            self.submit_export(f"分页导出 {os.path.basename(file_path)}", file_path, run, sql_text, 'paged')
         
     def close_tab(self):
         """关闭当前标签页"""
@@ -1265,6 +2619,15 @@ class HanaQueryAnalyzer:
                 if save:  # 用户选择保存
                     self.save_sql()
         
+        # 关闭该标签页保留的预览游标、结果临时文件和数据库会话；
+        # 查询仍在执行时先终止，查询线程结束后再释放
+        result_text = current_tab.result_text
+        result_text.closed = True
+        if result_text.session.running:
+            result_text.session.stop_requested = True
+        else:
+            self._release_tab_resources(result_text)
+        
         # 从文件路径映射中移除该标签页
         if current_tab in self.tab_file_paths:
             del self.tab_file_paths[current_tab]
@@ -1273,6 +2636,11 @@ class HanaQueryAnalyzer:
         self.notebook.forget(current_tab)
         self.log_message("已关闭当前标签页")
         
+    def _release_tab_resources(self, result_text):
+        self.close_preview_cursor(result_text)
+        self.release_result_store(result_text)
+        result_text.session.close()
+        
     def clear_sql(self):
         # 清空当前查询窗口的SQL文本
         sql_input, _, _ = self.get_current_tab_widgets()
@@ -1281,47 +2649,50 @@ class HanaQueryAnalyzer:
             self.log_message("已清空查询语句")
             
     def check_connection_status(self):
-        """检查数据库实际连接状态"""
-        try:
-            # 尝试执行一个简单的查询来验证连接
-            if hasattr(self.hana_utils, '_connection') and self.hana_utils._connection:
-                cursor = self.hana_utils.get_cursor()
-                cursor.execute("SELECT 1 FROM DUMMY")
-                cursor.fetchone()
-                return True
-        except Exception:
+        """检查当前标签页会话的实际连接状态"""
+        _, result_text, _ = self.get_current_tab_widgets()
+        if result_text is None:
             return False
-        return False
+        session = result_text.session
+        if session.running:
+            # 查询执行中不在同一连接上再发查询，只检查客户端状态
+            return session.is_connected()
+        return session.check()
 
     def update_connection_button(self):
         """更新连接按钮状态和文本"""
-        is_connected = self.check_connection_status()
+        _, result_text, _ = self.get_current_tab_widgets()
+        is_connected = result_text is not None and result_text.session.is_connected()
         self.connected = is_connected
         self.connect_button.configure(
             text="断开数据库" if is_connected else "连接数据库"
         )
 
     def connect_disconnect_db(self):
-        """连接或断开数据库"""
+        """连接或断开当前标签页的数据库会话"""
+        _, result_text, _ = self.get_current_tab_widgets()
+        if result_text is None:
+            return
+        session = result_text.session
+        if session.running:
+            self.log_message("查询正在执行，请先终止查询")
+            return
         current_status = self.check_connection_status()
         
         if not current_status:
             try:
                 # 尝试连接数据库
-                self.hana_utils.connect()
-                if self.check_connection_status():
-                    self.connected = True
-                    self.log_message("数据库连接成功")
-                else:
-                    self.connected = False
-                    self.log_message("数据库连接失败：无法验证连接")
+                session.connect(timeout=0)
+                self.connected = True
+                self.log_message(f"数据库连接成功（{session.mode}）")
             except Exception as e:
                 self.connected = False
                 self.log_message(str(e))
         else:
             try:
-                # 尝试断开连接
-                self.hana_utils.disconnect()
+                # 预览游标属于该连接，断开前先关闭
+                self.close_preview_cursor(result_text, reason="数据库已断开")
+                session.close()
                 self.connected = False
                 self.log_message("数据库已断开连接")
             except Exception as e:
@@ -1330,7 +2701,7 @@ class HanaQueryAnalyzer:
                 self.connected = self.check_connection_status()
 
         # 更新按钮状态
-        self.update_connection_button()
+        self._update_tab_controls()
                 
     def create_menu(self):
         # 创建菜单栏
@@ -1338,7 +2709,15 @@ class HanaQueryAnalyzer:
         
     def sort_column(self, tree, col):
         """列排序功能"""
-        if not self._all_data:
+        grid = tree.virtual_grid
+        if tree.filter_bar.pushdown_enabled and tree.base_sql:
+            # 服务器端模式：对完整结果集排序，同一列再次点击切换升降序
+            col_idx = tree["columns"].index(col)
+            reverse = tree.server_sort is not None and tree.server_sort[0] == col_idx and not tree.server_sort[1]
+            tree.server_sort = (col_idx, reverse)
+            self.run_pushdown_query(tree)
+            return
+        if not grid.rows:
             return
             
         # 更新排序状态
@@ -1351,95 +2730,25 @@ class HanaQueryAnalyzer:
         # 获取列索引
         col_idx = tree["columns"].index(col)
         
-        # 对所有数据进行排序
-        self._all_data.sort(key=lambda x: (x[col_idx] is None, x[col_idx]), reverse=self._sort_reverse)
+        # 使用缓存的排序置换，切换升降序不再重新排序
+        grid.rows.sort(col_idx, reverse=self._sort_reverse)
         
-        # 清除现有显示
-        for item in tree.get_children():
-            tree.delete(item)
-            
-        # 重新显示第一批数据
-        for i, row in enumerate(self._all_data[:self._batch_size]):
-            tag = 'evenrow' if i % 2 == 0 else 'oddrow'
-            tree.insert("", "end", values=row, tags=(tag,))
-
-    def on_scroll(self, event, tree):
-        """处理滚动事件"""
-        if not hasattr(self, '_all_data') or not self._all_data or len(self._all_data) <= self._batch_size:
-            return
-            
-        # 取消之前的清理定时器
-        if hasattr(self, '_cleanup_after_id'):
-            self.root.after_cancel(self._cleanup_after_id)
-            
-        current_items = len(tree.get_children())
-        if current_items >= len(self._all_data):
-            return
-            
-        # 检查是否接近底部
-        first, last = tree.yview()
-        if last > 0.9:
-            self.load_more_data(tree)
-            
-        # 设置新的清理定时器
-        self._cleanup_after_id = self.root.after(5000, lambda: self.clear_tree_memory(tree))
-            
-    def on_mouse_move(self, event, tree):
-        """处理鼠标移动事件，优化滚动和内存使用"""
-        # 取消之前的定时器
-        for timer_id in ['_scroll_after_id', '_cleanup_after_id']:
-            if hasattr(self, timer_id):
-                self.root.after_cancel(getattr(self, timer_id))
-                
-        # 设置新的滚动检查定时器
-        self._scroll_after_id = self.root.after(50, lambda: self.check_scroll_position(tree))
-        # 设置新的内存清理定时器
-        self._cleanup_after_id = self.root.after(5000, lambda: self.clear_tree_memory(tree))
-        
-    def on_scrollbar_drag(self, event, tree):
-        """处理滚动条拖动，优化性能和内存使用"""
-        # 取消之前的定时器
-        for timer_id in ['_drag_after_id', '_cleanup_after_id']:
-            if hasattr(self, timer_id):
-                self.root.after_cancel(getattr(self, timer_id))
-                
-        # 设置新的滚动检查定时器
-        self._drag_after_id = self.root.after(50, lambda: self.check_scroll_position(tree))
-        # 设置新的内存清理定时器
-        self._cleanup_after_id = self.root.after(5000, lambda: self.clear_tree_memory(tree))
-        
-    def check_scroll_position(self, tree):
-        """检查滚动位置并按需加载数据"""
-        if not self._all_data:
-            return
-            
-        first, last = tree.yview()
-        if last > 0.7:  # 当滚动到70%时加载更多
-            self.load_more_data(tree)
-            
-    def load_more_data(self, tree):
-        """加载更多数据到显示区域"""
-        current_items = len(tree.get_children())
-        if current_items >= len(self._all_data):
-            return
-            
-        # 计算新的显示范围
-        end_idx = min(current_items + self._batch_size, len(self._all_data))
-        new_data = self._all_data[current_items:end_idx]
-        
-        # 批量插入新数据
-        for i, row in enumerate(new_data, start=current_items):
-            tag = 'evenrow' if i % 2 == 0 else 'oddrow'
-            tree.insert("", "end", values=row, tags=(tag,))
-            
-    def log_message(self, message):
+        # 回到顶部重新绑定可见窗口
+        grid.set_rows(grid.rows)
+
+    def log_message(self, message, log_text=None):
         """记录日志信息"""
-        _, _, log_text = self.get_current_tab_widgets()
-        if not log_text:
+        self.log_messages([message], log_text)
+        
+    def log_messages(self, messages, log_text=None):
+        """一次写入多条日志，未指定日志区域时写入当前标签页"""
+        if log_text is None:
+            _, _, log_text = self.get_current_tab_widgets()
+        if not log_text or not messages or not log_text.winfo_exists():
             return
             
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_text.insert(tk.END, f"[{timestamp}] {message}\n")
+        log_text.insert(tk.END, "".join(f"[{timestamp}] {message}\n" for message in messages))
         log_text.see(tk.END)
         
     def create_results_context_menu(self, tree):
@@ -1459,8 +2768,7 @@ class HanaQueryAnalyzer:
             
     def select_all_results(self, tree):
         """选择所有结果"""
-        for item in tree.get_children():
-            tree.selection_add(item)
+        return tree.virtual_grid.select_all()
             
     def copy_cell_content(self, event, tree):
         """复制单元格内容到剪贴板并显示提示"""
@@ -1487,19 +2795,15 @@ class HanaQueryAnalyzer:
         # 记录日志提示
         self.log_message(f"已复制单元格内容: {value}")
             
-    def clear_tree_memory(self, tree):
-        """清理Treeview的内存使用"""
-        if not hasattr(self, '_all_data') or not self._all_data:
-            return
-            
     def copy_selected_with_headers(self, tree):
         """复制选中行及表头数据到剪贴板"""
         # 确保有列名
         if not hasattr(tree, '_column_names'):
             return
             
-        # 获取选中的行
-        selection = tree.selection()
+        # 获取选中的行（包括滚动到窗口外的行）
+        grid = tree.virtual_grid
+        selection = grid.selected_positions()
         if not selection:
             return
             
@@ -1512,8 +2816,7 @@ class HanaQueryAnalyzer:
         rows.append('\t'.join(headers))
         
         # 添加选中的行
-        for item in selection:
-            values = tree.item(item)['values']
+        for values in grid.rows.take(selection):
             if values:
                 # 将所有值转换为字符串并确保None显示为空字符串
                 values = [str(v) if v is not None else '' for v in values]
@@ -1525,44 +2828,8 @@ class HanaQueryAnalyzer:
         # 复制到剪贴板
         self.root.clipboard_clear()
         self.root.clipboard_append(copy_text)
-            
-        visible_items = tree.get_children()
-        if len(visible_items) <= self._batch_size:
-            return
-            
-        # 获取可见区域的起始和结束位置
-        first, last = tree.yview()
-        total_items = len(visible_items)
-        
-        # 计算可见项目的范围
-        visible_start = int(first * total_items)
-        visible_end = int(last * total_items) + 1
-        
-        # 保留可见区域周围的缓冲区
-        buffer_size = self._batch_size // 2
-        start_idx = max(0, visible_start - buffer_size)
-        end_idx = min(total_items, visible_end + buffer_size)
-        
-        # 删除缓冲区外的项目
-        items_to_keep = visible_items[start_idx:end_idx]
-        items_to_remove = [item for item in visible_items if item not in items_to_keep]
-        
-        if items_to_remove:
-            # 暂时隐藏滚动条避免闪烁
-            if hasattr(tree, 'vsb'):
-                tree.vsb.pack_forget()
-            if hasattr(tree, 'hsb'):
-                tree.hsb.pack_forget()
-            
-            # 批量删除项目
-            for item in items_to_remove:
-                tree.delete(item)
-            
-            # 恢复滚动条
-            if hasattr(tree, 'vsb'):
-                tree.vsb.pack(side=tk.RIGHT, fill=tk.Y)
-            if hasattr(tree, 'hsb'):
-                tree.hsb.pack(fill=tk.X, expand=True)
+        self.log_message(f"已复制 {len(selection)} 行数据")
+        return "break"
         
     def show_parameter_dialog(self, params):
         """显示参数输入对话框"""
@@ -1739,55 +3006,17 @@ class HanaQueryAnalyzer:
         return sql
 
     def toggle_highlight(self):
-        """切换高亮状态并应用高亮"""
+        """切换高亮状态并应用到所有标签页"""
         self.highlight_enabled = not self.highlight_enabled
         
-        # 获取当前标签页的SQL输入框
-        sql_input, _, _ = self.get_current_tab_widgets()
-        if not sql_input:
-            return
-        
-        if self.highlight_enabled:
-            # 强制重置上次内容，确保会触发高亮
-            self._last_content = None
-            self.highlight_sql()  # 直接调用高亮处理
-            self.log_message("SQL高亮已开启")
-        else:
-            # 清除所有高亮标记
-            for tag in sql_input.tag_names():
-                if str(tag).startswith('Token') or tag == "quoted_string":
-                    sql_input.tag_remove(tag, "1.0", tk.END)
-            self.log_message("SQL高亮已关闭")
-
-    def update_line_numbers(self, sql_input, line_numbers):
-        """更新行号"""
-        try:
-            # 获取文本内容并计算行数
-            text_content = sql_input.get("1.0", "end-1c")
-            # 计算实际行数，确保至少有1行
-            num_lines = max(1, text_content.count('\n') + 1)
-            
-            # 生成行号文本，每个行号后加换行符
-            line_numbers_text = '\n'.join(str(i).rjust(3) for i in range(1, num_lines + 1))
-            
-            # 更新行号文本框
-            line_numbers.configure(state='normal')
-            line_numbers.delete("1.0", tk.END)
-            line_numbers.insert("1.0", line_numbers_text)
-            
-            # 如果最后一行不是空行，确保行号区域和文本区域对齐
-            if not text_content.endswith('\n'):
-                line_numbers.insert(tk.END, '\n')
-                
-            line_numbers.configure(state='disabled')
-            
-            # 同步滚动位置
-            sql_input.update_idletasks()
-            line_numbers.update_idletasks()
-            line_numbers.yview_moveto(sql_input.yview()[0])
-            
-        except Exception as e:
-            print(f"Error updating line numbers: {str(e)}")
+        for tab_id in self.notebook.tabs():
+            sql_input = self.notebook.nametowidget(tab_id).sql_input
+            if self.highlight_enabled:
+                sql_input.highlighter.schedule()
+            else:
+                # 清除所有高亮标记和分析状态
+                sql_input.highlighter.clear()
+        self.log_message("SQL高亮已开启" if self.highlight_enabled else "SQL高亮已关闭")
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -1,24 +1,26 @@
 import sys
 import os
 import time
+import multiprocessing
 from datetime import datetime
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                            QHBoxLayout, QLabel, QPushButton, 
                            QTextEdit, QProgressBar, QFileDialog, QComboBox,
                            QSpinBox, QGroupBox, QMessageBox,
                            QListWidget, QSplitter)
-from PyQt6.QtCore import Qt, QThread, pyqtSignal
+from PyQt6.QtCore import Qt, QThread, QPoint, pyqtSignal
 from PyQt6.QtGui import QTextCharFormat, QSyntaxHighlighter, QColor, QShortcut, QKeySequence
 import pandas as pd
 from pygments import lex
 from pygments.lexers.sql import SqlLexer
 from pygments.token import Token
-from utils import ExcelExporter, StreamExporter
+from utils import ExcelExporter, StreamExporter, SqlFile, ConcurrentExport, ConnectionPool, ShardedExporter
 
 class SqlHighlighter(QSyntaxHighlighter):
     """SQL语法高亮类"""
     def __init__(self, parent=None):
         super().__init__(parent)
+        self.lexer = SqlLexer()
         self.setup_formats()
         
     def setup_formats(self):
@@ -41,25 +43,80 @@ class SqlHighlighter(QSyntaxHighlighter):
 
     def highlightBlock(self, text):
         """实现高亮逻辑"""
-        # 使用pygments进行语法分析
-        for token, content in lex(text, SqlLexer()):
+        # 使用pygments进行语法分析，按token顺序累计位置（同一内容多次出现时find会定位错）
+        pos = 0
+        for token, content in lex(text, self.lexer):
             format = self.formats.get(token, None) or self.formats.get(token.parent, None)
             if format is not None:
-                self.setFormat(text.find(content), len(content), format)
+                self.setFormat(pos, len(content), format)
+            pos += len(content)
+
+class LazySqlHighlighter(SqlHighlighter):
+    """只高亮可见区域的文本块，滚动或窗口大小变化时补齐新出现的块"""
+    def __init__(self, editor):
+        super().__init__(editor.document())
+        self.editor = editor
+        self._visible = (0, -1)
+        self._done = set()
+        editor.verticalScrollBar().valueChanged.connect(self.highlight_visible)
+        editor.verticalScrollBar().rangeChanged.connect(self.highlight_visible)
+
+    def reset(self):
+        """设置新文本前调用，避免对整篇文档做语法分析"""
+        self._visible = (0, -1)
+        self._done.clear()
+
+    def highlight_visible(self, *args):
+        viewport = self.editor.viewport()
+        first = self.editor.cursorForPosition(QPoint(0, 0)).blockNumber()
+        last = self.editor.cursorForPosition(QPoint(0, viewport.height() - 1)).blockNumber()
+        self._visible = (first, last)
+        document = self.document()
+        for number in range(first, last + 1):
+            if number not in self._done:
+                self.rehighlightBlock(document.findBlockByNumber(number))
+
+    def highlightBlock(self, text):
+        number = self.currentBlock().blockNumber()
+        if not self._visible[0] <= number <= self._visible[1]:
+            return
+        self._done.add(number)
+        super().highlightBlock(text)
+
+class SqlScanThread(QThread):
+    """后台统计SQL文件中的语句数"""
+    finished_signal = pyqtSignal(str, int)  # 文件路径, 语句数（失败时为-1）
+
+    def __init__(self, sql_file):
+        super().__init__()
+        self.sql_file = sql_file
+
+    def run(self):
+        try:
+            with SqlFile(self.sql_file) as f:
+                count = f.count_statements()
+        except Exception:
+            count = -1
+        self.finished_signal.emit(self.sql_file, count)
 
 class ExportThread(QThread):
     """导出处理线程"""
     progress_signal = pyqtSignal(int, int)  # 当前进度, 总数
+    finalize_signal = pyqtSignal(int, int)  # 保存文件阶段：已完成, 总数
     finished_signal = pyqtSignal(bool, str)  # 是否成功, 消息
 
-    def __init__(self, sql_query, output_file, page_size):
+    def __init__(self, sql_file, output_file, page_size):
         super().__init__()
-        self.sql_query = sql_query
+        self.sql_file = sql_file
         self.output_file = output_file
         self.page_size = page_size
 
     def run(self):
         try:
+            # 在导出线程中直接从映射文件解码SQL，界面线程不再整读一遍
+            with SqlFile(self.sql_file) as f:
+                self.sql_query = f.read_text()
+            
             # 继承ExcelExporter并添加进度通知功能
             class UIExcelExporter(ExcelExporter):
                 def __init__(self, sql_query, output_file, page_size=None, progress_signal=None):
@@ -92,6 +149,7 @@ class ExportThread(QThread):
                         self.last_update_time = current_time
                         
             exporter = UIExcelExporter(self.sql_query, self.output_file, self.page_size, self.progress_signal)
+            exporter.finalize_callback = self.finalize_signal.emit
             # 先连接数据库并初始化
             cursor = exporter.connect()
             total = exporter.get_total_records(cursor)
@@ -102,14 +160,98 @@ class ExportThread(QThread):
                 exporter.export_page(cursor)
             
             exporter.close()
+            exporter.governor.report('paged', self.output_file, min(exporter.current_offset, total))
             
             # 检查SQL是否被修改
             if hasattr(exporter, 'modified_sql'):
-                self.finished_signal.emit(True, f"SQL语句已自动添加ORDER BY子句:\n{exporter.modified_sql}\n\n成功导出到: {os.path.abspath(self.output_file)}")
+                self.finished_signal.emit(True, f"SQL语句已自动添加ORDER BY子句:\n{exporter.modified_sql}\n\n成功导出到: {os.path.abspath(self.output_file)}，{exporter.governor.summary()}")
             else:
-                self.finished_signal.emit(True, f"成功导出到: {os.path.abspath(self.output_file)}")
+                self.finished_signal.emit(True, f"成功导出到: {os.path.abspath(self.output_file)}，{exporter.governor.summary()}")
+        except Exception as e:
+            self.finished_signal.emit(False, f"导出失败: {str(e)}")
+
+class MultiSheetExportThread(QThread):
+    """多个SQL文件并发查询，写入同一个工作簿（每个文件一个工作表）"""
+    progress_signal = pyqtSignal(int, int)  # 已导出行数, 总行数
+    log_signal = pyqtSignal(str)  # 单个查询的进度和耗时
+    finished_signal = pyqtSignal(bool, str)  # 是否成功, 消息
+
+    def __init__(self, sql_files, output_file):
+        super().__init__()
+        self.sql_files = sql_files
+        self.output_file = output_file
+        self.counts = {}
+        self.fetched = {}
+
+    def on_progress(self, event, index, info):
+        """在工作线程中调用，通过信号转发到界面线程"""
+        name = os.path.basename(self.sql_files[index])
+        if event == 'count':
+            self.counts[index] = info
+            self.log_signal.emit(f"{name}: 共 {info} 条记录")
+        elif event == 'rows':
+            self.fetched[index] = info
+            self.progress_signal.emit(sum(self.fetched.values()), max(sum(self.counts.values()), 1))
+        elif event == 'done':
+            self.log_signal.emit(f"{name}: 完成，{info['rows']} 条记录，耗时 {info['seconds']:.2f}秒")
+        elif event == 'error':
+            self.log_signal.emit(f"{name}: 导出失败: {info['error']}")
+
+    def run(self):
+        pool = None
+        try:
+            queries = []
+            for sql_file in self.sql_files:
+                with SqlFile(sql_file) as f:
+                    queries.append((os.path.splitext(os.path.basename(sql_file))[0], f.read_text(), None))
+            
+            # 每个查询使用独立的连接
+            pool = ConnectionPool(min(int(os.getenv('POOL_SIZE', 4)), len(queries)))
+            export = ConcurrentExport(queries, self.output_file, per_sheet=True, pool=pool,
+                                      count_rows=True, progress_callback=self.on_progress)
+            start_time = time.time()
+            results = export.run()
+            
+            failed = [r['label'] for r in results if r['error']]
+            summary = (f"共 {len(results)} 个查询，成功 {len(results) - len(failed)} 个，"
+                       f"总耗时 {time.time() - start_time:.2f}秒，{export.governor.summary()}\n"
+                       f"成功导出到: {os.path.abspath(self.output_file)}")
+            if failed:
+                summary += "\n失败的查询: " + ", ".join(failed)
+            self.finished_signal.emit(not failed, summary)
         except Exception as e:
             self.finished_signal.emit(False, f"导出失败: {str(e)}")
+        finally:
+            if pool is not None:
+                pool.close()
+
+class ShardExportThread(QThread):
+    """多进程分片导出线程：依次导出每个SQL文件到各自的分片目录"""
+    progress_signal = pyqtSignal(int, int)  # 已取数行数, 总行数
+    log_signal = pyqtSignal(str)
+    finished_signal = pyqtSignal(bool, str)  # 是否成功, 消息
+
+    def __init__(self, sql_files):
+        super().__init__()
+        self.sql_files = sql_files
+
+    def run(self):
+        try:
+            manifests = []
+            for sql_file in self.sql_files:
+                with SqlFile(sql_file) as f:
+                    sql = f.read_text()
+                output_dir = os.path.splitext(sql_file)[0] + '_shards'
+                exporter = ShardedExporter(sql, output_dir,
+                                           progress_callback=lambda current, total: self.progress_signal.emit(current, total))
+                start_time = time.time()
+                self.log_signal.emit(f"{os.path.basename(sql_file)}: 使用 {exporter.workers} 个写入进程分片导出")
+                manifests.append(exporter.export())
+                self.log_signal.emit(f"{os.path.basename(sql_file)}: 完成，{exporter.total_records} 条记录，"
+                                     f"耗时 {time.time() - start_time:.2f}秒，{exporter.governor.summary()}")
+            self.finished_signal.emit(True, "分片导出完成，分片清单:\n" + "\n".join(manifests))
+        except Exception as e:
+            self.finished_signal.emit(False, f"分片导出失败: {str(e)}")
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -200,9 +342,16 @@ class MainWindow(QMainWindow):
         self.sql_preview = QTextEdit()
         self.sql_preview.setPlaceholderText("SQL预览(点击列表中的文件查看内容)...")
         self.sql_preview.setReadOnly(True)
-        self.sql_preview_highlighter = SqlHighlighter(self.sql_preview.document())
+        self.sql_preview.setLineWrapMode(QTextEdit.LineWrapMode.NoWrap)
+        self.sql_preview_highlighter = LazySqlHighlighter(self.sql_preview)
         self.file_layout.addWidget(self.sql_preview)
         
+        # 预览信息：文件大小、语句数、是否只显示了开头部分
+        self.sql_preview_info = QLabel()
+        self.file_layout.addWidget(self.sql_preview_info)
+        self.preview_kb = int(os.getenv('SQL_PREVIEW_KB', 256))
+        self.scan_threads = {}
+        
         # SQL直接输入界面
         self.input_layout = QVBoxLayout(self.input_widget)
         self.sql_input = QTextEdit()
@@ -242,9 +391,19 @@ class MainWindow(QMainWindow):
         self.page_export_btn.clicked.connect(self.startExport)
         self.export_layout.addWidget(self.page_export_btn)
         
+        self.merge_export_btn = QPushButton("合并导出到一个工作簿(Alt+F12)")
+        self.merge_export_btn.clicked.connect(self.merge_export)
+        self.export_layout.addWidget(self.merge_export_btn)
+        
+        self.shard_export_btn = QPushButton("分片导出(Ctrl+Shift+F12)")
+        self.shard_export_btn.clicked.connect(self.shard_export)
+        self.export_layout.addWidget(self.shard_export_btn)
+        
         # 绑定快捷键
         QShortcut(QKeySequence("F12"), self).activated.connect(self.stream_export)
         QShortcut(QKeySequence("Ctrl+F12"), self).activated.connect(self.startExport)
+        QShortcut(QKeySequence("Alt+F12"), self).activated.connect(self.merge_export)
+        QShortcut(QKeySequence("Ctrl+Shift+F12"), self).activated.connect(self.shard_export)
         
         self.export_group.setLayout(self.export_layout)
         layout.addWidget(self.export_group)
@@ -261,12 +420,42 @@ class MainWindow(QMainWindow):
             self.input_widget.show()
 
     def preview_sql_file(self, item):
-        """预览选中的SQL文件"""
+        """预览选中的SQL文件：只映射并显示开头部分，语句数在后台统计"""
+        sql_file = item.text()
         try:
-            with open(item.text(), 'r', encoding='utf-8') as f:
-                self.sql_preview.setText(f.read())
+            with SqlFile(sql_file) as f:
+                text, truncated = f.head(self.preview_kb * 1024)
+                size = f.size
         except Exception as e:
             QMessageBox.critical(self, "错误", f"无法读取SQL文件: {str(e)}")
+            return
+        
+        self.sql_preview_highlighter.reset()
+        self.sql_preview.setPlainText(text)
+        self.sql_preview_highlighter.highlight_visible()
+        
+        self.preview_info = f"文件大小: {size / 1024 / 1024:.2f} MB"
+        if truncated:
+            self.preview_info += f"，仅预览前 {self.preview_kb} KB"
+        self.sql_preview_info.setText(f"{self.preview_info}，正在统计语句数...")
+        
+        if sql_file not in self.scan_threads:
+            thread = SqlScanThread(sql_file)
+            thread.finished_signal.connect(self.scanFinished)
+            # finished_signal在run()内发出，线程真正结束后才释放引用，避免QThread运行中被回收
+            thread.finished.connect(lambda: self.scan_threads.pop(sql_file, None))
+            self.scan_threads[sql_file] = thread
+            thread.start()
+    
+    def scanFinished(self, sql_file, count):
+        """语句数统计完成，只更新当前预览文件的信息"""
+        current = self.sql_files_list.currentItem()
+        if current is None or current.text() != sql_file:
+            return
+        if count < 0:
+            self.sql_preview_info.setText(f"{self.preview_info}，语句数统计失败")
+        else:
+            self.sql_preview_info.setText(f"{self.preview_info}，共 {count} 条语句")
 
     def selectSQLFile(self):
         """选择多个SQL文件"""
@@ -330,24 +519,22 @@ class MainWindow(QMainWindow):
         sql_file = self.sql_files[self.current_export_index]
         output_file = os.path.splitext(sql_file)[0] + '.xlsx'
         
-        try:
-            with open(sql_file, 'r', encoding='utf-8') as f:
-                sql = f.read()
-        except Exception as e:
-            QMessageBox.critical(self, "错误", f"无法读取SQL文件 {sql_file}: {str(e)}")
+        if not os.path.isfile(sql_file):
+            QMessageBox.critical(self, "错误", f"无法读取SQL文件 {sql_file}: 文件不存在")
             self.current_export_index += 1
             self.export_next_file()
             return
         
-        # 创建并启动导出线程
+        # 创建并启动导出线程（SQL在线程中从文件读取）
         self.export_thread = ExportThread(
-            sql,
+            sql_file,
             output_file,
             self.page_size_input.value()
         )
         
         # 连接信号
         self.export_thread.progress_signal.connect(self.updateProgress)
+        self.export_thread.finalize_signal.connect(self.updateFinalizeProgress)
         self.export_thread.finished_signal.connect(self.exportFinished)
         
         # 禁用导出按钮
@@ -373,6 +560,13 @@ class MainWindow(QMainWindow):
         self.status_label.setText(status_msg)
         self.log_message(status_msg)
 
+    def updateFinalizeProgress(self, current, total):
+        """数据读取完成后显示保存文件（压缩写入）的进度"""
+        progress = int(current / max(total, 1) * 100)
+        self.progress.setValue(progress)
+        file_name = os.path.basename(self.sql_files[self.current_export_index])
+        self.status_label.setText(f"正在生成文件 {file_name}: {progress}%")
+
     def exportFinished(self, success, message):
         """单个文件导出完成处理"""
         if success:
@@ -438,27 +632,26 @@ class MainWindow(QMainWindow):
             return
             
         sql_file = self.sql_files[self.current_export_index]
-        output_file = os.path.splitext(sql_file)[0] + '_stream.xlsx'
+        # FILE_EXTENSION为csv或parquet时流式导出写入对应格式
+        output_file = os.path.splitext(sql_file)[0] + '_stream.' + os.getenv("FILE_EXTENSION", "xlsx")
         
-        try:
-            with open(sql_file, 'r', encoding='utf-8') as f:
-                sql = f.read()
-        except Exception as e:
-            error_msg = f"错误：无法读取SQL文件 {sql_file}: {str(e)}"
+        if not os.path.isfile(sql_file):
+            error_msg = f"错误：无法读取SQL文件 {sql_file}: 文件不存在"
             self.log_message(error_msg)
             QMessageBox.critical(self, "错误", error_msg)
             self.current_export_index += 1
             self.stream_export_next_file()
             return
             
-        # 创建并启动流式导出线程
+        # 创建并启动流式导出线程（SQL在线程中从文件读取）
         self.stream_export_thread = StreamExportThread(
-            sql,
+            sql_file,
             output_file
         )
         
         # 连接信号
         self.stream_export_thread.progress_signal.connect(self.updateProgress)
+        self.stream_export_thread.finalize_signal.connect(self.updateFinalizeProgress)
         self.stream_export_thread.finished_signal.connect(self.streamExportFinished)
         
         # 禁用导出按钮
@@ -498,91 +691,114 @@ class MainWindow(QMainWindow):
             self.status_label.setText("")  # 清空状态标签
             QMessageBox.critical(self, "错误", message)
 
+    def set_export_buttons_enabled(self, enabled):
+        for button in (self.stream_export_btn, self.page_export_btn, self.merge_export_btn, self.shard_export_btn):
+            button.setEnabled(enabled)
+
+    def merge_export(self):
+        """所有选中的SQL文件并发查询，导出到同一个工作簿"""
+        if not hasattr(self, 'sql_files') or not self.sql_files or self.sql_mode_combo.currentText() != "上传SQL文件":
+            QMessageBox.warning(self, "警告", "请先选择SQL文件！")
+            return
+        
+        default_file = os.path.join(os.path.dirname(self.sql_files[0]), "合并导出.xlsx")
+        output_file, _ = QFileDialog.getSaveFileName(self, "保存合并导出的工作簿", default_file, "Excel文件 (*.xlsx)")
+        if not output_file:
+            return
+        
+        self.output_dir = os.path.dirname(os.path.abspath(output_file))
+        self.merge_export_thread = MultiSheetExportThread(list(self.sql_files), output_file)
+        self.merge_export_thread.progress_signal.connect(self.updateMergeProgress)
+        self.merge_export_thread.log_signal.connect(self.log_message)
+        self.merge_export_thread.finished_signal.connect(self.mergeExportFinished)
+        
+        self.set_export_buttons_enabled(False)
+        self.progress.show()
+        self.progress.setValue(0)
+        self.status_label.setText(f"正在合并导出 {len(self.sql_files)} 个查询...")
+        self.log_message(f"开始合并导出 {len(self.sql_files)} 个查询到 {output_file}")
+        self.merge_export_thread.start()
+
+    def updateMergeProgress(self, current, total):
+        """合并导出和分片导出的总进度"""
+        progress = min(int(current / max(total, 1) * 100), 100)
+        self.progress.setValue(progress)
+        self.status_label.setText(f"正在导出: {current}/{total} ({progress}%)")
+
+    def mergeExportFinished(self, success, message):
+        """合并导出和分片导出完成处理"""
+        self.set_export_buttons_enabled(True)
+        self.status_label.setText("")
+        self.log_message(message)
+        if success:
+            self.progress.setValue(100)
+            os.startfile(self.output_dir)  # 在Windows上打开文件夹
+        else:
+            QMessageBox.critical(self, "错误", message)
+
+    def shard_export(self):
+        """多进程分片导出：每个SQL文件导出为一个目录，包含多个xlsx分片和manifest.json"""
+        if not hasattr(self, 'sql_files') or not self.sql_files or self.sql_mode_combo.currentText() != "上传SQL文件":
+            QMessageBox.warning(self, "警告", "请先选择SQL文件！")
+            return
+        
+        self.output_dir = os.path.dirname(os.path.abspath(self.sql_files[0]))
+        self.shard_export_thread = ShardExportThread(list(self.sql_files))
+        self.shard_export_thread.progress_signal.connect(self.updateMergeProgress)
+        self.shard_export_thread.log_signal.connect(self.log_message)
+        self.shard_export_thread.finished_signal.connect(self.mergeExportFinished)
+        
+        self.set_export_buttons_enabled(False)
+        self.progress.show()
+        self.progress.setValue(0)
+        self.log_message(f"开始分片导出 {len(self.sql_files)} 个文件")
+        self.shard_export_thread.start()
+
 class StreamExportThread(QThread):
     """流式导出处理线程"""
     progress_signal = pyqtSignal(int, int)  # 当前进度, 总数
+    finalize_signal = pyqtSignal(int, int)  # 保存文件阶段：已完成, 总数
     finished_signal = pyqtSignal(bool, str)  # 是否成功, 消息
     
-    def __init__(self, sql_query, output_file):
+    def __init__(self, sql_file, output_file):
         super().__init__()
-        self.sql_query = sql_query
+        self.sql_file = sql_file
         self.output_file = output_file
         
     def run(self):
         try:
+            # 在导出线程中直接从映射文件解码SQL，界面线程不再整读一遍
+            with SqlFile(self.sql_file) as f:
+                self.sql_query = f.read_text()
+            
             # 继承StreamExporter添加进度通知功能
             class UIStreamExporter(StreamExporter):
-                def __init__(self, sql_query, output_file, progress_signal=None):
+                def __init__(self, sql_query, output_file, progress_signal=None, finalize_signal=None):
                     super().__init__(sql_query, output_file)
                     self.progress_signal = progress_signal
+                    if finalize_signal:
+                        self.finalize_callback = finalize_signal.emit
                     
-                def export(self):
-                    try:
-                        cursor = self.utils.get_cursor()
-                        self.get_total_records(cursor)
-                        self.init_excel_writer()
-
-                        cursor.execute(self.sql_query)
-                        columns = [desc[0] for desc in cursor.description]
-                        
-                        # 写入表头等初始化操作...
-                        df = pd.DataFrame(columns=columns)
-                        df.to_excel(self.writer, sheet_name='Data', index=False, startrow=0)
-                        self.worksheet = self.writer.sheets['Data']
-                        
-                        for col_num, value in enumerate(columns):
-                            self.worksheet.write(0, col_num, value, self.header_format)
-                        
-                        self.worksheet.set_column(0, len(columns) - 1, 20)
-                        self.worksheet.freeze_panes(1, 0)
-                        
-                        row = 1
-                        processed = 0
-                        
-                        while True:
-                            results = cursor.fetchmany(self.chunk_size)
-                            if not results:
-                                break
-                                
-                            df = pd.DataFrame(results, columns=columns)
-                            
-                            for col in df.columns:
-                                try:
-                                    df[col] = pd.to_numeric(df[col])
-                                except (ValueError, TypeError):
-                                    continue
-                            
-                            for r_idx, data_row in enumerate(df.values):
-                                for c_idx, value in enumerate(data_row):
-                                    if pd.isna(value) or (isinstance(value, float) and (value == float('inf') or value == float('-inf'))):
-                                        value = None
-                                    self.worksheet.write(row + r_idx, c_idx, value, self.body_format)
-                            
-                            row += len(results)
-                            processed += len(results)
-                            
-                            # 发送进度信号
-                            if self.progress_signal:
-                                self.progress_signal.emit(processed, self.total_records)
-                        
-                        return True
-                    finally:
-                        if self.writer:
-                            self.writer.close()
+                def report_progress(self, processed):
+                    # 发送进度信号
+                    if self.progress_signal:
+                        self.progress_signal.emit(processed, self.total_records)
             
             # 使用自定义导出器
-            exporter = UIStreamExporter(self.sql_query, self.output_file, self.progress_signal)
+            exporter = UIStreamExporter(self.sql_query, self.output_file, self.progress_signal, self.finalize_signal)
             exporter.utils.connect()
             
             # 执行导出
             exporter.export()
             
             # 发送成功消息，包含完整的输出路径
-            self.finished_signal.emit(True, f"成功导出到: {os.path.abspath(self.output_file)}")
+            self.finished_signal.emit(True, f"成功导出到: {os.path.abspath(self.output_file)}，{exporter.governor.summary()}")
         except Exception as e:
             self.finished_signal.emit(False, f"导出失败: {str(e)}")
 
 if __name__ == '__main__':
+    # 打包为exe后，分片导出的写入进程需要freeze_support才能正常启动
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     window = MainWindow()
     window.show()
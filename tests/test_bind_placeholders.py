@@ -0,0 +1,36 @@
+from utils import bind_placeholders
+
+
+def test_placeholders_inside_literals_and_comments_are_not_bound():
+    sql, params = bind_placeholders(
+        "SELECT * FROM T WHERE A = '${p}_x' AND B = ? -- ${q}?",
+        {'p': '1', 'q': '2', '第1个参数': '1', '第2个参数': '2'})
+    assert sql == "SELECT * FROM T WHERE A = '1_x' AND B = ? -- ${q}?"
+    assert params == ['1']
+
+
+def test_question_mark_in_literal_is_not_a_marker():
+    sql, params = bind_placeholders("SELECT * FROM T WHERE A = 'what?' AND B = ${p}", {'p': '1', '第1个参数': ''})
+    assert sql == "SELECT * FROM T WHERE A = 'what?' AND B = ?"
+    assert params == ['1']
+
+
+def test_skipped_question_marks_keep_dialog_numbering():
+    sql, params = bind_placeholders(
+        "SELECT * FROM T WHERE A = 'it''s?' AND B = ? /* ? */ AND C = ?",
+        {'第1个参数': 'x', '第2个参数': 'y', '第3个参数': 'z', '第4个参数': 'w'})
+    assert sql == "SELECT * FROM T WHERE A = 'it''s?' AND B = ? /* ? */ AND C = ?"
+    assert params == ['y', 'w']
+
+
+def test_literal_substitution_is_escaped():
+    sql, params = bind_placeholders("SELECT * FROM T WHERE A LIKE '%${p}%' AND B = '${p}'", {'p': "o'k"})
+    assert sql == "SELECT * FROM T WHERE A LIKE '%o''k%' AND B = ?"
+    assert params == ["o'k"]
+
+
+def test_calc_view_parameter_stays_literal():
+    sql, params = bind_placeholders(
+        "SELECT * FROM \"_SYS_BIC\".\"CV\" ('PLACEHOLDER' = ('$$P$$', '${p}')) WHERE A = ${p}", {'p': '5'})
+    assert sql == "SELECT * FROM \"_SYS_BIC\".\"CV\" ('PLACEHOLDER' = ('$$P$$', '5')) WHERE A = ?"
+    assert params == ['5']
@@ -0,0 +1,41 @@
+import pickle
+from datetime import date, datetime
+from decimal import Decimal
+
+from utils import ColumnBatch
+
+COLUMNS = ['整数', '小数', '浮点', '文本', '日期', '时间', '空列']
+ROWS = [
+    (1, Decimal('1.10'), 0.5, '甲', date(2024, 2, 29), datetime(2024, 1, 2, 3, 4, 5, 678901), None),
+    (None, None, None, None, None, None, None),
+    (-(2 ** 40), Decimal('-12345678901234567890.000001'), float('inf'), '', date(1900, 1, 1),
+     datetime(1999, 12, 31, 23, 59, 59), None),
+]
+
+
+def round_trip(batch):
+    # 分片导出把to_bytes的结果pickle后传给写入进程
+    return ColumnBatch.from_bytes(batch.columns, pickle.loads(pickle.dumps(batch.to_bytes())))
+
+
+def test_bytes_round_trip_preserves_values_and_nulls():
+    restored = round_trip(ColumnBatch.from_rows(COLUMNS, ROWS))
+    assert restored.columns == COLUMNS
+    assert len(restored) == len(ROWS)
+    assert restored.to_rows() == ROWS
+
+
+def test_bytes_round_trip_keeps_python_types():
+    restored = round_trip(ColumnBatch.from_rows(COLUMNS, ROWS)).to_rows()
+    first = restored[0]
+    assert type(first[0]) is int
+    assert isinstance(first[1], Decimal) and str(first[1]) == '1.10'
+    assert type(first[4]) is date
+    assert type(first[5]) is datetime
+    assert all(value is None for value in restored[1])
+
+
+def test_bytes_round_trip_of_slices():
+    batch = ColumnBatch.from_rows(COLUMNS, ROWS * 5)
+    restored = round_trip(batch.slice(4, 11))
+    assert restored.to_rows() == (ROWS * 5)[4:11]
@@ -0,0 +1,22 @@
+from utils import is_read_only_query
+
+
+def test_select_and_with_are_retried():
+    assert is_read_only_query("SELECT 1 FROM DUMMY")
+    assert is_read_only_query("  select * from T")
+    assert is_read_only_query("WITH cte AS (SELECT 1 FROM DUMMY) SELECT * FROM cte")
+    assert is_read_only_query("with\ncte as (select 1 from dummy) select * from cte")
+
+
+def test_leading_comments_are_skipped():
+    assert is_read_only_query("-- 月报\nSELECT * FROM T")
+    assert is_read_only_query("/* 说明\n多行 */ -- 备注\n  WITH c AS (SELECT 1 FROM DUMMY) SELECT * FROM c")
+
+
+def test_dml_and_ddl_are_not_retried():
+    assert not is_read_only_query("INSERT INTO T SELECT * FROM S")
+    assert not is_read_only_query("-- SELECT\nDELETE FROM T")
+    assert not is_read_only_query("/* WITH */ UPDATE T SET A = 1")
+    assert not is_read_only_query("CREATE TABLE SELECTED (A INT)")
+    assert not is_read_only_query("SELECTX")
+    assert not is_read_only_query("")
@@ -0,0 +1,84 @@
+import os
+import random
+from decimal import Decimal
+
+import pytest
+
+from utils import ResultStore
+
+COLUMNS = ['A', 'B', 'C']
+
+
+def make_rows(start, count):
+    rng = random.Random(start)
+    return [(rng.choice([None, i % 40, 7]), rng.choice([None, f'值{i % 9}', 'XYZ']),
+             rng.choice([None, Decimal(i % 5) / 2])) for i in range(start, start + count)]
+
+
+def full_refilter(store, filters, search):
+    reference = ResultStore(store.columns)
+    for batch in store.iter_batches():
+        reference.append_batch(batch)
+    reference.set_filter(filters, search)
+    return reference
+
+
+@pytest.mark.parametrize('filters, search', [
+    ([(0, '>', '10')], ''),
+    ([(0, '=', '7'), (1, '非空', '')], ''),
+    ([(1, '包含', '值')], ''),
+    ([(2, '<=', '1')], 'xyz'),
+    ([(0, '!=', '7'), (2, '为空', '')], ''),
+])
+def test_append_while_filtered_matches_full_refilter(filters, search):
+    store = ResultStore(COLUMNS)
+    store.page_rows = 500
+    store.set_filter(filters, search)
+    total = 0
+    for count in [3, 120, 450, 1, 700, 260]:
+        store.append_rows(make_rows(total, count))
+        total += count
+        reference = full_refilter(store, filters, search)
+        assert store.take(range(len(store))) == reference.take(range(len(reference)))
+    # 追加时不把尾部缓冲区强制封成小页
+    assert len(store._pages) == total // store.page_rows
+
+    store.sort(0, reverse=True)
+    reference.sort(0, reverse=True)
+    assert store.take(range(len(store))) == reference.take(range(len(reference)))
+
+
+def test_key_type_change_refilters_everything():
+    store = ResultStore(['A'])
+    store.set_filter([(0, '>', '5')])
+    store.append_rows([(None,), (None,)])
+    store.append_rows([(9,), (1,)])
+    assert store.take(range(len(store))) == [(9,)]
+    # 文本值使整列改为按文本比较，之前的行也要按文本重新判断
+    store.append_rows([('70',), ('abc',)])
+    assert store.take(range(len(store))) == [(9,), ('70',), ('abc',)]
+
+
+def test_spilled_sort_keeps_one_permutation_file(tmp_path):
+    store = ResultStore(COLUMNS, memory_rows=500, spill_dir=str(tmp_path))
+    store.page_rows = 250
+    store.append_rows(make_rows(0, 1000))
+    store.sort(0)
+    directory = store._spill.directory
+
+    def sort_files():
+        return [name for name in os.listdir(directory) if name.startswith('sort_')]
+
+    assert len(sort_files()) == 1
+    first = store.take(range(5))
+    store.append_rows(make_rows(1000, 300))
+    assert sort_files() == []
+    # 追加后显示顺序不再引用已删除的映射文件
+    assert store.take(range(5)) == first
+    store.sort(0)
+    store.sort(0, reverse=True)
+    assert len(sort_files()) == 1
+
+    store.close()
+    assert not os.path.exists(directory)
+    assert os.listdir(tmp_path) == []
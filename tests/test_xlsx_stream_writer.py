@@ -0,0 +1,90 @@
+import zipfile
+from datetime import date, datetime
+from decimal import Decimal
+from xml.dom import minidom
+
+import openpyxl
+import pytest
+
+import utils
+from utils import StreamExporter, ColumnBatch, create_excel_writer
+
+
+@pytest.fixture
+def stream_env(monkeypatch):
+    monkeypatch.setenv('XLSX_WRITER', 'stream')
+    monkeypatch.setenv('XLSX_SHARED_STRINGS', 'False')
+    monkeypatch.setenv('XLSX_COMPRESS_CHUNK_KB', '1024')
+
+
+def write_workbook(path, sheets):
+    writer = create_excel_writer(str(path))
+    body = writer.add_format({'border': 1})
+    date_style = writer.add_format({'num_format': 'yyyy-mm-dd'})
+    datetime_style = writer.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+    for name, rows in sheets:
+        writer.add_sheet(name, 3, 20, freeze_header=True)
+        writer.write_rows(rows, body, date_style, datetime_style)
+    writer.close()
+
+
+def test_values_and_types_round_trip(tmp_path, stream_env):
+    path = tmp_path / 'out.xlsx'
+    rows = [('名称', '数量', '日期'),
+            ('a<b>&"c"', 42, date(2024, 2, 29)),
+            ('00123', Decimal('1.25'), datetime(2024, 1, 2, 3, 4, 5)),
+            (None, 2.5, True)]
+    write_workbook(path, [('Data', rows)])
+
+    with zipfile.ZipFile(path) as archive:
+        assert archive.testzip() is None
+    sheet = openpyxl.load_workbook(path).active
+    values = [[cell.value for cell in row] for row in sheet.iter_rows()]
+    assert values[0] == ['名称', '数量', '日期']
+    assert values[1] == ['a<b>&"c"', 42, datetime(2024, 2, 29)]
+    assert values[2] == ['00123', 1.25, datetime(2024, 1, 2, 3, 4, 5)]
+    assert values[3] == [None, 2.5, True]
+    assert sheet['C2'].number_format == 'yyyy-mm-dd'
+    assert sheet.freeze_panes == 'A2'
+
+
+def test_quoted_sheet_name_is_well_formed(tmp_path, stream_env):
+    path = tmp_path / 'quoted.xlsx'
+    write_workbook(path, [('a"b', [('x',)]), ('c&d', [('y',)])])
+    with zipfile.ZipFile(path) as archive:
+        minidom.parseString(archive.read('xl/workbook.xml'))
+        minidom.parseString(archive.read('xl/styles.xml'))
+    assert openpyxl.load_workbook(path).sheetnames == ['a"b', 'c&d']
+
+
+def test_shared_strings_and_parallel_chunks(tmp_path, stream_env, monkeypatch):
+    monkeypatch.setenv('XLSX_SHARED_STRINGS', 'True')
+    monkeypatch.setenv('XLSX_COMPRESS_CHUNK_KB', '1')
+    path = tmp_path / 'shared.xlsx'
+    rows = [(f'行{i % 50}', i, 'x' * 40000 if i == 0 else None) for i in range(3000)]
+    write_workbook(path, [('Data', rows)])
+
+    with zipfile.ZipFile(path) as archive:
+        assert archive.testzip() is None
+        assert 'xl/sharedStrings.xml' in archive.namelist()
+    sheet = openpyxl.load_workbook(path).active
+    values = [[cell.value for cell in row] for row in sheet.iter_rows()]
+    assert len(values) == 3000
+    assert [row[:2] for row in values[-3:]] == [['行47', 2997], ['行48', 2998], ['行49', 2999]]
+    assert len(values[0][2]) == utils.EXCEL_MAX_CELL_CHARS
+
+
+def test_rows_roll_over_to_new_sheets(tmp_path, stream_env, monkeypatch):
+    monkeypatch.setattr(utils, 'EXCEL_MAX_ROWS', 4)
+    path = tmp_path / 'rollover.xlsx'
+    columns = ['A', 'B']
+    rows = [(i, str(i)) for i in range(10)]
+    exporter = StreamExporter('SELECT 1 FROM DUMMY', str(path))
+    exporter.export_batches(columns, [ColumnBatch.from_rows(columns, rows[:3]), ColumnBatch.from_rows(columns, rows[3:])])
+
+    book = openpyxl.load_workbook(path)
+    assert book.sheetnames == ['Data', 'Data_2', 'Data_3']
+    sheets = [[[cell.value for cell in row] for row in sheet.iter_rows()] for sheet in book]
+    assert all(sheet[0] == columns for sheet in sheets)
+    assert [row[0] for sheet in sheets for row in sheet[1:]] == list(range(10))
+    assert [len(sheet) - 1 for sheet in sheets] == [4, 4, 2]
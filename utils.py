@@ -1,7 +1,36 @@
 import os
-from datetime import datetime
+import re
+import io
+import csv
+import json
+import time
+import queue
+import multiprocessing
+import mmap
+import pickle
+import shutil
+import zipfile
+import zlib
+import sqlite3
+import tempfile
+import threading
+import gc
+import hashlib
+import heapq
+import sys
+import tracemalloc
+import weakref
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date
+from decimal import Decimal
 from hdbcli import dbapi
+try:
+    import psutil
+except ImportError:
+    psutil = None
 from dotenv import load_dotenv
+import numpy as np
 import pandas as pd
 
 load_dotenv()
@@ -15,7 +44,10 @@ class HANAUtils:
         self.port = int(os.getenv("HANA_PORT", 30041))
         self.user = os.getenv("HANA_USER")
         self.password = os.getenv("HANA_PASSWORD")
+        self.statement_cache_size = int(os.getenv("STATEMENT_CACHE_SIZE", 32))
         self._connection = None
+        self.statements = None  # 当前连接的预编译语句缓存
+        self.last_used = 0.0  # 最近一次取游标的时间，保活只检查空闲的连接
 
     def connect(self):
         """连接到HANA数据库"""
@@ -29,12 +61,12 @@ class HANAUtils:
                 user=self.user,
                 password=self.password
             )
+            self.last_used = time.time()
             
-            # 验证连接
-            cursor = self._connection.cursor()
-            cursor.execute("SELECT 1 FROM DUMMY")
-            cursor.fetchone()
-            cursor.close()
+            # 预编译语句属于连接，重连后重新建立缓存
+            if self.statements is not None:
+                self.statements.close()
+            self.statements = StatementCache(self._connection, self.statement_cache_size)
             
             return True
         except Exception as e:
@@ -50,6 +82,9 @@ class HANAUtils:
         """断开HANA数据库连接"""
         if self._connection:
             try:
+                if self.statements is not None:
+                    self.statements.close()
+                    self.statements = None
                 self._connection.close()
                 self._connection = None
                 return True
@@ -57,12 +92,33 @@ class HANAUtils:
                 raise type(e)(f"断开连接失败: {str(e)}")
         return False
 
+    def is_connected(self):
+        """不访问数据库，只检查客户端连接是否仍然有效"""
+        try:
+            return bool(self._connection and self._connection.isconnected())
+        except Exception:
+            return False
+
     def get_cursor(self):
         """获取数据库游标"""
         if self._connection:
+            self.last_used = time.time()
             return self._connection.cursor()
         raise Exception("未连接到数据库，请先调用connect()方法。")
 
+    def ping(self):
+        """执行一次SELECT 1确认连接可用，失败返回False"""
+        try:
+            cursor = self.get_cursor()
+            try:
+                cursor.execute("SELECT 1 FROM DUMMY")
+                cursor.fetchone()
+            finally:
+                cursor.close()
+            return True
+        except Exception:
+            return False
+
     def execute_query(self, query):
         """执行SQL查询并返回结果"""
         try:
@@ -113,7 +169,1360 @@ class HANAUtils:
         file_extension = os.getenv("FILE_EXTENSION", "xlsx") if extension is None else extension
         return f"{file_prefix}_{timestamp}.{file_extension}"
 
-class StreamExporter:
+class SqlFile:
+    """以内存映射方式读取SQL文件，预览和统计语句数时不把整个文件读进内存"""
+
+    # 字符串、带引号的标识符、注释和分号；注释和字符串中的分号不算语句结束
+    _TOKEN = re.compile(rb"'[^']*'|\"[^\"]*\"|--[^\n]*|/\*.*?\*/|;", re.DOTALL)
+    _NON_SPACE = re.compile(rb"\S")
+
+    def __init__(self, path, encoding='utf-8'):
+        self.path = path
+        self.encoding = encoding
+        self._file = open(path, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        # 空文件无法映射
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def head(self, limit):
+        """返回前limit字节的文本（在最后一个换行处截断），以及是否被截断"""
+        if self._mmap is None:
+            return '', False
+        if self.size <= limit:
+            return self._mmap[:].decode(self.encoding, errors='replace'), False
+        end = self._mmap.rfind(b'\n', 0, limit)
+        end = limit if end <= 0 else end
+        return self._mmap[:end].decode(self.encoding, errors='replace'), True
+
+    def count_statements(self):
+        """统计以分号分隔的非空语句数"""
+        if self._mmap is None:
+            return 0
+        count = 0
+        has_content = False
+        pos = 0
+        for match in self._TOKEN.finditer(self._mmap):
+            if not has_content and self._NON_SPACE.search(self._mmap, pos, match.start()):
+                has_content = True
+            token = match.group()
+            if token == b';':
+                count += has_content
+                has_content = False
+            elif token[:1] in (b"'", b'"'):
+                has_content = True
+            pos = match.end()
+        if has_content or self._NON_SPACE.search(self._mmap, pos):
+            count += 1
+        return count
+
+    def read_text(self):
+        """直接从映射区解码全文，不再额外复制一份字节串"""
+        if self._mmap is None:
+            return ''
+        with memoryview(self._mmap) as view:
+            return str(view, self.encoding)
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+class StatementCache:
+    """单个连接上的预编译语句缓存
+
+    键为规范化后的SQL文本，值为已经prepare过的空闲游标。同一语句换参数重新执行时
+    直接executeprepared，跳过语句编译。游标在使用期间从缓存中取出，用完后归还，
+    因此同一语句被多个结果集同时使用时会各自prepare一个游标。
+    """
+
+    _LITERAL_OR_SPACE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*\n?|\s+")
+
+    def __init__(self, connection, capacity=32):
+        self.connection = connection
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._idle = OrderedDict()  # 键 -> 空闲游标列表，按最近使用排序
+        self._lock = threading.Lock()
+        self._closed = False
+
+    @classmethod
+    def normalize(cls, sql):
+        """合并字符串和注释之外的空白、去掉末尾分号，作为缓存键"""
+        def collapse(match):
+            token = match.group()
+            return ' ' if token.isspace() else token
+        return cls._LITERAL_OR_SPACE.sub(collapse, sql.strip().rstrip(';').strip())
+
+    def acquire(self, sql):
+        """取出sql对应的已预编译游标，没有空闲游标时新建并prepare；返回(键, 游标, 是否命中)"""
+        key = self.normalize(sql)
+        with self._lock:
+            cursors = self._idle.get(key)
+            if cursors:
+                cursor = cursors.pop()
+                if not cursors:
+                    del self._idle[key]
+                self.hits += 1
+                return key, cursor, True
+            self.misses += 1
+        cursor = self.connection.cursor()
+        try:
+            cursor.prepare(sql)
+        except Exception:
+            cursor.close()
+            raise
+        return key, cursor, False
+
+    def execute(self, sql, params):
+        """用绑定参数执行语句，返回(键, 游标, 是否命中)；执行失败的游标不再放回缓存"""
+        key, cursor, hit = self.acquire(sql)
+        try:
+            cursor.executeprepared(params)
+        except Exception:
+            cursor.close()
+            raise
+        return key, cursor, hit
+
+    def release(self, key, cursor):
+        """归还游标，超出容量时关闭最久未使用的语句"""
+        with self._lock:
+            if self._closed:
+                cursor.close()
+                return
+            self._idle.setdefault(key, []).append(cursor)
+            self._idle.move_to_end(key)
+            evicted = []
+            while sum(len(c) for c in self._idle.values()) > self.capacity:
+                _, cursors = self._idle.popitem(last=False)
+                evicted.extend(cursors)
+        for old in evicted:
+            try:
+                old.close()
+            except Exception:
+                pass
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            cursors = [c for group in self._idle.values() for c in group]
+            self._idle.clear()
+        for cursor in cursors:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+
+class ConnectionPool:
+    """HANA连接池，每个连接是一个独立的HANAUtils（带各自的预编译语句缓存）"""
+
+    def __init__(self, size=None):
+        self.size = max(1, int(os.getenv("POOL_SIZE", 4)) if size is None else size)
+        self._idle = []
+        self._created = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout=None):
+        """取出一个空闲连接，没有空闲连接且未达上限时新建，否则等待归还
+
+        timeout为等待秒数，None表示一直等待，0表示不等待；超时仍没有可用连接时抛出异常。
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise Exception("连接池已关闭")
+                if self._idle:
+                    return self._idle.pop()
+                if self._created < self.size:
+                    self._created += 1
+                    break
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"连接池的 {self.size} 个连接都在使用中")
+                self._cond.wait(remaining)
+        utils = HANAUtils()
+        try:
+            utils.connect()
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+        return utils
+
+    def release(self, utils):
+        """归还连接，已断开的连接直接丢弃"""
+        with self._cond:
+            if self._closed or not utils.is_connected():
+                self._created -= 1
+                discard = True
+            else:
+                self._idle.append(utils)
+                discard = False
+            self._cond.notify()
+        if discard:
+            try:
+                utils.disconnect()
+            except Exception:
+                pass
+
+    def keepalive(self, max_idle):
+        """对空闲超过max_idle秒的连接执行一次保活查询，失败的连接断开后丢弃"""
+        now = time.time()
+        with self._cond:
+            stale = [utils for utils in self._idle if now - utils.last_used >= max_idle]
+            for utils in stale:
+                self._idle.remove(utils)
+        for utils in stale:
+            record_connection_event('keepalive_pings')
+            if not utils.ping():
+                record_connection_event('keepalive_failures', source='pool')
+                try:
+                    utils.disconnect()
+                except Exception:
+                    pass
+            self.release(utils)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+            self._cond.notify_all()
+        for utils in idle:
+            try:
+                utils.disconnect()
+            except Exception:
+                pass
+
+
+# hdbcli表示连接不可用的错误码：连接失败、连接已断开、会话已重新连接、会话未连接
+CONNECTION_ERROR_CODES = {-10709, -10807, -10108, -10821}
+
+
+def is_connection_error(error, utils=None):
+    """判断异常是否由连接断开引起"""
+    if getattr(error, 'errorcode', None) in CONNECTION_ERROR_CODES:
+        return True
+    return utils is not None and not utils.is_connected()
+
+
+_CONNECTION_STATS_LOCK = threading.Lock()
+CONNECTION_STATS = {'reconnects': 0, 'reconnect_failures': 0, 'keepalive_pings': 0, 'keepalive_failures': 0}
+
+
+def record_connection_event(event, **extra):
+    """累计连接事件次数并返回当前统计；除保活查询外每次事件同时写入METRICS_FILE"""
+    with _CONNECTION_STATS_LOCK:
+        CONNECTION_STATS[event] += 1
+        stats = dict(CONNECTION_STATS)
+    if event != 'keepalive_pings':
+        write_metrics({'event': event, **extra, **stats})
+    return stats
+
+
+class ConnectionKeepalive:
+    """后台连接保活
+
+    每隔interval/2秒检查一次注册的会话和连接池，对空闲超过interval秒的连接执行一次SELECT 1，
+    失败的连接断开后由下一次使用时重新连接。这样执行查询前不需要再检查连接。
+    注册对象需要实现keepalive(max_idle)，以弱引用保存，关闭的标签页会话不会被保留。
+    """
+
+    def __init__(self, interval=None):
+        self.interval = float(os.getenv("KEEPALIVE_SECONDS", 240)) if interval is None else interval
+        self._sources = weakref.WeakSet()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def register(self, source):
+        self._sources.add(source)
+        if self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval / 2):
+            for source in list(self._sources):
+                try:
+                    source.keepalive(self.interval)
+                except Exception:
+                    pass
+
+    def stop(self):
+        self._stop.set()
+
+
+class QuerySession:
+    """查询窗口独立的数据库会话
+
+    连接在第一次使用时建立：pool为None时单独建立连接，否则从连接池借用，直到close时归还。
+    隔离级别和默认schema在建立连接或修改设置后的下一次connect时应用，归还连接池前恢复默认设置。
+    会话内同时只执行一条查询，running和stop_requested由界面线程和查询线程维护。
+    """
+
+    ISOLATION_LEVELS = ("READ COMMITTED", "REPEATABLE READ", "SERIALIZABLE")
+
+    def __init__(self, pool=None, isolation=None, schema=None):
+        self.pool = pool
+        self.isolation = None
+        self.schema = None
+        self.configure(isolation if isolation is not None else os.getenv("SESSION_ISOLATION", ""),
+                       schema if schema is not None else os.getenv("SESSION_SCHEMA", ""))
+        self.utils = None
+        self.running = False
+        self.stop_requested = False
+        self._applied = (None, None)  # 当前连接上已生效的(隔离级别, schema)，None为连接默认值
+        self._lock = threading.Lock()
+
+    @property
+    def mode(self):
+        return "连接池" if self.pool is not None else "独立连接"
+
+    def configure(self, isolation=None, schema=None):
+        """修改会话设置，下一次执行查询时生效"""
+        isolation = (isolation or "").strip().upper() or None
+        if isolation is not None and isolation not in self.ISOLATION_LEVELS:
+            raise ValueError(f"不支持的隔离级别: {isolation}")
+        self.isolation = isolation
+        self.schema = (schema or "").strip() or None
+
+    def is_connected(self):
+        """不访问数据库，只检查客户端连接状态"""
+        return self.utils is not None and self.utils.is_connected()
+
+    def check(self):
+        """执行一次查询确认连接可用"""
+        return self.utils is not None and self.utils.ping()
+
+    def connect(self, timeout=None):
+        """确保会话有可用连接并应用会话设置，返回HANAUtils；只检查客户端状态，不额外访问数据库
+
+        timeout为从连接池借用连接时的最长等待秒数，在界面线程中调用时应传入0避免界面卡住。
+        """
+        with self._lock:
+            return self._connect(timeout)
+
+    def _connect(self, timeout=None):
+        if self.utils is not None and not self.utils.is_connected():
+            self._drop()
+        if self.utils is None:
+            if self.pool is not None:
+                self.utils = self.pool.acquire(timeout)
+            else:
+                utils = HANAUtils()
+                utils.connect()
+                self.utils = utils
+            self._applied = (None, None)
+        self._apply(self.utils, self.isolation, self.schema)
+        return self.utils
+
+    def reconnect(self, error=None):
+        """丢弃断开的连接，建立新连接并恢复会话设置，重连次数写入连接指标"""
+        start_time = time.time()
+        with self._lock:
+            self._drop()
+            try:
+                utils = self._connect()
+            except Exception as e:
+                record_connection_event('reconnect_failures', source='session', error=str(e))
+                raise
+        stats = record_connection_event('reconnects', source='session', mode=self.mode, error=str(error or ''),
+                                        seconds=round(time.time() - start_time, 3))
+        return utils, stats['reconnects']
+
+    def run(self, action, retry=True, on_reconnect=None):
+        """在会话连接上执行action(utils)并返回其结果
+
+        正常情况下不做任何额外检查；action因连接断开失败时重新连接，retry为True时在新连接上
+        再执行一次，否则重新抛出原异常。on_reconnect(累计重连次数)在重连成功后调用。
+        """
+        utils = self.connect()
+        try:
+            return action(utils)
+        except Exception as e:
+            if not is_connection_error(e, utils):
+                raise
+            utils, total = self.reconnect(e)
+            if on_reconnect is not None:
+                on_reconnect(total)
+            if not retry:
+                raise
+            return action(utils)
+
+    def keepalive(self, max_idle):
+        """连接空闲超过max_idle秒时执行一次保活查询，失败时断开，下一次查询重新连接"""
+        if self.running or not self._lock.acquire(blocking=False):
+            return
+        try:
+            utils = self.utils
+            if utils is None or not utils.is_connected() or time.time() - utils.last_used < max_idle:
+                return
+            record_connection_event('keepalive_pings')
+            if not utils.ping():
+                record_connection_event('keepalive_failures', source='session', mode=self.mode)
+                self._drop()
+        finally:
+            self._lock.release()
+
+    def _apply(self, utils, isolation, schema):
+        self._applied = self.apply_settings(utils, isolation, schema, self._applied)
+
+    @staticmethod
+    def apply_settings(utils, isolation, schema, applied=(None, None)):
+        """在连接上设置隔离级别和默认schema，只执行与已生效设置applied不同的部分，返回新的已生效设置
+
+        也用于导出任务从连接池借用的连接，使导出与提交它的标签页使用相同的会话设置。
+        """
+        applied_isolation, applied_schema = applied
+        if (isolation, schema) == applied:
+            return applied
+        cursor = utils.get_cursor()
+        try:
+            if isolation != applied_isolation:
+                cursor.execute(f"SET TRANSACTION ISOLATION LEVEL {isolation or 'READ COMMITTED'}")
+            if schema != applied_schema:
+                if schema is None:
+                    # 恢复为用户自己的schema
+                    cursor.execute("SELECT CURRENT_USER FROM DUMMY")
+                    cursor.execute(f"SET SCHEMA {quote_identifier(cursor.fetchone()[0])}")
+                else:
+                    cursor.execute(f"SET SCHEMA {quote_identifier(schema)}")
+        finally:
+            cursor.close()
+        return (isolation, schema)
+
+    @classmethod
+    def reset_settings(cls, utils, applied):
+        """把借用的连接恢复为默认设置后再归还连接池；恢复失败时断开，连接池不再复用该连接"""
+        if applied == (None, None) or not utils.is_connected():
+            return
+        try:
+            cls.apply_settings(utils, None, None, applied)
+        except Exception:
+            try:
+                utils.disconnect()
+            except Exception:
+                pass
+
+    def _drop(self):
+        utils, self.utils = self.utils, None
+        if utils is None:
+            return
+        if self.pool is None:
+            try:
+                utils.disconnect()
+            except Exception:
+                pass
+            return
+        self.reset_settings(utils, self._applied)
+        self._applied = (None, None)
+        self.pool.release(utils)
+
+    def close(self):
+        """归还或断开会话的连接"""
+        with self._lock:
+            self._drop()
+
+
+def process_rss():
+    """当前进程的常驻内存（字节）：优先使用psutil，未安装时读取系统接口，都不可用时返回0"""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t), ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t), ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t), ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t), ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        kernel32 = ctypes.windll.kernel32
+        if kernel32.K32GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb):
+            return counters.WorkingSetSize
+        return 0
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+_METRICS_LOCK = threading.Lock()
+
+
+def write_metrics(record):
+    """把一条导出指标以JSON行追加到METRICS_FILE，未配置时不写"""
+    path = os.getenv("METRICS_FILE")
+    if not path:
+        return
+    record = {'time': datetime.now().isoformat(timespec='seconds'), **record}
+    with _METRICS_LOCK:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+
+
+class MemoryGovernor:
+    """导出内存上限控制
+
+    每批取数前采样进程常驻内存（RSS），limit_mb为0时只记录峰值。超过上限的soft_ratio时把批次减半；
+    超过上限时先回收垃圾，再阻塞取数等待写入线程、压缩线程或分片进程消化已取出的数据，直到回落到
+    soft线以下或等待超时。等待后仍未回落说明内存并非积压的数据占用，此后不再等待，只保持最小批次，
+    直到内存回落。内存低于soft线一半时批次逐步恢复。Python堆大小在启用tracemalloc时记录
+    （如设置PYTHONTRACEMALLOC=1），否则记录已分配的对象块数。
+    多个线程可以共享同一个实例。
+    """
+
+    def __init__(self, limit_mb=None, soft_ratio=0.8, min_batch=100, wait_seconds=None):
+        if limit_mb is None:
+            limit_mb = int(os.getenv("MEMORY_LIMIT_MB", 0))
+        self.limit = limit_mb * 1024 * 1024
+        self.soft_limit = int(self.limit * soft_ratio)
+        self.min_batch = min_batch
+        self.wait_seconds = float(os.getenv("MEMORY_WAIT_SECONDS", 5)) if wait_seconds is None else wait_seconds
+        self.scale = 1.0  # 当前批次相对于请求批次的比例
+        self.peak_rss = 0
+        self.peak_python_heap = 0
+        self.peak_python_blocks = 0
+        self.throttled_batches = 0
+        self.blocked_seconds = 0.0
+        self.start_time = time.time()
+        self._stalled = False
+        self._last_sample = 0
+        self._rss = 0
+        self._lock = threading.Lock()
+
+    def sample(self, force=False):
+        """采样当前RSS并更新峰值，两次采样间隔至少0.2秒"""
+        now = time.time()
+        if force or now - self._last_sample >= 0.2:
+            self._last_sample = now
+            self._rss = process_rss()
+            self.peak_rss = max(self.peak_rss, self._rss)
+            if tracemalloc.is_tracing():
+                self.peak_python_heap = max(self.peak_python_heap, tracemalloc.get_traced_memory()[0])
+            self.peak_python_blocks = max(self.peak_python_blocks, sys.getallocatedblocks())
+        return self._rss
+
+    def batch_size(self, requested):
+        """取下一批数据前调用，返回本批应取的行数；接近上限时缩小批次，超过上限时阻塞等待"""
+        rss = self.sample()
+        if not self.limit:
+            return requested
+        with self._lock:
+            if rss >= self.limit:
+                self.scale = max(self.scale / 2, self.min_batch / max(requested, 1))
+                self.throttled_batches += 1
+                if not self._stalled:
+                    gc.collect()
+                    start = time.time()
+                    while self.sample(force=True) >= self.soft_limit and time.time() - start < self.wait_seconds:
+                        time.sleep(0.05)
+                    self.blocked_seconds += time.time() - start
+                    self._stalled = self._rss >= self.limit
+            elif rss >= self.soft_limit:
+                self.scale = max(self.scale / 2, self.min_batch / max(requested, 1))
+                self.throttled_batches += 1
+            else:
+                self._stalled = False
+                if rss < self.soft_limit / 2:
+                    self.scale = min(1.0, self.scale * 2)
+            return max(self.min_batch, int(requested * self.scale)) if self.scale < 1 else requested
+
+    def report(self, export, output=None, rows=None, **extra):
+        """导出结束时调用：返回指标字典并写入METRICS_FILE"""
+        self.sample(force=True)
+        record = {
+            'export': export,
+            'output': output,
+            'rows': rows,
+            'seconds': round(time.time() - self.start_time, 3),
+            'peak_rss_mb': round(self.peak_rss / 1048576, 1),
+            'peak_python_heap_mb': round(self.peak_python_heap / 1048576, 1) if self.peak_python_heap else None,
+            'peak_python_blocks': self.peak_python_blocks,
+            'memory_limit_mb': self.limit // 1048576 or None,
+            'throttled_batches': self.throttled_batches,
+            'blocked_seconds': round(self.blocked_seconds, 2),
+            **extra,
+        }
+        write_metrics(record)
+        return record
+
+    def summary(self):
+        """用于日志的峰值内存说明"""
+        text = f"峰值内存 {self.peak_rss / 1048576:.1f} MB"
+        if self.throttled_batches:
+            text += f"（接近上限，缩小批次 {self.throttled_batches} 次，等待 {self.blocked_seconds:.1f}秒）"
+        return text
+
+
+# 计算视图参数：PLACEHOLDER."$$名称$$" => 值 以及 ('PLACEHOLDER' = ('$$名称$$', 值)) 两种写法
+_CALC_VIEW_PARAM = r"""(?:PLACEHOLDER\s*\.\s*"\$\$[^"]*\$\$"\s*=>\s*|'PLACEHOLDER'\s*=\s*\(\s*'\$\$[^']*\$\$'\s*,\s*)"""
+# 字符串常量、带引号的标识符和注释先整体匹配，其中的占位符和问号不作为绑定参数
+_PLACEHOLDER_TOKEN = re.compile(
+    r"(?P<prefix>" + _CALC_VIEW_PARAM + r")(?P<cq>'?)(?P<cv>\$\{[^}]+\}|\?)(?P=cq)"
+    r"|'\$\{(?P<quoted>[^}]+)\}'"
+    r"|(?P<literal>'(?:[^']|'')*')"
+    r"|(?P<skip>\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/)"
+    r"|\$\{(?P<name>[^}]+)\}"
+    r"|\?",
+    re.IGNORECASE | re.S
+)
+_NAMED_PLACEHOLDER = re.compile(r"\$\{[^}]+\}")
+_LEADING_COMMENTS = re.compile(r"(?:\s+|--[^\n]*|/\*.*?\*/)*", re.S)
+_READ_ONLY_QUERY = re.compile(r"(SELECT|WITH)\b", re.IGNORECASE)
+
+
+def is_read_only_query(sql):
+    """跳过开头的空白和注释后以SELECT或WITH开头的语句视为只读查询，断线重连后可以安全地重新执行"""
+    return _READ_ONLY_QUERY.match(sql, _LEADING_COMMENTS.match(sql).end()) is not None
+
+
+def bind_placeholders(sql, values):
+    """把${名称}和?占位符转换为绑定参数
+
+    values为参数对话框返回的字典，?占位符按出现顺序命名为"第N个参数"（与参数对话框一致，
+    字符串常量和注释中的问号也参与编号）。写在引号中的'${名称}'连同引号一起替换为?，
+    值两端用户自带的单引号会被去掉。字符串常量中的其他${名称}按转义后的文本替换，
+    注释和带双引号的标识符保持不变。计算视图的PLACEHOLDER参数不能使用绑定参数，
+    按转义后的字符串字面量写入SQL。返回(sql, 参数列表)。
+    """
+    params = []
+    question_index = 0
+
+    def value_of(token):
+        nonlocal question_index
+        if token == '?':
+            question_index += 1
+            value = values.get(f"第{question_index}个参数", '')
+        else:
+            value = values.get(token[2:-1], '')
+        if len(value) >= 2 and value.startswith("'") and value.endswith("'"):
+            value = value[1:-1].replace("''", "'")
+        return value
+
+    def substitute(match):
+        if match.group('prefix') is not None:
+            literal = value_of(match.group('cv')).replace("'", "''")
+            return f"{match.group('prefix')}'{literal}'"
+        token = match.group()
+        if match.group('literal') is not None or match.group('skip') is not None:
+            # 跳过的问号只占用编号
+            nonlocal question_index
+            question_index += _NAMED_PLACEHOLDER.sub('', token).count('?')
+            if match.group('literal') is None:
+                return token
+            return _NAMED_PLACEHOLDER.sub(lambda m: value_of(m.group()).replace("'", "''"), token)
+        if match.group('quoted') is not None:
+            token = token[1:-1]
+        params.append(value_of(token))
+        return '?'
+
+    return _PLACEHOLDER_TOKEN.sub(substitute, sql), params
+
+
+def quote_identifier(name):
+    """把列名转换为带双引号的SQL标识符"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def build_pushdown_query(sql_query, columns, filters=None, search=None, sort=None, limit=None):
+    """把原查询包装为子查询，在服务器端完成筛选、排序和截取
+
+    filters为(列索引, 运算符, 值)列表，运算符与ResultStore.FILTER_OPS一致；
+    search为在所有列中查找的子串；sort为(列索引, 是否降序)。
+    返回(sql, 参数列表)，筛选值全部以绑定参数传递。
+    """
+    where, params = [], []
+
+    def like(col):
+        return f"LOWER(TO_NVARCHAR({quote_identifier(col)})) LIKE ? ESCAPE '\\'"
+
+    def like_param(value):
+        value = value.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return f"%{value}%"
+
+    for col_idx, op, value in filters or []:
+        col = quote_identifier(columns[col_idx])
+        if op == '为空':
+            where.append(f"{col} IS NULL")
+        elif op == '非空':
+            where.append(f"{col} IS NOT NULL")
+        elif op == '包含':
+            where.append(like(columns[col_idx]))
+            params.append(like_param(value))
+        elif op in ('=', '!=', '>', '>=', '<', '<='):
+            where.append(f"{col} {'<>' if op == '!=' else op} ?")
+            params.append(value)
+        else:
+            raise ValueError(f"不支持的筛选运算符: {op}")
+
+    search = (search or '').strip()
+    if search and columns:
+        where.append("(" + " OR ".join(like(col) for col in columns) + ")")
+        params.extend([like_param(search)] * len(columns))
+
+    # 子查询末尾可能带有行注释，右括号另起一行
+    query = f"SELECT * FROM (\n{sql_query.strip().rstrip(';')}\n) AS T"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    if sort is not None:
+        col_idx, reverse = sort
+        # 与本地排序一致：升序时空值在后，降序时空值在前
+        query += f" ORDER BY {quote_identifier(columns[col_idx])} {'DESC NULLS FIRST' if reverse else 'ASC NULLS LAST'}"
+    if limit:
+        query += f" LIMIT {int(limit)}"
+    return query, params
+
+
+# cursor.description中LOB列的类型代码，BLOB和BINTEXT为二进制
+LOB_TYPE_CODES = {25: 'CLOB', 26: 'NCLOB', 27: 'BLOB', 51: 'TEXT', 53: 'BINTEXT'}
+_BINARY_LOB_CODES = (27, 53)
+LOB_POLICIES = ('skip', 'truncate', 'file')
+
+
+def parse_lob_policies(text):
+    """解析"列名=策略"的逗号分隔列表，策略为skip、truncate、truncate:N或file，返回{列名: (策略, N)}"""
+    policies = {}
+    for item in (text or '').split(','):
+        if not item.strip():
+            continue
+        if '=' not in item:
+            raise Exception(f"LOB策略格式错误: {item.strip()}，应为 列名=策略")
+        name, policy = (part.strip() for part in item.rsplit('=', 1))
+        policy, _, limit = policy.lower().partition(':')
+        if policy not in LOB_POLICIES:
+            raise Exception(f"未知的LOB策略: {policy}，可选 skip、truncate、file")
+        policies[name.upper()] = (policy, int(limit) if limit else None)
+    return policies
+
+
+class LobHandler:
+    """按cursor.description识别LOB列，在取数后按列策略处理LOB值
+
+    skip：不读取内容，单元格留空；truncate：只分块读取前N个字符（二进制为前N/2个字节，以十六进制写出）；
+    file：把完整内容分块写入旁路文件，单元格中写入相对于输出文件目录的路径。
+    处理完的LOB立即关闭，释放服务器端的定位器。
+    """
+
+    def __init__(self, description, side_dir=None, default_policy='truncate', column_policies=None,
+                 truncate_chars=32767, chunk_size=65536, base_dir=None):
+        self.side_dir = side_dir
+        self.base_dir = base_dir or (os.path.dirname(os.path.abspath(side_dir)) if side_dir else None)
+        self.truncate_chars = truncate_chars
+        self.chunk_size = chunk_size
+        self.row_number = 0
+        self.columns = {}  # 列索引 -> (列名, 策略, 截断长度, 是否二进制)
+        column_policies = column_policies or {}
+        for index, desc in enumerate(description):
+            if desc[1] not in LOB_TYPE_CODES:
+                continue
+            policy, limit = column_policies.get(str(desc[0]).upper(), (default_policy, None))
+            if policy == 'file' and side_dir is None:
+                # 没有输出文件（如在线预览）时不写旁路文件
+                policy = 'truncate'
+            self.columns[index] = (desc[0], policy, limit or truncate_chars, desc[1] in _BINARY_LOB_CODES)
+
+    @classmethod
+    def from_cursor(cls, cursor, output_file=None, subdir=None):
+        """按环境变量配置创建；结果集中没有LOB列时返回None
+
+        旁路文件写入LOB_SIDE_DIR，默认为输出文件同名的"_lobs"目录，多条查询写入同一文件时用subdir区分；
+        output_file为None表示在线预览，截断长度使用LOB_PREVIEW_CHARS，file策略按截断处理。
+        """
+        if not cursor.description or not any(desc[1] in LOB_TYPE_CODES for desc in cursor.description):
+            return None
+        side_dir = base_dir = None
+        if output_file is not None:
+            side_dir = os.getenv("LOB_SIDE_DIR") or os.path.splitext(output_file)[0] + '_lobs'
+            if subdir:
+                side_dir = os.path.join(side_dir, re.sub(r'[\\/:*?"<>|]+', '_', subdir))
+            base_dir = os.path.dirname(os.path.abspath(output_file))
+            truncate_chars = int(os.getenv("LOB_TRUNCATE_CHARS", 32767))
+        else:
+            truncate_chars = int(os.getenv("LOB_PREVIEW_CHARS", 1000))
+        return cls(cursor.description, side_dir=side_dir,
+                   default_policy=os.getenv("LOB_POLICY", "truncate").lower(),
+                   column_policies=parse_lob_policies(os.getenv("LOB_COLUMN_POLICIES", "")),
+                   truncate_chars=truncate_chars,
+                   chunk_size=int(os.getenv("LOB_READ_CHUNK", 65536)),
+                   base_dir=base_dir)
+
+    def _chunks(self, value, limit=None):
+        """分块读取LOB，limit为最多读取的字符数（二进制为字节数）"""
+        if not isinstance(value, dbapi.LOB):
+            # 驱动已经取回的内容（字符串或字节）
+            yield value if limit is None else value[:limit]
+            return
+        try:
+            remaining = limit
+            while remaining is None or remaining > 0:
+                size = self.chunk_size if remaining is None else min(self.chunk_size, remaining)
+                part = value.read(size)
+                if not part:
+                    break
+                yield part
+                if remaining is not None:
+                    remaining -= len(part)
+                if len(part) < size:
+                    break
+        finally:
+            value.close()
+
+    def _truncate(self, value, limit, binary):
+        if binary:
+            return b''.join(self._chunks(value, limit // 2)).hex()
+        return ''.join(self._chunks(value, limit))
+
+    def _write_side_file(self, value, index, name, binary):
+        os.makedirs(self.side_dir, exist_ok=True)
+        # 保留中文等Unicode字符，并带上列序号，避免不同列清洗后同名而相互覆盖
+        safe_name = re.sub(r'\W+', '_', str(name)).strip('_') or 'col'
+        filename = f"{safe_name}_{index + 1}_{self.row_number}.{'bin' if binary else 'txt'}"
+        path = os.path.join(self.side_dir, filename)
+        with open(path, 'wb' if binary else 'w', encoding=None if binary else 'utf-8') as f:
+            for part in self._chunks(value):
+                f.write(part)
+        return os.path.relpath(os.path.abspath(path), self.base_dir)
+
+    def apply(self, rows):
+        """处理一批行中的LOB列，返回新的行元组列表"""
+        result = []
+        for row in rows:
+            self.row_number += 1
+            row = list(row)
+            for index, (name, policy, limit, binary) in self.columns.items():
+                value = row[index]
+                if value is None:
+                    continue
+                if policy == 'skip':
+                    if isinstance(value, dbapi.LOB):
+                        value.close()
+                    row[index] = None
+                elif policy == 'file':
+                    row[index] = self._write_side_file(value, index, name, binary)
+                else:
+                    row[index] = self._truncate(value, limit, binary)
+            result.append(tuple(row))
+        return result
+
+
+EXCEL_MAX_CELL_CHARS = 32767  # 单元格最多容纳的字符数，与xlsxwriter的限制相同
+_ILLEGAL_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+_EXCEL_EPOCH = datetime(1899, 12, 30)
+_EXCEL_EPOCH_DATE = _EXCEL_EPOCH.date()
+
+
+def _xml_text(value):
+    """转义XML文本，去掉XML中不允许出现的控制字符"""
+    if '&' in value:
+        value = value.replace('&', '&amp;')
+    if '<' in value:
+        value = value.replace('<', '&lt;')
+    if '>' in value:
+        value = value.replace('>', '&gt;')
+    if _ILLEGAL_XML_CHARS.search(value):
+        value = _ILLEGAL_XML_CHARS.sub('', value)
+    return value
+
+
+def _xml_attr(value):
+    """转义XML属性值：在_xml_text的基础上把双引号转义为&quot;"""
+    value = _xml_text(value)
+    if '"' in value:
+        value = value.replace('"', '&quot;')
+    return value
+
+
+_COMPRESS_POOL = None
+_COMPRESS_THREADS = 1
+_COMPRESS_POOL_LOCK = threading.Lock()
+
+
+def _compress_pool():
+    """进程内共享的压缩线程池，线程数由XLSX_COMPRESS_THREADS配置（0为CPU核数）"""
+    global _COMPRESS_POOL, _COMPRESS_THREADS
+    with _COMPRESS_POOL_LOCK:
+        if _COMPRESS_POOL is None:
+            _COMPRESS_THREADS = int(os.getenv("XLSX_COMPRESS_THREADS", 0)) or os.cpu_count() or 1
+            _COMPRESS_POOL = ThreadPoolExecutor(max_workers=_COMPRESS_THREADS, thread_name_prefix='xlsx-deflate')
+        return _COMPRESS_POOL
+
+
+def _deflate_chunk(data, level, zdict):
+    """把一个数据块压缩为不带结束标记的deflate片段，各片段按顺序拼接即为完整的deflate流
+
+    zdict为前一个数据块的末尾32KB，与单线程连续压缩相比压缩率基本不变；zlib压缩时释放GIL，可多线程并行。
+    """
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FULL_FLUSH)
+
+
+def _column_name(index):
+    """0 -> A, 25 -> Z, 26 -> AA"""
+    name = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        name = chr(65 + rem) + name
+    return name
+
+
+class XlsxStreamWriter:
+    """导出专用的流式xlsx写入器
+
+    工作表XML按行直接写入zip流，不保留单元格对象，内存占用与行数无关。格式在写入前通过
+    add_format登记并得到样式编号（与xlsxwriter的add_format属性一致，ExcelExporter.init_excel_writer
+    可直接使用），写单元格时只输出编号。字符串默认写为内联字符串，shared_strings为True时
+    使用共享字符串表（文件更小，但不重复的字符串会保留在内存中）。
+    工作表只能依次写入：新建工作表时上一个工作表即写完。
+
+    工作表和共享字符串表按chunk_size切成数据块，提交到压缩线程池并行压缩，写入线程只按顺序
+    把压缩好的数据块写入文件；未写出的数据块数量有上限，内存占用不随文件大小增长。
+    """
+
+    _NS = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+    _NS_R = 'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"'
+
+    def __init__(self, path, shared_strings=False, compresslevel=None, chunk_size=1024 * 1024):
+        self.path = path
+        self.shared_strings = shared_strings
+        self.book = self  # 与pd.ExcelWriter.book相同的用法：writer.book.add_format(...)
+        self.compresslevel = -1 if compresslevel is None else compresslevel
+        self.chunk_size = chunk_size
+        self._zip = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel)
+        self._formats = []
+        self._sheets = []
+        self._part = None
+        self._buffer = bytearray()
+        self._pending = deque()
+        self._tail = b''
+        self._chunks_submitted = 0
+        self._chunks_written = 0
+        self._strings = {}
+        self._string_count = 0
+
+    def _open_part(self, name):
+        """在zip中开始一个并行压缩的部件：先写占位的文件头，写完后回填CRC和大小"""
+        info = zipfile.ZipInfo(name, date_time=time.localtime(time.time())[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = 0o600 << 16
+        info.file_size = info.compress_size = info.CRC = 0
+        info.header_offset = self._zip.fp.tell()
+        self._zip.fp.write(info.FileHeader(zip64=True))
+        self._part = info
+        self._tail = b''
+
+    def _write(self, data):
+        self._buffer += data
+        if len(self._buffer) >= self.chunk_size:
+            buffer = self._buffer
+            full = len(buffer) - len(buffer) % self.chunk_size
+            for start in range(0, full, self.chunk_size):
+                self._submit_chunk(bytes(buffer[start:start + self.chunk_size]))
+            self._buffer = buffer[full:]
+
+    def _submit_chunk(self, chunk=None):
+        if chunk is None:
+            if not self._buffer:
+                return
+            chunk = bytes(self._buffer)
+            self._buffer = bytearray()
+        info = self._part
+        info.CRC = zlib.crc32(chunk, info.CRC)
+        info.file_size += len(chunk)
+        self._pending.append(_compress_pool().submit(_deflate_chunk, chunk, self.compresslevel, self._tail))
+        self._tail = chunk[-32768:]
+        self._chunks_submitted += 1
+        while len(self._pending) > 2 * _COMPRESS_THREADS:
+            self._write_chunk()
+
+    def _write_chunk(self):
+        data = self._pending.popleft().result()
+        self._zip.fp.write(data)
+        self._part.compress_size += len(data)
+        self._chunks_written += 1
+
+    def _close_part(self, progress_callback=None):
+        """写出剩余的数据块并回填文件头，progress_callback(已写出块数, 总块数)最多每0.5秒调用一次"""
+        self._submit_chunk()
+        last_report = 0
+        while self._pending:
+            self._write_chunk()
+            if progress_callback and time.time() - last_report >= 0.5:
+                progress_callback(self._chunks_written, self._chunks_submitted)
+                last_report = time.time()
+        info = self._part
+        # 空的最后一个块，标记deflate流结束
+        end = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15).flush()
+        fp = self._zip.fp
+        fp.write(end)
+        info.compress_size += len(end)
+        position = fp.tell()
+        fp.seek(info.header_offset)
+        fp.write(info.FileHeader(zip64=True))
+        fp.seek(position)
+        self._zip.start_dir = position
+        self._zip.filelist.append(info)
+        self._zip.NameToInfo[info.filename] = info
+        self._part = None
+        if progress_callback:
+            progress_callback(self._chunks_written, self._chunks_submitted)
+
+    def add_format(self, properties=None):
+        """登记格式，返回单元格样式编号（0为默认样式）"""
+        self._formats.append(dict(properties or {}))
+        return len(self._formats)
+
+    @property
+    def sheet_names(self):
+        """已开始写入的工作表名称"""
+        return list(self._sheets)
+
+    def add_sheet(self, name, column_count=0, column_width=None, freeze_header=False):
+        """开始写新的工作表"""
+        self._finish_sheet()
+        self._sheets.append(name)
+        self._open_part(f'xl/worksheets/sheet{len(self._sheets)}.xml')
+        parts = [f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<worksheet {self._NS} {self._NS_R}>']
+        if freeze_header:
+            parts.append('<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" '
+                         'activePane="bottomLeft" state="frozen"/><selection pane="bottomLeft"/></sheetView></sheetViews>')
+        else:
+            parts.append('<sheetViews><sheetView workbookViewId="0"/></sheetViews>')
+        if column_count and column_width:
+            parts.append(f'<cols><col min="1" max="{column_count}" width="{column_width}" customWidth="1"/></cols>')
+        parts.append('<sheetData>')
+        self._write(''.join(parts).encode('utf-8'))
+
+    def write_rows(self, rows, style=0, date_style=0, datetime_style=0):
+        """追加若干行；空值写为只带样式的空单元格，保证后续单元格位置不变"""
+        blank = f'<c s="{style}"/>'
+        number = f'<c s="{style}"><v>'
+        boolean = f'<c s="{style}" t="b"><v>'
+        date_cell = f'<c s="{date_style}"><v>'
+        datetime_cell = f'<c s="{datetime_style}"><v>'
+        if self.shared_strings:
+            string = f'<c s="{style}" t="s"><v>'
+            strings = self._strings
+            close_string = '</v></c>'
+        else:
+            string = f'<c s="{style}" t="inlineStr"><is><t xml:space="preserve">'
+            close_string = '</t></is></c>'
+        parts = []
+        append = parts.append
+        for row in rows:
+            append('<row>')
+            for value in row:
+                kind = type(value)
+                if value is None:
+                    append(blank)
+                elif kind is str:
+                    if len(value) > EXCEL_MAX_CELL_CHARS:
+                        # 超长的单元格Excel会拒绝打开，与xlsxwriter一样截断
+                        value = value[:EXCEL_MAX_CELL_CHARS]
+                    if self.shared_strings:
+                        index = strings.get(value)
+                        if index is None:
+                            index = strings[value] = len(strings)
+                        self._string_count += 1
+                        append(f'{string}{index}{close_string}')
+                    else:
+                        append(f'{string}{_xml_text(value)}{close_string}')
+                elif kind is int:
+                    append(f'{number}{value}</v></c>')
+                elif kind is float:
+                    append(blank if value != value or value in (float('inf'), float('-inf')) else f'{number}{value!r}</v></c>')
+                elif kind is Decimal:
+                    append(f'{number}{value}</v></c>' if value.is_finite() else blank)
+                elif kind is bool:
+                    append(f'{boolean}{int(value)}</v></c>')
+                elif isinstance(value, datetime):
+                    delta = value.replace(tzinfo=None) - _EXCEL_EPOCH
+                    append(f'{datetime_cell}{delta.days + delta.seconds / 86400 + delta.microseconds / 86400e6!r}</v></c>')
+                elif isinstance(value, date):
+                    append(f'{date_cell}{(value - _EXCEL_EPOCH_DATE).days}</v></c>')
+                elif isinstance(value, (int, float, np.integer, np.floating)):
+                    value = float(value)
+                    append(blank if value != value or value in (float('inf'), float('-inf')) else f'{number}{value!r}</v></c>')
+                else:
+                    text = value.decode('utf-8', errors='replace') if isinstance(value, bytes) else str(value)
+                    text = text[:EXCEL_MAX_CELL_CHARS]
+                    append(f'<c s="{style}" t="inlineStr"><is><t xml:space="preserve">{_xml_text(text)}</t></is></c>')
+            append('</row>')
+        self._write(''.join(parts).encode('utf-8'))
+
+    def _finish_sheet(self, progress_callback=None):
+        if self._part is not None:
+            self._write(b'</sheetData></worksheet>')
+            self._close_part(progress_callback)
+
+    def _styles_xml(self):
+        """由登记的格式生成styles.xml"""
+        def color(value):
+            return 'FF' + value.lstrip('#').upper()
+
+        fonts = ['<font><sz val="11"/><name val="Calibri"/><family val="2"/></font>']
+        fills = ['<fill><patternFill patternType="none"/></fill>', '<fill><patternFill patternType="gray125"/></fill>']
+        borders = ['<border><left/><right/><top/><bottom/><diagonal/></border>']
+        num_fmts = []
+        xfs = ['<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>']
+
+        def index_of(items, item):
+            if item not in items:
+                items.append(item)
+            return items.index(item)
+
+        for props in self._formats:
+            font = '<font>'
+            if props.get('bold'):
+                font += '<b/>'
+            font += f'<sz val="{props.get("font_size", 11)}"/>'
+            if props.get('font_color'):
+                font += f'<color rgb="{color(props["font_color"])}"/>'
+            font += f'<name val="{_xml_attr(str(props.get("font_name", "Calibri")))}"/><family val="2"/></font>'
+            font_id = index_of(fonts, font)
+
+            fill_id = 0
+            if props.get('bg_color'):
+                fill_id = index_of(fills, f'<fill><patternFill patternType="solid"><fgColor rgb="{color(props["bg_color"])}"/>'
+                                          f'<bgColor indexed="64"/></patternFill></fill>')
+
+            border_id = 0
+            if props.get('border'):
+                edge_color = f'<color rgb="{color(props["border_color"])}"/>' if props.get('border_color') else '<color auto="1"/>'
+                edge = f'style="thin">{edge_color}'
+                border_id = index_of(borders, f'<border><left {edge}</left><right {edge}</right><top {edge}</top>'
+                                              f'<bottom {edge}</bottom><diagonal/></border>')
+
+            num_fmt_id = 0
+            if props.get('num_format'):
+                code = _xml_attr(props['num_format'])
+                num_fmt_id = 164 + index_of(num_fmts, code)
+
+            align = ''
+            if props.get('align') or props.get('valign'):
+                valign = {'vcenter': 'center'}.get(props.get('valign'), props.get('valign'))
+                attrs = ''.join(f' {k}="{v}"' for k, v in (('horizontal', props.get('align')), ('vertical', valign)) if v)
+                align = f'<alignment{attrs}/>'
+            xf = (f'<xf numFmtId="{num_fmt_id}" fontId="{font_id}" fillId="{fill_id}" borderId="{border_id}" xfId="0"'
+                  ' applyFont="1" applyFill="1" applyBorder="1"')
+            if num_fmt_id:
+                xf += ' applyNumberFormat="1"'
+            xfs.append(f'{xf} applyAlignment="1">{align}</xf>' if align else f'{xf}/>')
+
+        parts = [f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<styleSheet {self._NS}>']
+        if num_fmts:
+            parts.append(f'<numFmts count="{len(num_fmts)}">')
+            parts.extend(f'<numFmt numFmtId="{164 + i}" formatCode="{code}"/>' for i, code in enumerate(num_fmts))
+            parts.append('</numFmts>')
+        for tag, items in (('fonts', fonts), ('fills', fills), ('borders', borders)):
+            parts.append(f'<{tag} count="{len(items)}">{"".join(items)}</{tag}>')
+        parts.append('<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>')
+        parts.append(f'<cellXfs count="{len(xfs)}">{"".join(xfs)}</cellXfs>')
+        parts.append('<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles></styleSheet>')
+        return ''.join(parts)
+
+    def close(self, progress_callback=None):
+        """写完最后一个工作表以及工作簿、样式等其余部件
+
+        progress_callback(已写出块数, 总块数)报告收尾阶段剩余数据块的压缩写出进度。
+        """
+        if self._zip is None:
+            return
+        self._finish_sheet(progress_callback)
+        if not self._sheets:
+            self.add_sheet('Sheet1')
+            self._finish_sheet()
+        sheet_count = len(self._sheets)
+        overrides = ''.join(f'<Override PartName="/xl/worksheets/sheet{i}.xml" ContentType="application/'
+                            f'vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>' for i in range(1, sheet_count + 1))
+        if self.shared_strings:
+            overrides += ('<Override PartName="/xl/sharedStrings.xml" ContentType="application/'
+                          'vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>')
+        self._zip.writestr('[Content_Types].xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/'
+            'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/styles.xml" ContentType="application/'
+            'vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            f'{overrides}</Types>'))
+        self._zip.writestr('_rels/.rels', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+            'officeDocument" Target="xl/workbook.xml"/></Relationships>'))
+        sheets = ''.join(f'<sheet name="{_xml_attr(name)}" sheetId="{i}" r:id="rId{i}"/>'
+                         for i, name in enumerate(self._sheets, start=1))
+        self._zip.writestr('xl/workbook.xml', (
+            f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<workbook {self._NS} {self._NS_R}>'
+            f'<bookViews><workbookView/></bookViews><sheets>{sheets}</sheets></workbook>'))
+        rels = ''.join(f'<Relationship Id="rId{i}" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+                       f'relationships/worksheet" Target="worksheets/sheet{i}.xml"/>' for i in range(1, sheet_count + 1))
+        rels += (f'<Relationship Id="rId{sheet_count + 1}" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+                 f'relationships/styles" Target="styles.xml"/>')
+        if self.shared_strings:
+            rels += (f'<Relationship Id="rId{sheet_count + 2}" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+                     f'relationships/sharedStrings" Target="sharedStrings.xml"/>')
+        self._zip.writestr('xl/_rels/workbook.xml.rels', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            f'<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">{rels}</Relationships>'))
+        self._zip.writestr('xl/styles.xml', self._styles_xml())
+        if self.shared_strings:
+            self._open_part('xl/sharedStrings.xml')
+            self._write((f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<sst {self._NS} '
+                         f'count="{self._string_count}" uniqueCount="{len(self._strings)}">').encode('utf-8'))
+            batch = []
+            for text in self._strings:
+                batch.append(f'<si><t xml:space="preserve">{_xml_text(text)}</t></si>')
+                if len(batch) >= 10000:
+                    self._write(''.join(batch).encode('utf-8'))
+                    batch = []
+            self._write((''.join(batch) + '</sst>').encode('utf-8'))
+            self._close_part(progress_callback)
+        self._zip.close()
+        self._zip = None
+
+
+def create_excel_writer(output_file, constant_memory=False):
+    """按XLSX_WRITER配置创建写入器：stream为流式写入器，xlsxwriter为pandas的ExcelWriter"""
+    if os.getenv("XLSX_WRITER", "stream").lower() == "stream":
+        return XlsxStreamWriter(output_file,
+                                shared_strings=os.getenv("XLSX_SHARED_STRINGS", "False").lower() == "true",
+                                compresslevel=int(os.getenv("XLSX_COMPRESS_LEVEL", 6)),
+                                chunk_size=int(os.getenv("XLSX_COMPRESS_CHUNK_KB", 1024)) * 1024)
+    options = {'nan_inf_to_errors': True}
+    if constant_memory:
+        options['constant_memory'] = True
+    return pd.ExcelWriter(output_file, engine='xlsxwriter', engine_kwargs={'options': options})
+
+
+EXCEL_MAX_ROWS = 1048575  # 每个工作表除表头外最多容纳的行数
+
+
+class SheetWriterMixin:
+    """把游标数据逐批写入当前工作表，writer可以是pd.ExcelWriter或XlsxStreamWriter
+
+    使用前需由init_excel_writer设置writer、sheet_name、各单元格格式以及header_written、start_row。
+    finalize_callback(已完成, 总数)用于报告保存文件（压缩写出剩余数据）阶段的进度。
+    """
+
+    finalize_callback = None
+    reserved_sheet_names = frozenset()  # 换工作表时不能使用的名称（小写），如共享工作簿中其他查询的工作表名
+
+    def write_rows(self, columns, rows):
+        """把一批游标数据追加到当前工作表，首次调用时写入表头；writer可与其他导出器共享
+
+        当前工作表写满EXCEL_MAX_ROWS行后换到新的工作表继续写入，名称为原名称加"_2"、"_3"等序号，
+        跳过工作簿中已有的和reserved_sheet_names中的名称。
+        """
+        if not self.header_written:
+            self.sheet_base, self.sheet_part = self.sheet_name, 1
+            self._write_header(columns)
+        while rows:
+            room = EXCEL_MAX_ROWS - (self.start_row - 1)
+            if room <= 0:
+                # 超出单个工作表的行数上限，换到新的工作表
+                self.sheet_part += 1
+                self.sheet_name = self._rollover_sheet_name()
+                self._write_header(columns)
+                continue
+            self._write_body(columns, rows[:room])
+            rows = rows[room:]
+
+    def _rollover_sheet_name(self):
+        """生成下一个工作表的名称，名称已被占用时继续增加序号"""
+        names = self.writer.sheet_names if isinstance(self.writer, XlsxStreamWriter) else self.writer.sheets
+        taken = {name.lower() for name in names} | set(self.reserved_sheet_names)
+        while True:
+            suffix = f'_{self.sheet_part}'
+            name = self.sheet_base[:31 - len(suffix)] + suffix
+            if name.lower() not in taken:
+                return name
+            self.sheet_part += 1
+
+    def _write_header(self, columns):
+        """开始当前工作表并写入表头"""
+        column_width = int(os.getenv("COLUMN_WIDTH", 20))
+        freeze = os.getenv("FREEZE_PANES", "True").lower() == "true"
+        if isinstance(self.writer, XlsxStreamWriter):
+            self.writer.add_sheet(self.sheet_name, len(columns), column_width, freeze)
+            self.writer.write_rows([columns], self.header_format)
+        else:
+            pd.DataFrame(columns=columns).to_excel(self.writer, sheet_name=self.sheet_name, index=False, startrow=0)
+            self.worksheet = self.writer.sheets[self.sheet_name]
+            for col_num, value in enumerate(columns):
+                self.worksheet.write(0, col_num, value, self.header_format)
+            self.worksheet.set_column(0, len(columns) - 1, column_width)
+            if freeze:
+                self.worksheet.freeze_panes(1, 0)
+        self.header_written = True
+        self.start_row = 1
+
+    def _write_body(self, columns, rows):
+        """把不超过当前工作表剩余容量的一批行写在已写内容之后"""
+        if isinstance(self.writer, XlsxStreamWriter):
+            # 流式写入器按数据库返回的类型直接输出，不做数值转换，数字形式的字符串（如'00123'）保持为文本
+            self.writer.write_rows(rows, self.body_format, self.date_format, self.datetime_format)
+            self.start_row += len(rows)
+            return
+
+        df = pd.DataFrame(rows, columns=columns)
+        for col in df.columns:
+            # 只转换对象列，日期时间列转换后会变成整数
+            if df[col].dtype != object:
+                continue
+            try:
+                df[col] = pd.to_numeric(df[col])
+            except (ValueError, TypeError):
+                continue
+
+        for r_idx, data_row in enumerate(df.values):
+            for c_idx, value in enumerate(data_row):
+                cell_format = self.body_format
+                if pd.isna(value) or (isinstance(value, float) and (value == float('inf') or value == float('-inf'))):
+                    value = None
+                elif isinstance(value, datetime):
+                    cell_format = self.datetime_format
+                elif isinstance(value, date):
+                    cell_format = self.date_format
+                self.worksheet.write(self.start_row + r_idx, c_idx, value, cell_format)
+        self.start_row += len(rows)
+
+    def close_writer(self):
+        """保存并关闭工作簿；pandas写入器无法报告进度，只在开始和结束时各通知一次"""
+        if isinstance(self.writer, XlsxStreamWriter):
+            self.writer.close(self.finalize_callback)
+            return
+        if self.finalize_callback:
+            self.finalize_callback(0, 1)
+        self.writer.close()
+        if self.finalize_callback:
+            self.finalize_callback(1, 1)
+
+
+class StreamExporter(SheetWriterMixin):
     """流式Excel导出工具类"""
     
     def __init__(self, sql_query, output_file):
@@ -122,6 +1531,11 @@ class StreamExporter:
         self.sql_query = self.utils._clean_query(sql_query)
         self.output_file = output_file
         self.writer = None
+        self.sink = None
+        self.lobs = None
+        self.governor = MemoryGovernor()
+        self.metrics = None
+        self.cancelled = False  # 由其他线程设置，下一批数据前停止导出
         self.total_records = 0
         self.current_offset = 0
         self.chunk_size = 1000  # 每次获取的数据量
@@ -137,15 +1551,12 @@ class StreamExporter:
 
     def init_excel_writer(self):
         """初始化Excel写入器"""
-        self.writer = pd.ExcelWriter(
-            self.output_file, 
-            engine='xlsxwriter',
-            engine_kwargs={'options': {'nan_inf_to_errors': True}}
-        )
+        self.writer = create_excel_writer(self.output_file)
         self.workbook = self.writer.book
         self.worksheet = None
         self.header_written = False
         self.start_row = 0
+        self.sheet_name = 'Data'
 
         # 定义格式
         self.header_format = self.workbook.add_format({
@@ -159,7 +1570,7 @@ class StreamExporter:
             'valign': 'vcenter'
         })
 
-        self.body_format = self.workbook.add_format({
+        body_properties = {
             'font_color': '#50596d',
             'font_size': 9,
             'bg_color': '#ffffff',
@@ -168,67 +1579,65 @@ class StreamExporter:
             'font_name': "Arial",
             'align': 'center',
             'valign': 'vcenter'
-        })
+        }
+        self.body_format = self.workbook.add_format(body_properties)
+        self.date_format = self.workbook.add_format({**body_properties, 'num_format': 'yyyy-mm-dd'})
+        self.datetime_format = self.workbook.add_format({**body_properties, 'num_format': 'yyyy-mm-dd hh:mm:ss'})
+
+    def open_output(self, columns):
+        """按输出文件扩展名选择写入方式：.csv/.parquet写入列式输出，其他写入xlsx"""
+        self.sink = create_sink(self.output_file)
+        if self.sink is None:
+            self.init_excel_writer()
+            self.write_rows(columns, [])
+        else:
+            self.sink.open(columns)
+
+    def write_output(self, columns, rows):
+        if self.lobs:
+            rows = self.lobs.apply(rows)
+        if self.sink is None:
+            self.write_rows(columns, rows)
+        else:
+            self.sink.write_batch(ColumnBatch.from_rows(columns, rows))
+
+    def close_output(self):
+        if self.sink is not None:
+            self.sink.close(self.finalize_callback)
+        elif self.writer:
+            self.close_writer()
+
+    def report_progress(self, processed):
+        """每写入一批数据后调用，子类可改为通知界面"""
+        progress = processed/self.total_records
+        print(f"已导出 {processed}/{self.total_records} 条记录 ({progress:.1%})")
 
     def export(self):
         """执行流式导出"""
+        processed = 0
         try:
             cursor = self.utils.get_cursor()
             self.get_total_records(cursor)
-            self.init_excel_writer()
 
             # 执行查询但不获取所有结果
             cursor.execute(self.sql_query)
             columns = [desc[0] for desc in cursor.description]
+            self.lobs = LobHandler.from_cursor(cursor, self.output_file)
             
             # 写入表头
-            df = pd.DataFrame(columns=columns)
-            df.to_excel(self.writer, sheet_name='Data', index=False, startrow=0)
-            self.worksheet = self.writer.sheets['Data']
-            
-            # 应用表头格式
-            for col_num, value in enumerate(columns):
-                self.worksheet.write(0, col_num, value, self.header_format)
-            
-            # 设置列宽
-            self.worksheet.set_column(0, len(columns) - 1, 20)
-            
-            # 冻结首行
-            self.worksheet.freeze_panes(1, 0)
-            
-            row = 1  # 从第二行开始写入数据（第一行是表头）
-            processed = 0
+            self.open_output(columns)
             
             while True:
-                # 流式获取数据
-                results = cursor.fetchmany(self.chunk_size)
+                if self.cancelled:
+                    raise Exception("导出已取消")
+                # 流式获取数据，内存接近上限时缩小批次
+                results = cursor.fetchmany(self.governor.batch_size(self.chunk_size))
                 if not results:
                     break
                     
-                # 转换为DataFrame并写入Excel
-                df = pd.DataFrame(results, columns=columns)
-                
-                # 转换数值字段
-                for col in df.columns:
-                    try:
-                        df[col] = pd.to_numeric(df[col])
-                    except (ValueError, TypeError):
-                        continue
-                
-                # 写入数据并应用格式
-                for r_idx, data_row in enumerate(df.values):
-                    for c_idx, value in enumerate(data_row):
-                        # 处理NaN/INF值
-                        if pd.isna(value) or (isinstance(value, float) and (value == float('inf') or value == float('-inf'))):
-                            value = None
-                        self.worksheet.write(row + r_idx, c_idx, value, self.body_format)
-                
-                row += len(results)
+                self.write_output(columns, results)
                 processed += len(results)
-                
-                # 更新进度
-                progress = processed/self.total_records
-                print(f"已导出 {processed}/{self.total_records} 条记录 ({progress:.1%})")
+                self.report_progress(processed)
                 
             return True
             
@@ -236,10 +1645,33 @@ class StreamExporter:
             print(f"导出失败: {e}")
             raise
         finally:
-            if self.writer:
-                self.writer.close()
+            self.close_output()
+            self.metrics = self.governor.report('stream', self.output_file, processed)
+            print(f"导出结束，{self.governor.summary()}")
 
-class ExcelExporter:
+    def export_batches(self, columns, batches, source=None):
+        """从已获取的数据导出，不查询数据库；batches逐个产生ColumnBatch（如预览结果集和保留的游标）"""
+        processed = 0
+        try:
+            self.open_output(columns)
+            for batch in batches:
+                if self.cancelled:
+                    raise Exception("导出已取消")
+                if self.sink is None:
+                    self.write_rows(columns, batch.to_rows())
+                else:
+                    self.sink.write_batch(batch)
+                processed += len(batch)
+            return True
+        except Exception as e:
+            print(f"导出失败: {e}")
+            raise
+        finally:
+            self.close_output()
+            self.metrics = self.governor.report('stream', self.output_file, processed, source=source)
+            print(f"导出结束，{self.governor.summary()}")
+
+class ExcelExporter(SheetWriterMixin):
     """Excel导出工具类"""
     
     def __init__(self, sql_query, output_file, page_size=None, log_callback=None):
@@ -249,6 +1681,11 @@ class ExcelExporter:
         self.output_file = output_file
         self.page_size = int(os.getenv("PAGE_SIZE", 2000)) if page_size is None else page_size
         self.writer = None
+        self.lobs = None
+        self.governor = MemoryGovernor()
+        self.requested_page_size = self.page_size
+        self.metrics = None  # 导出结束后的指标，见MemoryGovernor.report
+        self.cancelled = False  # 由其他线程设置，下一页前停止导出
         self.total_records = 0
         self.current_offset = 0
         self.page_number = 1
@@ -298,7 +1735,7 @@ class ExcelExporter:
         })
 
         # 定义表格正文格式（包含居中对齐）
-        self.body_format = self.workbook.add_format({
+        body_properties = {
             'font_color': os.getenv("BODY_FONT_COLOR", '#50596d'),
             'font_size': int(os.getenv("BODY_FONT_SIZE", 9)),
             'bg_color': os.getenv("BODY_BG_COLOR", '#ffffff'),
@@ -307,7 +1744,11 @@ class ExcelExporter:
             'font_name': os.getenv("FONT_NAME", "Arial"),
             'align': 'center',
             'valign': 'vcenter'
-        })
+        }
+        self.body_format = self.workbook.add_format(body_properties)
+        # 日期和时间单元格使用带数字格式的正文格式
+        self.date_format = self.workbook.add_format({**body_properties, 'num_format': 'yyyy-mm-dd'})
+        self.datetime_format = self.workbook.add_format({**body_properties, 'num_format': 'yyyy-mm-dd hh:mm:ss'})
 
         # 定义居中对齐和边框格式
         self.center_format = self.workbook.add_format({
@@ -343,11 +1784,18 @@ class ExcelExporter:
             if self.log_callback and self._ordered_query != original_query:
                 self.log_callback(f"自动添加排序字段，实际执行的SQL:\n{self._ordered_query}")
         
+        # 内存接近上限时缩小后续分页，偏移按实际分页大小递增
+        self.page_size = self.governor.batch_size(self.requested_page_size)
         paginated_query = f"{self._ordered_query} LIMIT {self.page_size} OFFSET {self.current_offset}"
         cursor.execute(paginated_query)
         
         results = cursor.fetchall()
         columns = [desc[0] for desc in cursor.description]
+        if self.lobs is None:
+            # 同一个处理器用于所有分页，旁路文件按全局行号命名
+            self.lobs = LobHandler.from_cursor(cursor, self.output_file)
+        if self.lobs:
+            results = self.lobs.apply(results)
         df = pd.DataFrame(results, columns=columns)
         
         # 转换数值字段
@@ -395,7 +1843,7 @@ class ExcelExporter:
     def close(self):
         """关闭资源"""
         if self.writer:
-            self.writer.close()
+            self.close_writer()
 
     def export(self):
         """执行导出流程"""
@@ -405,6 +1853,8 @@ class ExcelExporter:
             self.init_excel_writer()
             
             while self.current_offset < self.total_records:
+                if self.cancelled:
+                    raise Exception("导出已取消")
                 self.export_page(cursor)
             
             print(f"成功导出数据到 {self.output_file}")
@@ -414,49 +1864,29 @@ class ExcelExporter:
             raise
         finally:
             self.close()
+            self.metrics = self.governor.report('paged', self.output_file, min(self.current_offset, self.total_records))
+            print(f"导出结束，{self.governor.summary()}")
             
     def export_all(self):
         """直接导出全部数据"""
+        results = []
         try:
             cursor = self.utils.get_cursor()
-            self.init_excel_writer()
+            self.init_excel_writer(writer=create_excel_writer(self.output_file))
             
             # 执行查询
             cursor.execute(self.sql_query)
             columns = [desc[0] for desc in cursor.description]
             
-            # 写入表头
-            df = pd.DataFrame(columns=columns)
-            df.to_excel(self.writer, sheet_name='Data', index=False, startrow=0)
-            self.worksheet = self.writer.sheets['Data']
-            
-            # 应用表头格式
-            for col_num, value in enumerate(columns):
-                self.worksheet.write(0, col_num, value, self.header_format)
-            
-            # 设置列宽
-            self.worksheet.set_column(0, len(columns) - 1, 20)
-            
-            # 冻结首行
-            self.worksheet.freeze_panes(1, 0)
-            
-            # 获取并写入所有数据
+            # 写入表头和全部数据
             results = cursor.fetchall()
-            df = pd.DataFrame(results, columns=columns)
-            
-            # 转换数值字段
-            for col in df.columns:
-                try:
-                    df[col] = pd.to_numeric(df[col])
-                except (ValueError, TypeError):
-                    continue
-            
-            # 写入数据并应用格式
-            for r_idx, data_row in enumerate(df.values):
-                for c_idx, value in enumerate(data_row):
-                    if pd.isna(value) or (isinstance(value, float) and (value == float('inf') or value == float('-inf'))):
-                        value = None
-                    self.worksheet.write(1 + r_idx, c_idx, value, self.body_format)
+            if self.cancelled:
+                raise Exception("导出已取消")
+            self.governor.sample(force=True)
+            self.lobs = LobHandler.from_cursor(cursor, self.output_file)
+            if self.lobs:
+                results = self.lobs.apply(results)
+            self.write_rows(columns, results)
             
             print(f"成功导出所有数据到 {self.output_file}")
             
@@ -465,3 +1895,1677 @@ class ExcelExporter:
             raise
         finally:
             self.close()
+            self.metrics = self.governor.report('all', self.output_file, len(results))
+            print(f"导出结束，{self.governor.summary()}")
+
+    def export_batches(self, columns, batches, source=None):
+        """从已获取的数据导出到一个工作表，不查询数据库；batches逐个产生ColumnBatch"""
+        processed = 0
+        try:
+            self.init_excel_writer(writer=create_excel_writer(self.output_file))
+            self.write_rows(columns, [])
+            for batch in batches:
+                if self.cancelled:
+                    raise Exception("导出已取消")
+                self.write_rows(columns, batch.to_rows())
+                processed += len(batch)
+            print(f"成功导出数据到 {self.output_file}")
+        except Exception as e:
+            print(f"导出失败: {e}")
+            raise
+        finally:
+            self.close()
+            self.metrics = self.governor.report('all', self.output_file, processed, source=source)
+            print(f"导出结束，{self.governor.summary()}")
+
+def parse_parameter_sets(text):
+    """解析参数组：第一行为参数名，之后每行一组参数值（CSV格式）"""
+    rows = [row for row in csv.reader(io.StringIO(text)) if any(cell.strip() for cell in row)]
+    if not rows:
+        return [], []
+    names = [name.strip() for name in rows[0]]
+    param_sets = []
+    for line_no, row in enumerate(rows[1:], start=2):
+        if len(row) != len(names):
+            raise ValueError(f"第{line_no}行有{len(row)}个值，参数名有{len(names)}个")
+        param_sets.append(dict(zip(names, (value.strip() for value in row))))
+    return names, param_sets
+
+
+class ConcurrentExport:
+    """在连接池的多个连接上并发执行多条查询并导出到Excel
+
+    queries为(名称, SQL, 绑定参数列表或None)列表。每个工作线程从连接池取一个连接，
+    依次处理分到的查询；带参数的查询使用连接上的预编译语句，同一语句只编译一次。
+    per_sheet为False时每条查询写一个文件（output为目录），为True时全部写入同一个工作簿
+    （output为文件路径），每条查询一个工作表，由调用run的线程统一写入。
+    某条查询失败只记录错误，不影响其他查询。count_rows为True时先统计各查询的总行数。
+    progress_callback(事件, 查询序号, 信息)，事件为start、count、rows、done、error。
+    settings为(隔离级别, 默认schema)时应用到每个借用的连接上，归还前恢复默认设置。
+    """
+
+    def __init__(self, queries, output, per_sheet=False, pool=None, workers=None,
+                 chunk_size=1000, count_rows=False, progress_callback=None, settings=None):
+        self.queries = [(name, sql.strip().rstrip(';'), params) for name, sql, params in queries]
+        self.output = output
+        self.per_sheet = per_sheet
+        self.pool = pool or ConnectionPool()
+        self.workers = max(1, min(workers or self.pool.size, self.pool.size, len(self.queries) or 1))
+        self.chunk_size = chunk_size
+        self.count_rows = count_rows
+        self.progress_callback = progress_callback
+        self.settings = settings or (None, None)
+        self.cancelled = False
+        self.labels = self._make_labels()
+        self.governor = None
+        self.metrics = None
+
+    def _make_labels(self):
+        """由查询名称生成互不重复的文件名或工作表名"""
+        labels, seen = [], set()
+        limit = 31 if self.per_sheet else 100
+        for index, (name, _, _) in enumerate(self.queries):
+            label = re.sub(r'[\\/:*?"<>|\[\]\']', '_', name)[:limit].strip() or f"查询{index + 1}"
+            base, n = label, 2
+            while label.lower() in seen:
+                suffix = f"_{n}"
+                label = base[:limit - len(suffix)] + suffix
+                n += 1
+            seen.add(label.lower())
+            labels.append(label)
+        return labels
+
+    def _notify(self, event, index, info=None):
+        if self.progress_callback:
+            self.progress_callback(event, index, info)
+
+    def output_path(self, index):
+        if self.per_sheet:
+            return self.output
+        return os.path.join(self.output, f"{self.labels[index]}.xlsx")
+
+    def run(self):
+        """执行全部查询，返回每条查询的结果字典（label、rows、seconds、output、error）"""
+        jobs = queue.Queue()
+        for index in range(len(self.queries)):
+            jobs.put(index)
+        self.results = [None] * len(self.queries)
+        # 各工作线程共享一个内存控制器，超过上限时阻塞取数，等待写入线程消化队列中的数据
+        self.governor = MemoryGovernor()
+        sink = queue.Queue(maxsize=self.workers * 4) if self.per_sheet else None
+
+        threads = [threading.Thread(target=self._worker, args=(jobs, sink), daemon=True)
+                   for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        if sink is not None:
+            self._write_sheets(sink, len(threads))
+        for thread in threads:
+            thread.join()
+        self.metrics = self.governor.report('concurrent', self.output, sum(r['rows'] for r in self.results if r),
+                                            queries=len(self.queries),
+                                            failed=sum(1 for r in self.results if r and r['error']))
+        return self.results
+
+    def _worker(self, jobs, sink):
+        utils = None
+        try:
+            while not self.cancelled:
+                try:
+                    index = jobs.get_nowait()
+                except queue.Empty:
+                    break
+                start_time = time.time()
+                self._notify('start', index)
+                try:
+                    if utils is None:
+                        borrowed = self.pool.acquire()
+                        try:
+                            QuerySession.apply_settings(borrowed, *self.settings)
+                        except Exception:
+                            QuerySession.reset_settings(borrowed, self.settings)
+                            self.pool.release(borrowed)
+                            raise
+                        utils = borrowed
+                    rows = self._run_set(utils, index, sink)
+                    self.results[index] = {'label': self.labels[index], 'rows': rows, 'seconds': time.time() - start_time,
+                                           'output': self.output_path(index), 'error': None}
+                    self._notify('done', index, self.results[index])
+                except Exception as e:
+                    self.results[index] = {'label': self.labels[index], 'rows': 0, 'seconds': time.time() - start_time,
+                                           'output': None, 'error': str(e)}
+                    if sink is not None:
+                        sink.put(('error', index, str(e)))
+                    self._notify('error', index, self.results[index])
+                    # 连接断开时换一个连接继续处理后面的查询
+                    if utils is not None and not utils.is_connected():
+                        self.pool.release(utils)
+                        utils = None
+        finally:
+            if utils is not None:
+                QuerySession.reset_settings(utils, self.settings)
+                self.pool.release(utils)
+            if sink is not None:
+                sink.put(('exit', None, None))
+
+    def _run_set(self, utils, index, sink):
+        """执行一条查询，并把结果写入文件或交给写入线程"""
+        _, sql, params = self.queries[index]
+        if self.count_rows:
+            count_cursor = utils.get_cursor()
+            try:
+                count_sql = f"SELECT COUNT(*) FROM (\n{sql}\n)"
+                if params:
+                    count_cursor.execute(count_sql, params)
+                else:
+                    count_cursor.execute(count_sql)
+                self._notify('count', index, count_cursor.fetchone()[0])
+            finally:
+                count_cursor.close()
+        if params:
+            key, cursor, _ = utils.statements.execute(sql, params)
+            release = lambda: utils.statements.release(key, cursor)
+        else:
+            cursor = utils.get_cursor()
+            cursor.execute(sql)
+            release = cursor.close
+        try:
+            if not cursor.description:
+                raise Exception("查询未返回结果集")
+            columns = [desc[0] for desc in cursor.description]
+            # 写入同一个工作簿时各查询的旁路文件放在以工作表名命名的子目录中
+            if sink is None:
+                lobs = LobHandler.from_cursor(cursor, self.output_path(index))
+            else:
+                lobs = LobHandler.from_cursor(cursor, self.output, subdir=self.labels[index])
+            exporter = None
+            if sink is None:
+                path = self.output_path(index)
+                exporter = ExcelExporter(sql, path)
+                exporter.init_excel_writer(writer=create_excel_writer(path, constant_memory=True))
+                exporter.write_rows(columns, [])
+            else:
+                sink.put(('columns', index, columns))
+            total = 0
+            try:
+                while not self.cancelled:
+                    rows = cursor.fetchmany(self.governor.batch_size(self.chunk_size))
+                    if not rows:
+                        break
+                    if lobs:
+                        rows = lobs.apply(rows)
+                    if exporter is not None:
+                        exporter.write_rows(columns, rows)
+                    else:
+                        sink.put(('rows', index, rows))
+                    total += len(rows)
+                    self._notify('rows', index, total)
+            finally:
+                if exporter is not None:
+                    exporter.close()
+            if self.cancelled:
+                raise Exception("已取消")
+            return total
+        finally:
+            release()
+
+    def _write_sheets(self, sink, producers):
+        """单线程把各查询的数据写入同一个工作簿，每条查询一个工作表"""
+        # 各工作表交替写入，但每个工作表内按行号顺序写，可以使用constant_memory逐行写出
+        writer = pd.ExcelWriter(self.output, engine='xlsxwriter',
+                                engine_kwargs={'options': {'nan_inf_to_errors': True, 'constant_memory': True}})
+        sheets = {}
+        error = None
+        try:
+            while producers:
+                kind, index, payload = sink.get()
+                if kind == 'exit':
+                    producers -= 1
+                    continue
+                if error is not None:
+                    # 写入失败后继续取走队列中的数据，避免工作线程阻塞
+                    continue
+                try:
+                    self._write_sheet_item(writer, sheets, kind, index, payload)
+                except Exception as e:
+                    error = e
+                    self.cancelled = True
+        finally:
+            writer.close()
+        if error is not None:
+            raise error
+
+    def _write_sheet_item(self, writer, sheets, kind, index, payload):
+        if index not in sheets:
+            sheets[index] = ExcelExporter(self.queries[index][1], self.output)
+            sheets[index].init_excel_writer(writer=writer, sheet_name=self.labels[index])
+            # 其他查询的工作表可能稍后才创建，换工作表时不能占用它们的名称
+            sheets[index].reserved_sheet_names = {label.lower() for label in self.labels}
+            sheets[index].columns = None
+        sheet = sheets[index]
+        if kind == 'columns':
+            sheet.columns = payload
+            sheet.write_rows(payload, [])
+        elif kind == 'rows':
+            sheet.write_rows(sheet.columns, payload)
+        elif kind == 'error':
+            # 失败的查询在其工作表末尾写入错误信息
+            if not sheet.header_written:
+                sheet.write_rows(['错误'], [])
+            sheet.worksheet.write(sheet.start_row, 0, f"导出失败: {payload}")
+
+
+class ParameterSweep(ConcurrentExport):
+    """同一条SQL按多组参数并发导出，每组参数是一条绑定参数的查询，名称由参数值组成"""
+
+    def __init__(self, sql_query, param_sets, output, **kwargs):
+        self.param_sets = param_sets
+        queries = []
+        for values in param_sets:
+            sql, params = bind_placeholders(sql_query, values)
+            queries.append(('_'.join(str(v) for v in values.values()), sql, params))
+        super().__init__(queries, output, **kwargs)
+
+
+def _write_shard(shard_index, path, columns, inbox, outbox):
+    """分片写入进程：把收到的批次依次写入自己的xlsx文件，收到None时保存并退出"""
+    start_time = time.time()
+    rows_written = 0
+    governor = MemoryGovernor(limit_mb=0)
+    try:
+        writer = create_excel_writer(path, constant_memory=True)
+        exporter = ExcelExporter('', path)
+        exporter.init_excel_writer(writer=writer, sheet_name='Data')
+        exporter.write_rows(columns, [])
+        while True:
+            item = inbox.get()
+            if item is None:
+                break
+            rows = ColumnBatch.from_bytes(columns, item).to_rows()
+            governor.sample()
+            # 超出单个工作表的行数上限时write_rows会换到新的工作表
+            exporter.write_rows(columns, rows)
+            rows_written += len(rows)
+        sheets = exporter.sheet_part
+        exporter.close()
+        governor.sample(force=True)
+        outbox.put(('done', shard_index, {'rows': rows_written, 'sheets': sheets, 'seconds': time.time() - start_time,
+                                          'peak_rss_mb': round(governor.peak_rss / 1048576, 1)}))
+    except Exception as e:
+        outbox.put(('error', shard_index, str(e)))
+        # 继续取走剩余批次，避免取数线程阻塞
+        while inbox.get() is not None:
+            pass
+
+
+class ShardedExporter:
+    """多进程分片导出：取数线程把结果按批次轮流分给多个写入进程，每个进程写一个xlsx分片
+
+    XLSX编码是纯Python的CPU密集操作，分到多个进程后可以利用多核。批次以列式字节块传给写入进程，
+    避免逐行pickle。导出目录中的manifest.json按分片记录各自包含的行区间（从0开始，左闭右开），
+    可据此还原原始顺序。
+    """
+
+    def __init__(self, sql_query, output_dir, workers=None, batch_rows=None, utils=None, progress_callback=None):
+        self.sql_query = sql_query.strip().rstrip(';')
+        self.output_dir = output_dir
+        self.workers = workers or int(os.getenv("SHARD_WORKERS", 0)) or os.cpu_count() or 1
+        self.batch_rows = batch_rows or int(os.getenv("SHARD_BATCH_ROWS", 50000))
+        self.utils = utils
+        self.progress_callback = progress_callback  # (已取数行数, 总行数)
+        self.total_records = 0
+        self.governor = MemoryGovernor()
+        self.metrics = None
+
+    def _put(self, inbox, process, outbox, item):
+        """发送批次；写入进程退出或报错时中止导出"""
+        while True:
+            self._check_errors(outbox)
+            try:
+                inbox.put(item, timeout=1)
+                return
+            except queue.Full:
+                if not process.is_alive():
+                    raise Exception("分片写入进程已意外退出")
+
+    def _check_errors(self, outbox):
+        try:
+            kind, shard_index, info = outbox.get_nowait()
+        except queue.Empty:
+            return
+        if kind == 'error':
+            raise Exception(f"分片{shard_index + 1}写入失败: {info}")
+        self._finished[shard_index] = info
+
+    def export(self):
+        """执行导出，返回manifest文件路径"""
+        start_time = time.time()
+        own_utils = self.utils is None
+        utils = HANAUtils() if own_utils else self.utils
+        if own_utils:
+            utils.connect()
+        cursor = utils.get_cursor()
+        processes = []
+        try:
+            cursor.execute(f"SELECT COUNT(*) FROM (\n{self.sql_query}\n)")
+            self.total_records = cursor.fetchone()[0]
+            cursor.execute(self.sql_query)
+            columns = [desc[0] for desc in cursor.description]
+            # LOB在取数进程中处理，旁路文件放在分片目录下
+            lobs = LobHandler.from_cursor(cursor, os.path.join(self.output_dir, os.path.basename(os.path.normpath(self.output_dir)) + '.xlsx'))
+
+            os.makedirs(self.output_dir, exist_ok=True)
+            stem = os.path.basename(os.path.normpath(self.output_dir))
+            # 固定使用spawn，避免在持有数据库连接和界面线程的进程中fork
+            ctx = multiprocessing.get_context('spawn')
+            outbox = ctx.Queue()
+            self._finished = {}
+            shards = []
+            for index in range(self.workers):
+                path = os.path.join(self.output_dir, f"{stem}_part{index + 1:03d}.xlsx")
+                inbox = ctx.Queue(maxsize=2)
+                process = ctx.Process(target=_write_shard, args=(index, path, columns, inbox, outbox), daemon=True)
+                process.start()
+                processes.append(process)
+                shards.append({'file': os.path.basename(path), 'inbox': inbox, 'ranges': []})
+
+            fetched = 0
+            batch_index = 0
+            while True:
+                # 取数进程接近内存上限时缩小批次；写入进程的队列已满时_put本身会阻塞
+                rows = cursor.fetchmany(self.governor.batch_size(self.batch_rows))
+                if not rows:
+                    break
+                if lobs:
+                    rows = lobs.apply(rows)
+                shard_index = batch_index % self.workers
+                shard = shards[shard_index]
+                self._put(shard['inbox'], processes[shard_index], outbox, ColumnBatch.from_rows(columns, rows).to_bytes())
+                shard['ranges'].append([fetched, fetched + len(rows)])
+                fetched += len(rows)
+                batch_index += 1
+                if self.progress_callback:
+                    self.progress_callback(fetched, self.total_records)
+
+            for shard, process in zip(shards, processes):
+                self._put(shard['inbox'], process, outbox, None)
+            while len(self._finished) < len(processes):
+                try:
+                    kind, shard_index, info = outbox.get(timeout=1)
+                except queue.Empty:
+                    if not all(p.is_alive() for i, p in enumerate(processes) if i not in self._finished):
+                        raise Exception("分片写入进程已意外退出")
+                    continue
+                if kind == 'error':
+                    raise Exception(f"分片{shard_index + 1}写入失败: {info}")
+                self._finished[shard_index] = info
+            for process in processes:
+                process.join()
+
+            manifest = {
+                'query': self.sql_query,
+                'columns': columns,
+                'total_rows': fetched,
+                'batch_rows': self.batch_rows,
+                'created': datetime.now().isoformat(timespec='seconds'),
+                'seconds': round(time.time() - start_time, 3),
+                'shards': [{'file': shard['file'], 'rows': self._finished[i]['rows'], 'sheets': self._finished[i]['sheets'],
+                            'peak_rss_mb': self._finished[i]['peak_rss_mb'], 'ranges': shard['ranges']}
+                           for i, shard in enumerate(shards)],
+            }
+            self.metrics = self.governor.report('sharded', self.output_dir, fetched, workers=self.workers,
+                                                shard_peak_rss_mb=[s['peak_rss_mb'] for s in manifest['shards']])
+            manifest['peak_rss_mb'] = self.metrics['peak_rss_mb']
+            manifest_path = os.path.join(self.output_dir, 'manifest.json')
+            with open(manifest_path, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False, indent=2)
+            return manifest_path
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+            try:
+                cursor.close()
+            except Exception:
+                pass
+            if own_utils:
+                utils.disconnect()
+
+
+class ExportJob:
+    """导出任务队列中的一个任务
+
+    target(job, utils)在工作线程中执行导出，utils为连接池中的连接（connection为False时为None），
+    返回值保存在result中。导出过程中调用update(rows, total)报告进度；attach关联的导出器在取消时设置cancelled标志。
+    """
+
+    def __init__(self, job_id, label, target, output=None, priority=False, connection=True):
+        self.id = job_id
+        self.label = label
+        self.target = target
+        self.output = output
+        self.priority = priority
+        self.connection = connection  # 是否需要连接池中的连接，从已获取的数据导出时不需要
+        self.status = 'waiting'  # waiting、connecting（已占用运行名额，等待连接池的连接）、running、done、failed、cancelled
+        self.rows = 0
+        self.total = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.cancelled = False
+        self.exporter = None
+        self.manager = None
+
+    @property
+    def active(self):
+        return self.status in ('waiting', 'connecting', 'running')
+
+    def attach(self, exporter):
+        """关联导出器，任务取消时停止其取数循环"""
+        self.exporter = exporter
+        exporter.cancelled = self.cancelled
+
+    def update(self, rows, total=None):
+        self.rows = rows
+        if total is not None:
+            self.total = total
+        if self.manager is not None:
+            self.manager._notify(self)
+
+    def rows_per_second(self):
+        if self.started is None:
+            return 0.0
+        elapsed = (self.finished or time.time()) - self.started
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def eta_seconds(self):
+        """按当前速度估算的剩余秒数，总行数未知时返回None"""
+        rate = self.rows_per_second()
+        if self.status != 'running' or not self.total or rate <= 0:
+            return None
+        return max(self.total - self.rows, 0) / rate
+
+
+class ExportJobManager:
+    """导出任务队列：最多concurrency个任务同时在连接池的连接上运行，其余排队等待
+
+    优先任务排在普通任务之前，并可额外占用priority_slots个运行名额，
+    小任务不必等待正在运行的大任务结束。on_change(job)在任务状态或进度变化时调用，
+    调用线程可能是工作线程。
+    """
+
+    def __init__(self, pool=None, concurrency=None, priority_slots=None, on_change=None):
+        self.pool = pool or ConnectionPool()
+        self.concurrency = max(1, int(os.getenv("EXPORT_CONCURRENCY", 2)) if concurrency is None else concurrency)
+        self.priority_slots = max(0, int(os.getenv("EXPORT_PRIORITY_SLOTS", 1)) if priority_slots is None else priority_slots)
+        self.on_change = on_change
+        self.jobs = []  # 按提交顺序
+        self._waiting = []  # (0为优先/1为普通, 任务ID, 任务) 的堆
+        self._running = 0
+        self._next_id = 0
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def _notify(self, job):
+        if self.on_change:
+            self.on_change(job)
+
+    def submit(self, label, target, output=None, priority=False, connection=True):
+        """加入队列，有空闲名额时立即开始，返回ExportJob"""
+        with self._lock:
+            if self._closed:
+                raise Exception("导出任务队列已关闭")
+            self._next_id += 1
+            job = ExportJob(self._next_id, label, target, output, priority, connection)
+            job.manager = self
+            self.jobs.append(job)
+            heapq.heappush(self._waiting, (0 if priority else 1, job.id, job))
+        self._notify(job)
+        self._dispatch()
+        return job
+
+    def _dispatch(self):
+        started = []
+        with self._lock:
+            while self._waiting and not self._closed:
+                rank, _, job = self._waiting[0]
+                if job.status != 'waiting':
+                    # 排队时已取消
+                    heapq.heappop(self._waiting)
+                    continue
+                limit = self.concurrency + (self.priority_slots if rank == 0 else 0)
+                if self._running >= limit:
+                    break
+                heapq.heappop(self._waiting)
+                job.status = 'connecting'
+                self._running += 1
+                started.append(job)
+        for job in started:
+            threading.Thread(target=self._run, args=(job,), daemon=True).start()
+            self._notify(job)
+
+    def _run(self, job):
+        utils = None
+        try:
+            # 等待连接期间定期检查是否已取消，拿到连接后才算开始运行
+            while job.connection and utils is None:
+                if job.cancelled:
+                    raise Exception("导出已取消")
+                try:
+                    utils = self.pool.acquire(timeout=0.5)
+                except TimeoutError:
+                    continue
+            with self._lock:
+                if job.cancelled:
+                    raise Exception("导出已取消")
+                job.status = 'running'
+                job.started = time.time()
+            self._notify(job)
+            job.result = job.target(job, utils)
+            job.status = 'done'
+        except Exception as e:
+            job.error = str(e)
+            job.status = 'cancelled' if job.cancelled else 'failed'
+        finally:
+            if utils is not None:
+                self.pool.release(utils)
+            job.finished = time.time()
+            with self._lock:
+                self._running -= 1
+            self._notify(job)
+            self._dispatch()
+
+    def cancel(self, job):
+        """取消任务：排队中的任务直接移出队列，运行中的任务在下一批数据前停止"""
+        with self._lock:
+            if not job.active:
+                return False
+            job.cancelled = True
+            if job.exporter is not None:
+                job.exporter.cancelled = True
+            if job.status in ('waiting', 'connecting'):
+                job.status = 'cancelled'
+                job.finished = time.time()
+        self._notify(job)
+        return True
+
+    def clear_finished(self):
+        """从任务列表中移除已结束的任务"""
+        with self._lock:
+            self.jobs = [job for job in self.jobs if job.active]
+
+    def close(self):
+        """取消全部任务，不再接受新任务"""
+        for job in list(self.jobs):
+            self.cancel(job)
+        with self._lock:
+            self._closed = True
+
+
+def _infer_column_kind(values):
+    """根据一列Python值推断存储类型"""
+    types = set(map(type, values))
+    types.discard(type(None))
+    if not types:
+        return 'null'
+    if types == {int}:
+        return 'int'
+    if types <= {int, float}:
+        return 'float'
+    if types <= {Decimal, int}:
+        return 'decimal'
+    if types == {str}:
+        return 'str'
+    if types == {datetime}:
+        # 带时区的时间无法放入datetime64，按普通对象处理
+        if all(v.tzinfo is None for v in values if v is not None):
+            return 'datetime'
+        return 'object'
+    if types == {date}:
+        return 'date'
+    return 'object'
+
+class ColumnPage:
+    """单列的一页数据：类型化数组 + 空值位图（Arrow布局，位为1表示非空）"""
+
+    __slots__ = ('kind', 'values', 'validity', 'length')
+
+    def __init__(self, kind, values, validity, length):
+        self.kind = kind
+        self.values = values
+        self.validity = validity
+        self.length = length
+
+    @classmethod
+    def from_values(cls, values):
+        """由一列Python值构建"""
+        length = len(values)
+        kind = _infer_column_kind(values)
+        objects = np.empty(length, dtype=object)
+        objects[:] = list(values)
+        mask = objects != None  # noqa: E711  逐元素比较
+        validity = np.packbits(mask, bitorder='little')
+
+        if kind in ('int', 'float'):
+            fill = 0 if kind == 'int' else np.nan
+            if not mask.all():
+                objects[~mask] = fill
+            try:
+                arr = objects.astype(np.int64 if kind == 'int' else np.float64)
+            except OverflowError:
+                # 超出int64范围的整数按对象保存
+                kind = 'decimal'
+                objects[~mask] = None
+                arr = objects
+        elif kind == 'datetime':
+            arr = np.array(values, dtype='datetime64[us]')
+        elif kind == 'date':
+            arr = np.array(values, dtype='datetime64[D]')
+        elif kind == 'null':
+            arr = np.zeros(length, dtype=np.int8)
+        else:
+            arr = objects
+        return cls(kind, arr, validity, length)
+
+    def valid_mask(self, idx=None):
+        """返回非空掩码"""
+        mask = np.unpackbits(self.validity, count=self.length, bitorder='little').view(bool)
+        return mask if idx is None else mask[idx]
+
+    def to_pylist(self, idx=None):
+        """转换为Python值列表，空值为None"""
+        values = self.values if idx is None else self.values[idx]
+        result = values.tolist()
+        if self.kind == 'null':
+            return [None] * len(result)
+        mask = self.valid_mask(idx)
+        if not mask.all():
+            for i in np.flatnonzero(~mask).tolist():
+                result[i] = None
+        return result
+
+    def to_bytes(self):
+        """序列化为溢出文件中的列块：空值位图 + 数据"""
+        if self.kind in ('str', 'decimal'):
+            # 变长文本按Arrow方式保存：偏移数组 + UTF-8数据
+            encoded = [b'' if v is None else str(v).encode('utf-8') for v in self.values.tolist()]
+            offsets = np.zeros(self.length + 1, dtype=np.int64)
+            np.cumsum([len(b) for b in encoded], out=offsets[1:])
+            payload = offsets.tobytes() + b''.join(encoded)
+        elif self.values.dtype == object:
+            payload = pickle.dumps(self.values.tolist(), protocol=pickle.HIGHEST_PROTOCOL)
+        else:
+            payload = self.values.tobytes()
+        return self.validity.tobytes() + payload
+
+    @classmethod
+    def from_bytes(cls, kind, length, dtype, data):
+        """从溢出文件中的列块还原"""
+        nvalid = (length + 7) // 8
+        validity = np.frombuffer(data, dtype=np.uint8, count=nvalid)
+        body = memoryview(data)[nvalid:]
+        if kind in ('str', 'decimal'):
+            offsets = np.frombuffer(body, dtype=np.int64, count=length + 1).tolist()
+            blob = bytes(body[(length + 1) * 8:])
+            texts = [blob[start:end].decode('utf-8') for start, end in zip(offsets[:-1], offsets[1:])]
+            values = np.empty(length, dtype=object)
+            if kind == 'decimal':
+                mask = np.unpackbits(validity, count=length, bitorder='little').view(bool).tolist()
+                texts = [Decimal(t) if valid else None for t, valid in zip(texts, mask)]
+            values[:] = texts
+        elif dtype == 'object':
+            values = np.empty(length, dtype=object)
+            values[:] = pickle.loads(body)
+        else:
+            values = np.frombuffer(body, dtype=dtype, count=length)
+        return cls(kind, values, validity, length)
+
+    def slice(self, start, stop):
+        """取[start, stop)行，数据数组为原数组的视图"""
+        mask = self.valid_mask()[start:stop]
+        return ColumnPage(self.kind, self.values[start:stop], np.packbits(mask, bitorder='little'), len(mask))
+
+    @classmethod
+    def concat(cls, pages):
+        """按顺序拼接同一列的多页；类型不一致时（如整数页和小数页）按全部值重新推断类型"""
+        kinds = {page.kind for page in pages} - {'null'}
+        length = sum(page.length for page in pages)
+        if not kinds:
+            return cls('null', np.zeros(length, dtype=np.int8), np.zeros((length + 7) // 8, dtype=np.uint8), length)
+        if len(kinds) > 1:
+            return cls.from_values([v for page in pages for v in page.to_pylist()])
+        kind = kinds.pop()
+        dtype = next(page.values.dtype for page in pages if page.kind == kind)
+        # 全为空的页按目标类型补位，这些位置在空值位图中为0
+        values = np.concatenate([page.values if page.kind == kind else np.zeros(page.length, dtype=dtype)
+                                 if dtype != object else np.full(page.length, None, dtype=object) for page in pages])
+        mask = np.concatenate([page.valid_mask() for page in pages])
+        return cls(kind, values, np.packbits(mask, bitorder='little'), length)
+
+    def to_pandas(self):
+        """转换为pandas列：有空值的整数列为可空Int64，日期时间列的空值为NaT，其他列的空值为None"""
+        mask = self.valid_mask()
+        if self.kind == 'null':
+            return np.full(self.length, None, dtype=object)
+        if mask.all() or self.kind == 'float':
+            return self.values
+        if self.kind == 'int':
+            return pd.arrays.IntegerArray(np.array(self.values), ~mask)
+        values = self.values.copy()
+        values[~mask] = np.datetime64('NaT') if self.kind in ('datetime', 'date') else None
+        return values
+
+    def to_arrow(self):
+        """转换为pyarrow数组；整数、小数和时间列直接引用数据数组和空值位图，不复制"""
+        import pyarrow as pa
+        validity = pa.py_buffer(self.validity)
+        if self.kind in ('int', 'float', 'datetime'):
+            arrow_type = {'int': pa.int64(), 'float': pa.float64(), 'datetime': pa.timestamp('us')}[self.kind]
+            return pa.Array.from_buffers(arrow_type, self.length, [validity, pa.py_buffer(np.ascontiguousarray(self.values))])
+        if self.kind == 'date':
+            days = self.values.astype(np.int32)
+            return pa.Array.from_buffers(pa.date32(), self.length, [validity, pa.py_buffer(days)])
+        if self.kind == 'null':
+            return pa.nulls(self.length)
+        values = self.to_pylist()
+        if self.kind == 'str':
+            return pa.array(values, type=pa.string())
+        if self.kind == 'decimal':
+            values = [Decimal(v) if type(v) is int else v for v in values]
+            try:
+                array = pa.array(values)
+                # 各批次推断的精度不同，统一为最大精度，只保留小数位数
+                return array.cast(pa.decimal128(38, array.type.scale))
+            except (pa.ArrowInvalid, pa.ArrowTypeError, AttributeError):
+                pass
+        try:
+            return pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+
+    def nbytes(self):
+        size = self.values.nbytes + self.validity.nbytes
+        if self.values.dtype == object:
+            # 对象数组只统计指针，字符串本身按长度粗略估算
+            size += sum(len(v) for v in self.values if isinstance(v, str))
+        return size
+
+
+class ColumnBatch:
+    """一批结果行的列式表示（对应Arrow的RecordBatch）：列名 + 每列一个ColumnPage
+
+    取数线程把fetchmany得到的行转换一次，之后预览存储、分片写入进程和CSV/Parquet输出都使用同一组列数组，
+    不再逐行构造Python对象；切片返回原数组的视图，预览存储封页时直接引用批次中的数组。
+    """
+
+    __slots__ = ('columns', 'pages', 'length')
+
+    def __init__(self, columns, pages, length):
+        self.columns = list(columns)
+        self.pages = pages
+        self.length = length
+
+    @classmethod
+    def from_rows(cls, columns, rows):
+        if rows:
+            pages = [ColumnPage.from_values(values) for values in zip(*rows)]
+        else:
+            pages = [ColumnPage.from_values([]) for _ in columns]
+        return cls(columns, pages, len(rows))
+
+    def __len__(self):
+        return self.length
+
+    def nbytes(self):
+        return sum(page.nbytes() for page in self.pages)
+
+    def slice(self, start, stop):
+        stop = min(stop, self.length)
+        return ColumnBatch(self.columns, [page.slice(start, stop) for page in self.pages], max(stop - start, 0))
+
+    @classmethod
+    def concat(cls, batches):
+        if len(batches) == 1:
+            return batches[0]
+        pages = [ColumnPage.concat(column) for column in zip(*(batch.pages for batch in batches))]
+        return cls(batches[0].columns, pages, sum(batch.length for batch in batches))
+
+    def to_rows(self):
+        """转换回行元组，供需要逐个单元格写入的xlsx输出使用"""
+        return list(zip(*(page.to_pylist() for page in self.pages)))
+
+    def to_bytes(self):
+        """序列化为按列的字节块列表，跨进程传递时只需pickle少量bytes对象"""
+        return [(page.kind, page.length, page.values.dtype.str if page.values.dtype != object else 'object', page.to_bytes())
+                for page in self.pages]
+
+    @classmethod
+    def from_bytes(cls, columns, encoded):
+        pages = [ColumnPage.from_bytes(kind, length, dtype, data) for kind, length, dtype, data in encoded]
+        return cls(columns, pages, pages[0].length if pages else 0)
+
+    def to_pandas(self):
+        frame = pd.DataFrame({i: page.to_pandas() for i, page in enumerate(self.pages)}, index=pd.RangeIndex(self.length))
+        frame.columns = self.columns
+        return frame
+
+    def to_arrow(self):
+        """转换为pyarrow.RecordBatch（需要安装pyarrow）"""
+        import pyarrow as pa
+        return pa.RecordBatch.from_arrays([page.to_arrow() for page in self.pages], names=self.columns)
+
+
+class CsvSink:
+    """CSV输出：每批数据由列数组组成DataFrame，交给pandas的CSV写入器整批写出"""
+
+    def __init__(self, path, encoding='utf-8-sig'):
+        self.path = path
+        self.encoding = encoding  # 带BOM，Excel打开时能识别中文
+        self._file = None
+
+    def open(self, columns):
+        self._file = open(self.path, 'w', newline='', encoding=self.encoding)
+        csv.writer(self._file).writerow(columns)
+
+    def write_batch(self, batch):
+        batch.to_pandas().to_csv(self._file, header=False, index=False)
+
+    def close(self, progress_callback=None):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if progress_callback:
+            progress_callback(1, 1)
+
+
+class ParquetSink:
+    """Parquet输出（需要安装pyarrow）：每批数据转换为Arrow记录批次写为一个行组
+
+    列类型由各列第一个非空的批次确定；开头的批次中整列为空时暂缓写入，最多缓存16个批次，
+    仍无法确定类型的列按字符串写入。
+    """
+
+    def __init__(self, path):
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            raise Exception("导出Parquet文件需要安装pyarrow")
+        self.path = path
+        self.columns = None
+        self._writer = None
+        self._schema = None
+        self._pending = []
+
+    def open(self, columns):
+        self.columns = list(columns)
+
+    def write_batch(self, batch):
+        import pyarrow as pa
+        record = batch.to_arrow()
+        if self._writer is None:
+            self._pending.append(record)
+            if len(self._pending) < 16 and any(pa.types.is_null(field.type) for field in record.schema):
+                return
+            self._open_writer()
+        else:
+            self._write(record)
+
+    def _open_writer(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        fields = []
+        for i, name in enumerate(self.columns):
+            types = [record.schema.field(i).type for record in self._pending]
+            known = [t for t in types if not pa.types.is_null(t)]
+            fields.append(pa.field(name, known[0] if known else pa.string()))
+        self._schema = pa.schema(fields)
+        self._writer = pq.ParquetWriter(self.path, self._schema)
+        pending, self._pending = self._pending, []
+        for record in pending:
+            self._write(record)
+
+    def _write(self, record):
+        import pyarrow as pa
+        if record.schema != self._schema:
+            try:
+                record = record.cast(self._schema)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError) as e:
+                raise Exception(f"Parquet各批次的列类型不一致: {e}")
+        self._writer.write_batch(record)
+
+    def close(self, progress_callback=None):
+        if self.columns is not None and self._writer is None:
+            self._open_writer()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if progress_callback:
+            progress_callback(1, 1)
+
+
+def create_sink(output_file):
+    """按扩展名创建列式输出：.csv为CsvSink，.parquet为ParquetSink，其他格式返回None（写xlsx）"""
+    extension = os.path.splitext(output_file)[1].lower()
+    if extension == '.csv':
+        return CsvSink(output_file)
+    if extension == '.parquet':
+        return ParquetSink(output_file)
+    return None
+
+class SpillFile:
+    """结果集溢出文件：按页追加写入列数据，通过内存映射读取"""
+
+    def __init__(self, directory=None):
+        self.directory = tempfile.mkdtemp(prefix='hana_preview_', dir=directory or None)
+        self.path = os.path.join(self.directory, 'pages.bin')
+        self._file = open(self.path, 'w+b')
+        self._size = 0
+        self._mmap = None
+        self._counter = 0
+
+    def append(self, data):
+        """追加数据，返回其在文件中的偏移"""
+        offset = self._size
+        self._file.seek(offset)
+        self._file.write(data)
+        self._size += len(data)
+        return offset
+
+    def read(self, offset, length):
+        """读取一段数据，文件增长后重新映射"""
+        if self._mmap is None or len(self._mmap) < offset + length:
+            self._file.flush()
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap[offset:offset + length]
+
+    def new_path(self, prefix):
+        """在溢出目录中生成一个新的文件路径"""
+        self._counter += 1
+        return os.path.join(self.directory, f"{prefix}_{self._counter}.bin")
+
+    def close(self):
+        """关闭并删除临时文件"""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if not self._file.closed:
+            self._file.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+class ResultStore:
+    """列式结果集存储
+
+    数据按页保存，每页每列是一个类型化numpy数组加空值位图；页起始行号构成偏移索引，
+    用于按行号定位。排序基于argsort，每列的排序置换会被缓存，之后切换升降序、
+    复制和重新渲染都只是对置换数组取切片。尚未凑满一页的行暂存在尾部缓冲区中。
+
+    指定memory_rows后，超过该行数的页会写入临时溢出文件，内存中只保留一个
+    小的LRU页缓存；排序置换也保存为内存映射文件。用完后需要调用close()删除临时文件。
+    """
+
+    page_rows = 10000
+    FILTER_OPS = ('=', '!=', '>', '>=', '<', '<=', '包含', '为空', '非空')
+
+    def __init__(self, columns, memory_rows=None, spill_dir=None, cache_pages=8):
+        self.columns = list(columns)
+        self.memory_rows = memory_rows
+        self.spill_dir = spill_dir
+        self.cache_pages = cache_pages
+        self._spill = None
+        self._spill_index = {}  # 页号 -> 每列的(偏移, 长度, 类型, 数组类型)
+        self._page_cache = OrderedDict()
+        self.spilled_rows = 0
+        self._pages = []  # 每页为ColumnPage列表，已溢出的页为None
+        self._page_starts = np.zeros(0, dtype=np.int64)  # 每页起始行号
+        self._sealed_rows = 0
+        self._tail = []  # 尚未封页的ColumnBatch
+        self._tail_rows = 0
+        self._sort_cache = {}  # 列索引 -> 升序置换
+        self._index_cache = {}  # 按需构建的有序索引、哈希索引和文本索引
+        self._search_cache = OrderedDict()  # (列索引, 搜索词) -> 命中行号
+        self._view = None  # 当前显示顺序（物理行号数组），None表示原始顺序
+        self._filter_mask = None
+        self.filters = []
+        self.search_text = ''
+        self.sort_col = None
+        self.sort_reverse = False
+
+    def __len__(self):
+        """当前显示的行数（筛选后）"""
+        if self._view is not None:
+            return len(self._view)
+        return self.total_rows
+
+    @property
+    def total_rows(self):
+        """已加载的总行数"""
+        return self._sealed_rows + self._tail_rows
+
+    @property
+    def filtered(self):
+        return self._filter_mask is not None
+
+    def __getitem__(self, key):
+        """按显示顺序取行，切片返回用于界面显示的元组列表"""
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            positions = range(start, stop, step)
+            return [tuple('' if v is None else v for v in row) for row in self.take(positions)]
+        return self.take([key])[0]
+
+    def append_rows(self, rows):
+        """追加一批行"""
+        if rows:
+            self.append_batch(ColumnBatch.from_rows(self.columns, rows))
+
+    def append_batch(self, batch):
+        """追加一个ColumnBatch；凑满一页时直接引用批次中的列数组封页"""
+        if not batch.length:
+            return
+        old_len = self.total_rows
+        if self._filter_mask is not None:
+            filter_cols = [col_idx for col_idx, op, _ in self.filters if op not in ('包含', '为空', '非空')]
+            old_kinds = [self._key_kind(kinds) if kinds - {'null'} else None
+                         for kinds in map(self._column_kinds, filter_cols)]
+        self._tail.append(batch)
+        self._tail_rows += batch.length
+        if self._tail_rows >= self.page_rows:
+            merged = ColumnBatch.concat(self._tail)
+            full = merged.length - merged.length % self.page_rows
+            for start in range(0, full, self.page_rows):
+                self._seal(merged.slice(start, start + self.page_rows))
+            self._tail = [merged.slice(full, merged.length)] if full < merged.length else []
+            self._tail_rows = merged.length - full
+        self._index_cache.clear()
+        self._clear_sort_cache()
+        self._search_cache.clear()
+        if self._filter_mask is not None:
+            # 有筛选条件时只对新追加的行求值；新数据改变了筛选列的键类型时才对全部数据重新筛选
+            # （之前全为空值的列不受影响，比较条件在空值上总是不命中）
+            new_kinds = [self._key_kind(self._column_kinds(c)) for c in filter_cols]
+            if all(old in (None, new) for old, new in zip(old_kinds, new_kinds)):
+                hits = self._batch_filter_mask(batch, new_kinds)
+                self._filter_mask = np.concatenate([self._filter_mask, hits])
+                self._view = np.concatenate([self._view, old_len + np.flatnonzero(hits)])
+            else:
+                self._refresh_filter()
+        elif self._view is not None:
+            # 已排序时新行追加在末尾，重新点击表头可参与排序
+            self._view = np.concatenate([self._view, np.arange(old_len, self.total_rows, dtype=np.int64)])
+
+    def flush(self):
+        """把尾部缓冲区封为一页"""
+        if self._tail:
+            self._seal(ColumnBatch.concat(self._tail))
+            self._tail = []
+            self._tail_rows = 0
+
+    def _seal(self, batch):
+        page = batch.pages
+        if self.memory_rows is not None and self._sealed_rows >= self.memory_rows:
+            self._spill_page(len(self._pages), page)
+            self._pages.append(None)
+            self.spilled_rows += batch.length
+        else:
+            self._pages.append(page)
+        self._page_starts = np.append(self._page_starts, self._sealed_rows)
+        self._sealed_rows += batch.length
+
+    def _spill_page(self, page_id, page):
+        """把一页写入溢出文件并记录每列的偏移"""
+        if self._spill is None:
+            self._spill = SpillFile(self.spill_dir)
+        entries = []
+        for column in page:
+            data = column.to_bytes()
+            offset = self._spill.append(data)
+            entries.append((offset, len(data), column.kind, column.values.dtype.str if column.values.dtype != object else 'object'))
+        self._spill_index[page_id] = entries
+
+    def _load_column(self, page_id, col_idx):
+        offset, length, kind, dtype = self._spill_index[page_id][col_idx]
+        rows = self._page_length(page_id)
+        return ColumnPage.from_bytes(kind, rows, dtype, self._spill.read(offset, length))
+
+    def _page_length(self, page_id):
+        end = self._page_starts[page_id + 1] if page_id + 1 < len(self._page_starts) else self._sealed_rows
+        return int(end - self._page_starts[page_id])
+
+    def _page(self, page_id):
+        """取一页数据，已溢出的页经LRU缓存从文件读取"""
+        page = self._pages[page_id]
+        if page is not None:
+            return page
+        page = self._page_cache.get(page_id)
+        if page is None:
+            page = [self._load_column(page_id, c) for c in range(len(self.columns))]
+            self._page_cache[page_id] = page
+            while len(self._page_cache) > self.cache_pages:
+                self._page_cache.popitem(last=False)
+        else:
+            self._page_cache.move_to_end(page_id)
+        return page
+
+    def _column(self, page_id, col_idx):
+        """取一页中的单列，整列扫描时不污染页缓存"""
+        page = self._pages[page_id] or self._page_cache.get(page_id)
+        if page is not None:
+            return page[col_idx]
+        return self._load_column(page_id, col_idx)
+
+    def _physical(self, positions):
+        """显示位置 -> 物理行号"""
+        positions = np.asarray(positions, dtype=np.int64)
+        if self._view is None:
+            return positions
+        return self._view[positions]
+
+    def take(self, positions):
+        """按显示位置批量取出原始行元组"""
+        physical = self._physical(positions)
+        count = len(physical)
+        if not count:
+            return []
+        out = [np.empty(count, dtype=object) for _ in self.columns]
+
+        # 尾部缓冲区中的行：先把各批次合并为一个，之后的读取直接使用
+        in_tail = physical >= self._sealed_rows
+        if in_tail.any():
+            sel = np.flatnonzero(in_tail)
+            self._tail = [ColumnBatch.concat(self._tail)]
+            local = physical[sel] - self._sealed_rows
+            for c, column in enumerate(self._tail[0].pages):
+                out[c][sel] = column.to_pylist(local)
+
+        # 已封页的行按页分组后成批转换
+        sel = np.flatnonzero(~in_tail)
+        if len(sel):
+            page_ids = np.searchsorted(self._page_starts, physical[sel], side='right') - 1
+            order = np.argsort(page_ids, kind='stable')
+            sel, page_ids = sel[order], page_ids[order]
+            bounds = np.flatnonzero(np.diff(page_ids)) + 1
+            for group in np.split(np.arange(len(sel)), bounds):
+                page_id = page_ids[group[0]]
+                rows_sel = sel[group]
+                local = physical[rows_sel] - self._page_starts[page_id]
+                for c, column in enumerate(self._page(page_id)):
+                    out[c][rows_sel] = column.to_pylist(local)
+        return list(zip(*(col.tolist() for col in out)))
+
+    def iter_batches(self, batch_rows=None):
+        """按加载顺序逐批返回全部行的ColumnBatch，不受排序和筛选影响，供导出使用
+
+        不使用页缓存，也不合并尾部缓冲区，没有新数据追加时可以在后台线程中读取。
+        """
+        batch_rows = batch_rows or self.page_rows
+        pages, tail = len(self._pages), list(self._tail)
+        for page_id in range(pages + len(tail)):
+            if page_id < pages:
+                # 已溢出的页逐页从文件读取
+                batch = ColumnBatch(self.columns, [self._column(page_id, c) for c in range(len(self.columns))],
+                                    self._page_length(page_id))
+            else:
+                batch = tail[page_id - pages]
+            for start in range(0, batch.length, batch_rows):
+                yield batch.slice(start, start + batch_rows)
+
+    @staticmethod
+    def _key_kind(kinds):
+        """由各页的列类型确定整列排序键的类型"""
+        kinds = set(kinds)
+        kinds.discard('null')
+        if kinds and kinds <= {'int', 'float'}:
+            return 'int' if kinds == {'int'} else 'float'
+        if kinds and kinds <= {'int', 'float', 'decimal'}:
+            return 'float'
+        if kinds in ({'datetime'}, {'date'}):
+            return kinds.pop()
+        # 字符串及混合类型统一按文本比较
+        return 'text'
+
+    def _column_kinds(self, col_idx):
+        """已封页和尾部缓冲区中该列的类型，已溢出的页从溢出索引读取，不加载数据"""
+        kinds = {page[col_idx].kind if page is not None else self._spill_index[page_id][col_idx][2]
+                 for page_id, page in enumerate(self._pages)}
+        return kinds | {batch.pages[col_idx].kind for batch in self._tail}
+
+    @staticmethod
+    def _column_keys(columns, key_kind):
+        """把若干列页按指定键类型转换为排序键和非空掩码"""
+        valid = np.concatenate([column.valid_mask() for column in columns])
+
+        def gather(convert):
+            return np.concatenate([convert(column) for column in columns])
+
+        if key_kind in ('int', 'float'):
+            dtype = np.int64 if key_kind == 'int' else np.float64
+
+            def to_number(column):
+                if column.kind == 'null':
+                    return np.zeros(column.length, dtype)
+                if column.kind == 'decimal':
+                    return np.fromiter((0.0 if v is None else float(v) for v in column.values.tolist()),
+                                       dtype=np.float64, count=column.length)
+                return column.values.astype(dtype)
+            keys = gather(to_number)
+        elif key_kind in ('datetime', 'date'):
+            keys = gather(lambda c: np.zeros(c.length, np.int64) if c.kind == 'null' else c.values.view(np.int64))
+        else:
+            def to_text(column):
+                arr = np.empty(column.length, dtype=object)
+                if column.kind == 'str':
+                    arr[:] = column.values
+                    arr[~column.valid_mask()] = ''
+                else:
+                    arr[:] = ['' if v is None else str(v) for v in column.to_pylist()]
+                return arr
+            keys = gather(to_text)
+        return keys, valid
+
+    def _sort_key(self, col_idx):
+        """生成整列的排序键、非空掩码和键类型"""
+        columns = [self._column(page_id, col_idx) for page_id in range(len(self._pages))]
+        key_kind = self._key_kind(column.kind for column in columns)
+        keys, valid = self._column_keys(columns, key_kind)
+        return keys, valid, key_kind
+
+    def sort_permutation(self, col_idx):
+        """返回按指定列升序（空值在后）的置换数组，结果会被缓存"""
+        self.flush()
+        perm = self._sort_cache.get(col_idx)
+        if perm is None:
+            if not self._pages:
+                return np.zeros(0, dtype=np.int64)
+            keys, valid, _ = self._sort_key(col_idx)
+            perm = self._cache_permutation(col_idx, keys, valid)
+        return perm
+
+    def _cache_permutation(self, col_idx, keys, valid):
+        perm = np.argsort(keys, kind='stable')
+        # 稳定地把空值移到末尾
+        perm = perm[np.argsort(~valid[perm], kind='stable')]
+        if self._spill is not None:
+            # 数据已溢出时置换数组也放到内存映射文件中
+            mapped = np.memmap(self._spill.new_path(f"sort_{col_idx}"), dtype=np.int64, mode='w+', shape=perm.shape)
+            mapped[:] = perm
+            mapped.flush()
+            perm = mapped
+        self._sort_cache[col_idx] = perm
+        return perm
+
+    def _clear_sort_cache(self):
+        """清空排序置换缓存，放在内存映射文件中的置换数组同时删除文件
+
+        当前显示顺序如果引用了这些映射，先复制到内存中；有序索引会引用置换数组，需先清空。
+        """
+        mapped = [perm for perm in self._sort_cache.values() if isinstance(perm, np.memmap)]
+        if self._view is not None and any(np.may_share_memory(self._view, perm) for perm in mapped):
+            self._view = np.array(self._view)
+        paths = [perm.filename for perm in mapped]
+        del mapped
+        self._sort_cache.clear()
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def sort(self, col_idx, reverse=False):
+        """按列排序，降序时直接使用置换数组的反向视图"""
+        self.sort_col = col_idx
+        self.sort_reverse = reverse
+        self._rebuild_view()
+
+    def clear_sort(self):
+        self.sort_col = None
+        self.sort_reverse = False
+        self._rebuild_view()
+
+    def _rebuild_view(self):
+        """根据排序和筛选状态重新生成显示顺序"""
+        if self.sort_col is None:
+            self._view = None if self._filter_mask is None else np.flatnonzero(self._filter_mask)
+            return
+        perm = self.sort_permutation(self.sort_col)
+        if self.sort_reverse:
+            perm = perm[::-1]
+        self._view = perm if self._filter_mask is None else perm[self._filter_mask[perm]]
+
+    def _sorted_index(self, col_idx):
+        """有序索引：非空行按列值升序排列的行号及对应的键，用于范围查询"""
+        index = self._index_cache.get(('sorted', col_idx))
+        if index is None:
+            keys, valid, key_kind = self._sort_key(col_idx)
+            perm = self._sort_cache.get(col_idx)
+            if perm is None:
+                perm = self._cache_permutation(col_idx, keys, valid)
+            rows = np.asarray(perm[:int(valid.sum())])
+            index = (rows, keys[rows], key_kind)
+            self._index_cache[('sorted', col_idx)] = index
+        return index
+
+    def _hash_index(self, col_idx):
+        """哈希索引：列值 -> 有序索引中的(起, 止)区间，用于等值查询"""
+        index = self._index_cache.get(('hash', col_idx))
+        if index is None:
+            _, sorted_keys, _ = self._sorted_index(col_idx)
+            if len(sorted_keys):
+                starts = np.concatenate([[0], np.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1])
+                ends = np.append(starts[1:], len(sorted_keys))
+                index = dict(zip(sorted_keys[starts].tolist(), zip(starts.tolist(), ends.tolist())))
+            else:
+                index = {}
+            self._index_cache[('hash', col_idx)] = index
+        return index
+
+    def _text_index(self, col_idx):
+        """文本索引：把一列（col_idx为None时为整行）的小写显示文本拼成一个字符串，
+        记录每行的起始偏移，子串搜索由str.find在C层完成"""
+        index = self._index_cache.get(('text', col_idx))
+        if index is None:
+            col_range = range(len(self.columns)) if col_idx is None else [col_idx]
+            col_texts = []
+            for c in col_range:
+                texts = []
+                for page_id in range(len(self._pages)):
+                    texts.extend('' if v is None else str(v).lower() for v in self._column(page_id, c).to_pylist())
+                col_texts.append(texts)
+            texts = col_texts[0] if len(col_texts) == 1 else ['\x1f'.join(values) for values in zip(*col_texts)]
+            offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+            np.cumsum(np.fromiter(map(len, texts), dtype=np.int64, count=len(texts)) + 1, out=offsets[1:])
+            index = ('\x1e'.join(texts) + '\x1e', offsets)
+            self._index_cache[('text', col_idx)] = index
+        return index
+
+    def _search_rows(self, col_idx, needle):
+        """子串搜索（不区分大小写），返回命中的物理行号；结果会被缓存，
+        输入逐字加长时只在上一次的命中行中继续查找"""
+        needle = needle.lower()
+        cached = self._search_cache.get((col_idx, needle))
+        if cached is not None:
+            self._search_cache.move_to_end((col_idx, needle))
+            return cached
+
+        blob, offsets = self._text_index(col_idx)
+        candidates = None
+        for (c, previous), rows in self._search_cache.items():
+            if c == col_idx and previous in needle and (candidates is None or len(rows) < len(candidates)):
+                candidates = rows
+        if candidates is not None and len(candidates) * 4 < len(offsets):
+            starts, ends = offsets[candidates].tolist(), offsets[candidates + 1].tolist()
+            hits = np.fromiter((needle in blob[a:b] for a, b in zip(starts, ends)), dtype=bool, count=len(candidates))
+            rows = candidates[hits]
+        else:
+            found = []
+            pos = blob.find(needle)
+            while pos != -1:
+                row = int(np.searchsorted(offsets, pos, side='right')) - 1
+                found.append(row)
+                pos = blob.find(needle, int(offsets[row + 1]))
+            rows = np.array(found, dtype=np.int64)
+
+        self._search_cache[(col_idx, needle)] = rows
+        while len(self._search_cache) > 32:
+            self._search_cache.popitem(last=False)
+        return rows
+
+    @staticmethod
+    def _coerce_filter_value(key_kind, text):
+        """把界面输入的筛选值转换为索引键的类型"""
+        if key_kind in ('int', 'float'):
+            value = float(text)
+            return int(value) if key_kind == 'int' and value.is_integer() else value
+        if key_kind == 'datetime':
+            return int(np.datetime64(text.strip(), 'us').astype(np.int64))
+        if key_kind == 'date':
+            return int(np.datetime64(text.strip(), 'D').astype(np.int64))
+        return text
+
+    def _predicate_mask(self, col_idx, op, value, total):
+        """计算单个筛选条件命中的行"""
+        mask = np.zeros(total, dtype=bool)
+        if op == '包含':
+            mask[self._search_rows(col_idx, value)] = True
+            return mask
+
+        rows, sorted_keys, key_kind = self._sorted_index(col_idx)
+        if op in ('为空', '非空'):
+            mask[rows] = True
+            return mask if op == '非空' else ~mask
+        try:
+            target = self._coerce_filter_value(key_kind, value)
+        except ValueError:
+            raise ValueError(f"筛选值 {value} 与列 {self.columns[col_idx]} 的类型不匹配")
+
+        if op in ('=', '!='):
+            bounds = self._hash_index(col_idx).get(target)
+            if bounds:
+                mask[rows[bounds[0]:bounds[1]]] = True
+            if op == '!=':
+                not_null = np.zeros(total, dtype=bool)
+                not_null[rows] = True
+                mask = not_null & ~mask
+        elif op in ('>', '>='):
+            mask[rows[np.searchsorted(sorted_keys, target, side='right' if op == '>' else 'left'):]] = True
+        elif op in ('<', '<='):
+            mask[rows[:np.searchsorted(sorted_keys, target, side='left' if op == '<' else 'right')]] = True
+        else:
+            raise ValueError(f"不支持的筛选运算符: {op}")
+        return mask
+
+    def _batch_filter_mask(self, batch, key_kinds):
+        """在一个新追加的批次上逐行计算筛选条件，语义与_predicate_mask一致；
+        key_kinds为各比较条件所在列的键类型"""
+        mask = np.ones(batch.length, dtype=bool)
+        key_kinds = iter(key_kinds)
+        for col_idx, op, value in self.filters:
+            column = batch.pages[col_idx]
+            if op == '包含':
+                mask &= self._batch_search(batch, [col_idx], value)
+            elif op in ('为空', '非空'):
+                valid = column.valid_mask()
+                mask &= valid if op == '非空' else ~valid
+            else:
+                key_kind = next(key_kinds)
+                try:
+                    target = self._coerce_filter_value(key_kind, value)
+                except ValueError:
+                    raise ValueError(f"筛选值 {value} 与列 {self.columns[col_idx]} 的类型不匹配")
+                keys, valid = self._column_keys([column], key_kind)
+                if op == '=':
+                    hits = keys == target
+                elif op == '!=':
+                    hits = keys != target
+                elif op == '>':
+                    hits = keys > target
+                elif op == '>=':
+                    hits = keys >= target
+                elif op == '<':
+                    hits = keys < target
+                elif op == '<=':
+                    hits = keys <= target
+                else:
+                    raise ValueError(f"不支持的筛选运算符: {op}")
+                mask &= valid & np.asarray(hits, dtype=bool)
+        if self.search_text:
+            mask &= self._batch_search(batch, range(len(self.columns)), self.search_text)
+        return mask
+
+    @staticmethod
+    def _batch_search(batch, col_range, needle):
+        """在批次的指定列上做子串搜索，拼接方式与_text_index一致"""
+        needle = needle.lower()
+        col_texts = [['' if v is None else str(v).lower() for v in batch.pages[c].to_pylist()] for c in col_range]
+        texts = col_texts[0] if len(col_texts) == 1 else ['\x1f'.join(values) for values in zip(*col_texts)]
+        return np.fromiter((needle in text for text in texts), dtype=bool, count=batch.length)
+
+    def set_filter(self, filters=None, search=None):
+        """设置筛选条件
+
+        filters为(列索引, 运算符, 值)列表，search为对所有列的子串搜索，条件之间为"且"关系。
+        所需索引在第一次使用时构建并缓存，之后重复筛选不再扫描数据。
+        """
+        self.filters = list(filters or [])
+        self.search_text = (search or '').strip()
+        self._refresh_filter()
+
+    def clear_filter(self):
+        self.set_filter()
+
+    def _refresh_filter(self):
+        self.flush()
+        if not self.filters and not self.search_text:
+            self._filter_mask = None
+        else:
+            total = self.total_rows
+            mask = np.ones(total, dtype=bool)
+            if total:
+                for col_idx, op, value in self.filters:
+                    mask &= self._predicate_mask(col_idx, op, value, total)
+                if self.search_text:
+                    found = np.zeros(total, dtype=bool)
+                    found[self._search_rows(None, self.search_text)] = True
+                    mask &= found
+            self._filter_mask = mask
+        self._rebuild_view()
+
+    def nbytes(self):
+        """估算占用内存（不含溢出文件）"""
+        pages = [page for page in self._pages if page is not None] + list(self._page_cache.values())
+        size = sum(column.nbytes() for page in pages for column in page)
+        return size + sum(perm.nbytes for perm in self._sort_cache.values() if not isinstance(perm, np.memmap))
+
+    def close(self):
+        """释放缓存并删除溢出文件"""
+        self._page_cache.clear()
+        self._view = None
+        self._index_cache.clear()
+        self._clear_sort_cache()
+        self._search_cache.clear()
+        self._filter_mask = None
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+
+class QueryHistory:
+    """本地SQLite查询历史
+
+    每次执行记录一行：语句原文、规范化文本及其哈希、参数、执行和取数耗时、行数、字节数，
+    导出另外记录导出方式、输出文件和吞吐量。语句原文建立FTS5全文索引用于搜索（SQLite不支持
+    FTS5时退化为LIKE），按规范化文本的哈希汇总找出最慢的查询。可以在多个线程中同时记录。
+    """
+
+    _NORMALIZE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/|\b\d+(?:\.\d+)?\b|\s+", re.S)
+
+    def __init__(self, path=None, max_rows=None):
+        self.path = os.getenv("QUERY_HISTORY_DB", "query_history.db") if path is None else path
+        self.max_rows = int(os.getenv("QUERY_HISTORY_MAX_ROWS", 100000)) if max_rows is None else max_rows
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS history (
+                    id INTEGER PRIMARY KEY,
+                    executed_at TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    sql_text TEXT NOT NULL,
+                    normalized TEXT NOT NULL,
+                    sql_hash TEXT NOT NULL,
+                    params TEXT,
+                    execute_seconds REAL,
+                    fetch_seconds REAL,
+                    total_seconds REAL,
+                    row_count INTEGER,
+                    bytes INTEGER,
+                    export_mode TEXT,
+                    output TEXT,
+                    rows_per_second REAL,
+                    error TEXT
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS history_hash ON history (sql_hash, id)")
+            self.fts = True
+            try:
+                self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5("
+                                   "sql_text, content='history', content_rowid='id')")
+                self._conn.execute("CREATE TRIGGER IF NOT EXISTS history_ai AFTER INSERT ON history BEGIN "
+                                   "INSERT INTO history_fts (rowid, sql_text) VALUES (new.id, new.sql_text); END")
+                self._conn.execute("CREATE TRIGGER IF NOT EXISTS history_ad AFTER DELETE ON history BEGIN "
+                                   "INSERT INTO history_fts (history_fts, rowid, sql_text) "
+                                   "VALUES ('delete', old.id, old.sql_text); END")
+            except sqlite3.OperationalError:
+                self.fts = False
+            if self.max_rows > 0:
+                self._conn.execute("DELETE FROM history WHERE id <= (SELECT MAX(id) FROM history) - ?", (self.max_rows,))
+
+    @classmethod
+    def normalize(cls, sql):
+        """去掉注释，字符串和数字常量替换为?并合并空白，常量不同的同一语句得到相同的文本"""
+        def replace(match):
+            token = match.group()
+            if token.startswith('"'):
+                return token
+            if token.startswith('--') or token.startswith('/*') or token.isspace():
+                return ' '
+            return '?'
+        return re.sub(r'\s+', ' ', cls._NORMALIZE.sub(replace, sql.strip().rstrip(';'))).strip()
+
+    def record(self, kind, sql, params=None, execute_seconds=None, fetch_seconds=None, rows=None, nbytes=None,
+               export_mode=None, output=None, error=None):
+        """记录一次执行，kind为query或export；记录失败只打印错误，不影响查询和导出"""
+        normalized = self.normalize(sql)
+        timings = [t for t in (execute_seconds, fetch_seconds) if t is not None]
+        total = sum(timings) if timings else None
+        rate = rows / (fetch_seconds or total) if rows and (fetch_seconds or total) else None
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT INTO history (executed_at, kind, sql_text, normalized, sql_hash, params, execute_seconds, "
+                    "fetch_seconds, total_seconds, row_count, bytes, export_mode, output, rows_per_second, error) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (datetime.now().isoformat(sep=' ', timespec='seconds'), kind, sql, normalized,
+                     hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16],
+                     json.dumps(list(params), ensure_ascii=False, default=str) if params else None,
+                     execute_seconds, fetch_seconds, total, rows, nbytes, export_mode, output, rate, error))
+        except sqlite3.Error as e:
+            print(f"记录查询历史失败: {e}")
+
+    def search(self, text=None, limit=200):
+        """按语句文本搜索历史，最新的在前；text为空时返回最近的记录"""
+        words = re.findall(r'\w+', text or '')
+        with self._lock:
+            if not words:
+                return self._conn.execute("SELECT * FROM history ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+            if self.fts:
+                # 每个词按前缀匹配，词之间为"且"关系
+                match = ' '.join(f'"{word}"*' for word in words)
+                return self._conn.execute(
+                    "SELECT h.* FROM history_fts JOIN history h ON h.id = history_fts.rowid "
+                    "WHERE history_fts MATCH ? ORDER BY h.id DESC LIMIT ?", (match, limit)).fetchall()
+            where = ' AND '.join("sql_text LIKE ?" for _ in words)
+            return self._conn.execute(f"SELECT * FROM history WHERE {where} ORDER BY id DESC LIMIT ?",
+                                      [f"%{word}%" for word in words] + [limit]).fetchall()
+
+    def slowest(self, limit=50):
+        """按规范化语句汇总成功的执行，按平均耗时从高到低排列；最近一次耗时明显高于平均值时可能是性能退化"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT sql_hash, normalized, COUNT(*) AS runs, AVG(total_seconds) AS avg_seconds, "
+                "MAX(total_seconds) AS max_seconds, AVG(row_count) AS avg_rows, MAX(executed_at) AS last_run, "
+                "(SELECT total_seconds FROM history last WHERE last.sql_hash = g.sql_hash AND last.error IS NULL "
+                "ORDER BY last.id DESC LIMIT 1) AS last_seconds, "
+                "(SELECT sql_text FROM history last WHERE last.sql_hash = g.sql_hash "
+                "ORDER BY last.id DESC LIMIT 1) AS sql_text "
+                "FROM history g WHERE error IS NULL AND total_seconds IS NOT NULL "
+                "GROUP BY sql_hash ORDER BY avg_seconds DESC LIMIT ?", (limit,)).fetchall()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()